@@ -2,18 +2,21 @@
 API 依赖项
 """
 from typing import Generator, Optional
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 
-from app.core.database import get_db
-from app.core.security import decode_access_token
+from app.core.database import get_db, SessionLocal
+from app.core.security import decode_access_token, decode_file_token
 from app.models.user import User, UserStatus
 from app.schemas.user import UserInDB
 
 # OAuth2 密码模式（令牌 URL）
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
+# 不强制要求 Authorization 头（EventSource 无法设置请求头，允许通过查询参数传递令牌）
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login", auto_error=False)
+
 
 def get_current_user(
     db: Session = Depends(get_db),
@@ -85,6 +88,52 @@ def get_current_active_user(
     return current_user
 
 
+def get_stream_user(
+    db: Session = Depends(get_db),
+    header_token: Optional[str] = Depends(optional_oauth2_scheme),
+    token: Optional[str] = Query(None, description="JWT 令牌（EventSource、播放器等无法设置 Authorization 头时使用）")
+) -> User:
+    """
+    获取事件流（SSE）、播放列表与文件下载的当前激活用户
+
+    优先使用 Authorization 头，其次使用 ?token= 查询参数；
+    只在建立连接时认证一次
+
+    Raises:
+        HTTPException: 认证失败或用户未激活
+    """
+    access_token = header_token or token
+    if not access_token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="无法验证凭据",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return get_current_active_user(get_current_user(db, access_token))
+
+
+def get_signed_user(db: Session, signature: str, resource: str) -> User:
+    """
+    按资源签名（见 app.core.security.create_file_token）获取当前激活用户
+
+    Raises:
+        HTTPException: 签名无效、已过期或用户未激活
+    """
+    user_id = decode_file_token(signature, resource)
+    user = db.query(User).filter(User.id == user_id).first() if user_id is not None else None
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="签名无效或已过期"
+        )
+    if user.status != UserStatus.ACTIVE:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="用户已被禁用"
+        )
+    return get_current_active_user(user)
+
+
 def get_current_superuser(
     current_user: User = Depends(get_current_user)
 ) -> User:
@@ -122,10 +171,11 @@ def check_user_quota(user: User, quota_amount: int = 1) -> bool:
     Raises:
         HTTPException: 配额不足
     """
-    if not user.has_quota():
+    if not user.has_quota(quota_amount):
+        needed = f"，本次需要：{quota_amount}" if quota_amount > 1 else ""
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"配额不足，请升级会员或明天再试。今日已用：{user.used_quota}/{user.daily_quota if user.daily_quota > 0 else '无限'}"
+            detail=f"配额不足，请升级会员或明天再试。今日已用：{user.used_quota}/{user.daily_quota if user.daily_quota > 0 else '无限'}{needed}"
         )
     return True
 
@@ -142,3 +192,28 @@ def consume_user_quota(user: User, quota_amount: int = 1) -> bool:
         bool: 是否成功消耗
     """
     return user.consume_quota(quota_amount)
+
+
+def consume_user_quota_by_id(user_id: int, quota_amount: int = 1) -> bool:
+    """
+    在独立的数据库会话中消耗配额
+
+    用于流式响应：请求依赖注入的会话在响应体发送前已关闭，
+    需要在生成结束后单独提交
+
+    Args:
+        user_id: 用户ID
+        quota_amount: 需要消耗的配额数量
+
+    Returns:
+        bool: 是否成功消耗
+    """
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is None or not user.consume_quota(quota_amount):
+            return False
+        db.commit()
+        return True
+    finally:
+        db.close()
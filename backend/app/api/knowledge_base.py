@@ -1,16 +1,39 @@
 """
-知识库相关 API 路由（简化版 - 暂不含向量检索）
+知识库相关 API 路由
 """
 import os
-import aiofiles
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+import asyncio
+from typing import Callable, List, Tuple
+from fastapi import APIRouter, Depends, HTTPException, status, Request
 from sqlalchemy.orm import Session
+from loguru import logger
 
 from app.core.database import get_db
 from app.core.config import settings
 from app.models.user import User
 from app.models.knowledge_base import KnowledgeBase, KnowledgeDocument
+from app.services.ingestion import (
+    adjust_kb_counters,
+    delete_document_chunks,
+    delete_knowledge_base_chunks,
+)
+from app.services.ingestion_worker import schedule_document
+from app.services.retrieval import hybrid_search, build_context_prompt
+from app.services.file_storage import (
+    receive_upload,
+    upload_tmp_dir,
+    blob_path,
+    acquire_blob,
+    install_blob,
+    release_blob,
+    purge_blob,
+    UploadError,
+    UploadTooLargeError,
+)
+from app.services.file_delivery import file_response
+from app.services.vector_store import get_vector_store, INDEX_IVF
+from app.services.admission import priority_for, AdmissionTimeoutError
+from app.services.resilience import CircuitOpenError
 from app.schemas.knowledge_base import (
     KnowledgeBaseCreate,
     KnowledgeBaseUpdate,
@@ -21,12 +44,73 @@ from app.schemas.knowledge_base import (
     KnowledgeQueryRequest,
     KnowledgeQueryResponse,
 )
-from app.api.deps import get_current_active_user, check_user_quota, consume_user_quota
+from app.api.deps import (
+    get_current_active_user,
+    get_stream_user,
+    check_user_quota,
+    consume_user_quota,
+    consume_user_quota_by_id,
+)
+from app.api.sse import sse_event, sse_response
 
 router = APIRouter(prefix="/knowledge-bases", tags=["知识库"])
 
-# Milvus 向量数据库已禁用（Railway 部署不需要）
-MILVUS_AVAILABLE = False
+# 允许上传的文档类型
+DOCUMENT_EXTENSIONS = {".txt", ".pdf", ".doc", ".docx", ".md"}
+
+# 上传接口的请求体说明（流式解析，不经过 UploadFile）
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+
+# 向量检索使用 app.services.vector_store（默认本地 NumPy 存储，无需 Milvus）
+
+# 后台任务引用，防止任务在完成前被垃圾回收
+_background_tasks = set()
+
+
+def _schedule(coro) -> None:
+    """在事件循环中调度后台任务"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def _release_document_files(db: Session, docs: List[KnowledgeDocument]) -> Callable[[], None]:
+    """
+    释放文档引用的文件（不提交事务），返回提交后执行的清理函数
+
+    内容寻址存储减少引用计数，引用归零的文件与旧版本按路径保存的文件都在提交后才删除，
+    事务失败时文件保持不变
+    """
+    hashes, paths = [], []
+    for doc in docs:
+        if doc.content_hash and doc.file_url == blob_path(doc.content_hash):
+            if release_blob(db, doc.content_hash):
+                hashes.append(doc.content_hash)
+        elif doc.file_url:
+            paths.append(doc.file_url)
+
+    def cleanup() -> None:
+        for sha256 in hashes:
+            purge_blob(db, sha256)
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    return cleanup
+
 
 # 尝试导入通义千问服务
 try:
@@ -54,6 +138,8 @@ async def create_knowledge_base(
         embedding_model=kb_data.embedding_model,
         chunk_size=kb_data.chunk_size,
         chunk_overlap=kb_data.chunk_overlap,
+        index_type=kb_data.index_type,
+        index_nprobe=kb_data.index_nprobe,
         is_public=kb_data.is_public,
     )
 
@@ -132,12 +218,17 @@ async def update_knowledge_base(
         )
 
     update_data = kb_data.model_dump(exclude_unset=True)
+    switch_to_ivf = update_data.get("index_type") == INDEX_IVF and kb.index_type != INDEX_IVF
     for field, value in update_data.items():
         setattr(kb, field, value)
 
     db.commit()
     db.refresh(kb)
 
+    if switch_to_ivf:
+        # 切换到 IVF 时在后台线程训练索引，避免首次查询时才训练
+        _schedule(asyncio.to_thread(get_vector_store().build_ivf, kb.id))
+
     return KnowledgeBaseResponse.model_validate(kb)
 
 
@@ -159,22 +250,45 @@ async def delete_knowledge_base(
             detail="知识库不存在"
         )
 
+    delete_knowledge_base_chunks(db, kb_id)
+    docs = db.query(KnowledgeDocument).filter(
+        KnowledgeDocument.kb_id == kb_id
+    ).all()
+    cleanup = _release_document_files(db, docs)
+    db.query(KnowledgeDocument).filter(
+        KnowledgeDocument.kb_id == kb_id
+    ).delete(synchronize_session=False)
     db.delete(kb)
     db.commit()
+    cleanup()
 
     return {"message": "知识库已删除"}
 
 
 # ========== 知识库文档管理 ==========
 
-@router.post("/{kb_id}/documents", response_model=KnowledgeDocumentResponse, summary="上传文档")
+@router.post(
+    "/{kb_id}/documents",
+    response_model=KnowledgeDocumentResponse,
+    summary="上传文档",
+    openapi_extra=UPLOAD_OPENAPI
+)
 async def upload_document(
     kb_id: int,
-    file: UploadFile = File(...),
+    request: Request,
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    """上传文档到知识库"""
+    """
+    上传文档到知识库
+
+    请求体流式写入磁盘并同时计算 SHA-256，超过大小限制立即中止，
+    单个上传的内存占用与文件大小无关。
+
+    文件按内容哈希去重存储：同一知识库重复上传直接返回已有文档；
+    其他知识库已处理过相同内容（且分块参数相同）时复用其分块、全文索引和向量。
+    文档写入后立即返回（status=processing），分块、索引与向量化在后台执行
+    """
     kb = db.query(KnowledgeBase).filter(
         KnowledgeBase.id == kb_id,
         KnowledgeBase.user_id == current_user.id
@@ -186,50 +300,56 @@ async def upload_document(
             detail="知识库不存在"
         )
 
-    file_ext = os.path.splitext(file.filename)[1].lower()
-    if file_ext not in [".txt", ".pdf", ".doc", ".docx", ".md"]:
+    try:
+        upload = await receive_upload(request, upload_tmp_dir(), settings.MAX_UPLOAD_SIZE)
+    except UploadTooLargeError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="不支持的文件类型"
+            detail=f"文件大小超过限制（{settings.MAX_UPLOAD_SIZE // 1024 // 1024}MB）"
         )
-
-    file_content = await file.read()
-    if len(file_content) > settings.MAX_UPLOAD_SIZE:
+    except UploadError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"文件大小超过限制（{settings.MAX_UPLOAD_SIZE // 1024 // 1024}MB）"
+            detail=str(e)
         )
 
-    upload_dir = os.path.join(settings.UPLOAD_DIR, "kb", str(kb_id))
-    os.makedirs(upload_dir, exist_ok=True)
+    file_ext = os.path.splitext(upload.filename)[1].lower()
+    if file_ext not in DOCUMENT_EXTENSIONS:
+        os.remove(upload.path)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="不支持的文件类型"
+        )
 
-    file_path = os.path.join(upload_dir, file.filename)
-    async with aiofiles.open(file_path, "wb") as f:
-        await f.write(file_content)
+    existing = db.query(KnowledgeDocument).filter(
+        KnowledgeDocument.kb_id == kb_id,
+        KnowledgeDocument.content_hash == upload.sha256
+    ).first()
+    if existing:
+        os.remove(upload.path)
+        return KnowledgeDocumentResponse.model_validate(existing)
 
-    content = None
-    if file_ext == ".txt":
-        content = file_content.decode("utf-8")
+    blob = acquire_blob(db, upload)
 
     new_doc = KnowledgeDocument(
         kb_id=kb_id,
-        file_name=file.filename,
-        file_url=file_path,
-        file_size=len(file_content),
+        file_name=upload.filename,
+        file_url=blob.storage_path,
+        file_size=upload.size,
         file_type=file_ext,
-        content=content,
-        status="completed" if content else "processing"
+        content_hash=upload.sha256,
+        status="processing",
+        progress=0
     )
 
     db.add(new_doc)
     db.commit()
+    install_blob(upload)
     db.refresh(new_doc)
 
-    if content:
-        new_doc.chunk_count = 1
-        kb.document_count += 1
-        kb.total_chars += len(content)
-        db.commit()
+    # 分块、全文索引与向量化都在后台执行（文本提取在进程池中），
+    # 可通过文档列表查看 progress 与 status
+    schedule_document(new_doc.id)
 
     return KnowledgeDocumentResponse.model_validate(new_doc)
 
@@ -300,28 +420,54 @@ async def delete_document(
             detail="文档不存在"
         )
 
-    if doc.file_url and os.path.exists(doc.file_url):
-        os.remove(doc.file_url)
-
+    cleanup = _release_document_files(db, [doc])
+    delete_document_chunks(db, doc.id)
     db.delete(doc)
-    kb.document_count -= 1
-    if doc.content:
-        kb.total_chars -= len(doc.content)
+    if doc.status == "completed":
+        # 只有处理完成的文档计入了知识库统计
+        adjust_kb_counters(db, kb.id, -1, -(doc.char_count or len(doc.content or "")))
     db.commit()
+    cleanup()
 
     return {"message": "文档已删除"}
 
 
-# ========== 知识库问答 ==========
-
-@router.post("/{kb_id}/query", response_model=KnowledgeQueryResponse, summary="知识库问答")
-async def query_knowledge_base(
+@router.get("/{kb_id}/documents/{doc_id}/file", summary="下载文档原文件")
+async def download_document(
     kb_id: int,
-    query_data: KnowledgeQueryRequest,
-    current_user: User = Depends(get_current_active_user),
+    doc_id: int,
+    request: Request,
+    current_user: User = Depends(get_stream_user),
     db: Session = Depends(get_db)
 ):
-    """使用知识库进行问答（简化版，使用通义千问直接回答）"""
+    """
+    下载上传的原文件，支持 Range 断点续传
+
+    浏览器直接打开链接时可通过 ?token= 传递令牌
+    """
+    doc = db.query(KnowledgeDocument).join(
+        KnowledgeBase, KnowledgeBase.id == KnowledgeDocument.kb_id
+    ).filter(
+        KnowledgeDocument.id == doc_id,
+        KnowledgeDocument.kb_id == kb_id,
+        KnowledgeBase.user_id == current_user.id
+    ).first()
+
+    if not doc or not doc.file_url:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="文档不存在"
+        )
+
+    # 按内容寻址保存的文件内容不变，用内容哈希作为 ETag
+    etag = doc.content_hash if doc.content_hash and doc.file_url == blob_path(doc.content_hash) else None
+    return await file_response(request, doc.file_url, filename=doc.file_name, inline=False, etag=etag)
+
+
+# ========== 知识库问答 ==========
+
+def _get_queryable_kb(db: Session, kb_id: int, user: User) -> KnowledgeBase:
+    """获取当前用户可问答的知识库（自己的或公开的）"""
     kb = db.query(KnowledgeBase).filter(
         KnowledgeBase.id == kb_id
     ).first()
@@ -332,12 +478,34 @@ async def query_knowledge_base(
             detail="知识库不存在"
         )
 
-    if kb.user_id != current_user.id and not kb.is_public:
+    if kb.user_id != user.id and not kb.is_public:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="无权访问此知识库"
         )
 
+    return kb
+
+
+def _build_qa_prompt(query: str, sources: List[dict]) -> Tuple[str, str]:
+    """根据检索到的片段组装 (system_prompt, prompt)"""
+    system_prompt = """你是一个专业的知识库助手。请根据用户的问题提供准确、简洁的回答。"""
+    prompt = query
+    if sources:
+        system_prompt += "\n请优先依据下面给出的知识库片段作答，片段中没有的信息请如实说明。"
+        prompt = f"知识库片段：\n{build_context_prompt(sources)}\n\n问题：{query}"
+    return system_prompt, prompt
+
+
+@router.post("/{kb_id}/query", response_model=KnowledgeQueryResponse, summary="知识库问答")
+async def query_knowledge_base(
+    kb_id: int,
+    query_data: KnowledgeQueryRequest,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """使用知识库进行问答：检索相关片段后交给通义千问回答"""
+    kb = _get_queryable_kb(db, kb_id, current_user)
     check_user_quota(current_user)
 
     try:
@@ -347,12 +515,15 @@ async def query_knowledge_base(
                 sources=[]
             )
 
-        # 简化版：直接使用通义千问回答
-        system_prompt = """你是一个专业的知识库助手。请根据用户的问题提供准确、简洁的回答。"""
+        # 向量与关键词检索并行，任一路超时或失败时降级为另一路结果
+        sources = await hybrid_search(db, kb, query_data.query, query_data.top_k)
+        system_prompt, prompt = _build_qa_prompt(query_data.query, sources)
 
         answer = await qwen_service.chat(
-            prompt=query_data.query,
-            system_prompt=system_prompt
+            prompt=prompt,
+            system_prompt=system_prompt,
+            use_cache=query_data.use_cache,
+            priority=priority_for(current_user)
         )
 
         consume_user_quota(current_user, 1)
@@ -360,11 +531,79 @@ async def query_knowledge_base(
 
         return KnowledgeQueryResponse(
             answer=answer,
-            sources=[]
+            sources=sources
         )
 
+    except AdmissionTimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI 服务繁忙，请稍后重试",
+            headers={"Retry-After": "5"}
+        )
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(int(settings.QWEN_CIRCUIT_RECOVERY_TIMEOUT))}
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"查询失败: {str(e)}"
         )
+
+
+@router.post("/{kb_id}/query/stream", summary="知识库问答（流式）")
+async def query_knowledge_base_stream(
+    kb_id: int,
+    query_data: KnowledgeQueryRequest,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    知识库问答的 Server-Sent Events 版本，回答逐段推送
+
+    事件顺序：
+    - sources: 检索到的参考来源
+    - delta: 新增的回答文本 {"content": "..."}，可能有多个
+    - done: 生成完成 {"answer": "完整回答"}
+    - error: 生成失败 {"detail": "..."}
+
+    仅在收到 done 时消耗配额，客户端中途断开或生成失败不计费
+    """
+    kb = _get_queryable_kb(db, kb_id, current_user)
+    check_user_quota(current_user)
+
+    if not QWEN_AVAILABLE:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="通义千问服务未配置，请在 .env 中设置 QWEN_API_KEY"
+        )
+
+    # 检索在建立流之前完成，请求的数据库会话在响应体发送前即关闭
+    sources = await hybrid_search(db, kb, query_data.query, query_data.top_k)
+    system_prompt, prompt = _build_qa_prompt(query_data.query, sources)
+    user_id = current_user.id
+    priority = priority_for(current_user)
+
+    async def events():
+        yield sse_event(sources, event="sources")
+        parts = []
+        try:
+            async for content in qwen_service.chat_stream(
+                prompt=prompt,
+                system_prompt=system_prompt,
+                use_cache=query_data.use_cache,
+                priority=priority
+            ):
+                parts.append(content)
+                yield sse_event({"content": content}, event="delta")
+        except Exception as e:
+            logger.warning(f"知识库流式问答失败: kb_id={kb_id}, {e}")
+            yield sse_event({"detail": f"查询失败: {str(e)}"}, event="error")
+            return
+
+        consume_user_quota_by_id(user_id, 1)
+        yield sse_event({"answer": "".join(parts)}, event="done")
+
+    return sse_response(events())
@@ -0,0 +1,39 @@
+"""
+Server-Sent Events 响应工具
+"""
+import json
+from typing import Any, AsyncIterator, Optional
+
+from fastapi.responses import StreamingResponse
+
+# 禁止代理缓冲和缓存，事件到达即转发给客户端
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(data: Any, event: Optional[str] = None, event_id: Optional[str] = None) -> str:
+    """
+    格式化单个 SSE 事件
+
+    Args:
+        data: 事件数据，非字符串时序列化为 JSON
+        event: 事件类型
+        event_id: 事件ID（客户端断线重连时通过 Last-Event-ID 回传）
+    """
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False)
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    """将事件生成器包装为 text/event-stream 响应"""
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
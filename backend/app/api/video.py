@@ -1,15 +1,19 @@
 """
 AI 视频生成相关 API 路由
 """
-from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+import asyncio
+import os
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
-from datetime import datetime
 from loguru import logger
 
+from app.core.config import settings
 from app.core.database import get_db
+from app.core.security import create_file_token
 from app.models.user import User
-from app.models.video import VideoGenerationTask, VideoTemplate, VideoGenerationStatus
+from app.models.video import VideoGenerationTask, VideoSegment, VideoTemplate, VideoGenerationStatus
 from app.schemas.video import (
     VideoTaskCreate,
     VideoTaskResponse,
@@ -20,25 +24,68 @@ from app.schemas.video import (
     VideoTemplateListResponse,
     MessageResponse,
 )
-from app.api.deps import get_current_active_user, get_current_superuser, check_user_quota, consume_user_quota
-
-# 尝试导入通义万相服务，如果失败则使用模拟模式
-try:
-    from app.services.wanxiang_service import wanxiang_service
-    WANXIANG_AVAILABLE = True
-except ImportError:
-    WANXIANG_AVAILABLE = False
-    wanxiang_service = None
+from app.api.deps import (
+    get_current_active_user,
+    get_current_superuser,
+    get_signed_user,
+    get_stream_user,
+    optional_oauth2_scheme,
+    check_user_quota,
+    consume_user_quota,
+    consume_user_quota_by_id,
+)
+from app.api.sse import sse_event, sse_response
+from app.services.admission import priority_for, AdmissionTimeoutError
+from app.services.resilience import CircuitOpenError
+from app.services.event_bus import get_event_bus, EVENT_RESET
+from app.services.video_events import (
+    EVENT_SNAPSHOT,
+    load_task_snapshot,
+    publish_task_update,
+    publish_task_deleted,
+)
+from app.services.video_cache import (
+    detach_followers,
+    find_reusable_task,
+    generation_key,
+    is_referenced,
+    promote_follower,
+    reuse_task,
+)
+from app.services.video_jobs import notify_new_job
+from app.services.file_delivery import file_response
+from app.services.video_mirror import MIRROR_COMPLETED, MIRROR_FAILED, hls_segment_path, mirror_path, move_mirror, remove_mirror
+from app.services.video_scheduler import assign_virtual_tags, queue_estimates
+from app.services.video_segments import (
+    build_playlist,
+    is_long_video,
+    segment_file_url,
+    segment_stream_url,
+    split_duration,
+)
 
 router = APIRouter(prefix="/video", tags=["AI视频"])
 
 
 # ========== 视频生成任务 ==========
 
+def _task_responses(db: Session, tasks: List[VideoGenerationTask]) -> List[VideoTaskResponse]:
+    """任务响应，排队中的任务附带排队位置与预计开始时间，已完成的长视频附带各分段地址"""
+    estimates = queue_estimates(db, tasks)
+    responses = []
+    for task in tasks:
+        response = VideoTaskResponse.model_validate(task)
+        if task.id in estimates:
+            response.queue_position, response.estimated_start_at = estimates[task.id]
+        if task.segment_count and task.status == VideoGenerationStatus.COMPLETED.value:
+            response.segment_urls = [segment_file_url(task.id, i) for i in range(task.segment_count)]
+        responses.append(response)
+    return responses
+
+
 @router.post("/generate", response_model=VideoTaskResponse, summary="创建视频生成任务")
 async def create_video_task(
     task_data: VideoTaskCreate,
-    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -47,12 +94,18 @@ async def create_video_task(
 
     - **prompt**: 提示词/文案（必填）
     - **video_style**: 视频风格（可选）
-    - **video_duration**: 视频时长（秒）
+    - **video_duration**: 视频时长（秒），超过 VIDEO_SEGMENT_SECONDS 时拆成多段并发生成，结果为 HLS 播放列表
     - **aspect_ratio**: 宽高比（16:9, 9:16, 1:1）
     - **template_id**: 模板ID（可选）
+    - **use_cache**: 是否复用相同参数任务的结果：已完成的直接返回视频，进行中的随其完成（false 时总是重新生成）
+
+    长视频按分段数消耗配额（每段 1 次）
     """
+    segment_count = len(split_duration(task_data.video_duration)) if is_long_video(task_data.video_duration) else None
+    quota_cost = segment_count or 1
+
     # 检查配额
-    check_user_quota(current_user)
+    check_user_quota(current_user, quota_cost)
 
     # 验证模板
     if task_data.template_id:
@@ -67,6 +120,13 @@ async def create_video_task(
             )
 
     # 创建任务
+    key = generation_key(
+        task_data.prompt,
+        task_data.aspect_ratio,
+        task_data.video_duration,
+        task_data.template_id,
+        task_data.video_style
+    )
     new_task = VideoGenerationTask(
         user_id=current_user.id,
         prompt=task_data.prompt,
@@ -76,98 +136,35 @@ async def create_video_task(
         template_id=task_data.template_id,
         status=VideoGenerationStatus.PENDING.value,
         progress=0,
+        segment_count=segment_count,
+        generation_key=key,
     )
+    # 按会员权重排队，见 app.services.video_scheduler
+    assign_virtual_tags(db, new_task, current_user.membership_type)
 
     db.add(new_task)
+    db.flush()
+    # use_cache=False 时不复用，但仍记录 generation_key 供之后的请求复用
+    source = find_reusable_task(db, key) if task_data.use_cache else None
+    if source is not None and source.id != new_task.id:
+        reuse_task(new_task, source)
     db.commit()
     db.refresh(new_task)
 
     # 消耗配额
-    consume_user_quota(current_user, 1)
+    consume_user_quota(current_user, quota_cost)
     db.commit()
 
-    # 后台处理任务
-    background_tasks.add_task(process_video_task, new_task.id, db)
-
-    return VideoTaskResponse.model_validate(new_task)
-
-
-async def process_video_task(task_id: int, db: Session):
-    """
-    后台处理视频生成任务
-    使用通义万相 API 生成真实视频
-    """
-    task = db.query(VideoGenerationTask).filter(VideoGenerationTask.id == task_id).first()
-    if not task:
-        return
+    # 任务已入队（status=pending），由 worker 领取处理，见 app.services.video_jobs；
+    # 复用其他任务结果的不需要领取
+    if new_task.source_task_id is None:
+        notify_new_job()
+    await publish_task_update(current_user.id, new_task.id, {
+        "status": new_task.status,
+        "progress": new_task.progress,
+    })
 
-    # 检查服务是否可用
-    if not WANXIANG_AVAILABLE or wanxiang_service is None:
-        task.status = VideoGenerationStatus.FAILED.value
-        task.error_message = "通义万相服务未配置，请设置 DASHSCOPE_API_KEY 环境变量"
-        db.commit()
-        return
-
-    try:
-        # 更新状态为处理中
-        task.status = VideoGenerationStatus.PROCESSING.value
-        task.progress = 10
-        db.commit()
-
-        # 映射宽高比到通义万相尺寸
-        size_map = {
-            "16:9": "1920*1080",
-            "9:16": "1080*1920",
-            "1:1": "1080*1080"
-        }
-        size = size_map.get(task.aspect_ratio, "1920*1080")
-
-        # 映射时长 (通义万相只支持 5/10 秒)
-        duration = 5 if task.video_duration <= 5 else 10
-
-        # 创建视频生成任务
-        logger.info(f"创建视频生成任务: {task.prompt}")
-        result = await wanxiang_service.create_video_task(
-            prompt=task.prompt,
-            size=size,
-            duration=duration,
-            watermark=False
-        )
-
-        task.provider_task_id = result.get("task_id")
-        task.progress = 30
-        db.commit()
-
-        # 等待视频生成完成
-        logger.info(f"等待视频生成完成: {task.provider_task_id}")
-        video_url = await wanxiang_service.wait_for_completion(
-            task_id=task.provider_task_id,
-            check_interval=15,
-            max_wait=300  # 最多等待5分钟
-        )
-
-        if video_url:
-            # 生成成功
-            task.status = VideoGenerationStatus.COMPLETED.value
-            task.progress = 100
-            task.video_url = video_url
-            task.thumbnail_url = video_url.replace(".mp4", ".jpg")  # 通义万相不提供缩略图，使用占位
-            task.video_duration_actual = duration
-            task.completed_at = datetime.utcnow()
-            logger.info(f"视频生成成功: {video_url}")
-        else:
-            # 生成失败
-            task.status = VideoGenerationStatus.FAILED.value
-            task.error_message = "视频生成超时或失败"
-            logger.error(f"视频生成失败: {task.provider_task_id}")
-
-        db.commit()
-
-    except Exception as e:
-        logger.error(f"处理视频任务异常: {e}")
-        task.status = VideoGenerationStatus.FAILED.value
-        task.error_message = str(e)
-        db.commit()
+    return _task_responses(db, [new_task])[0]
 
 
 @router.get("/tasks", response_model=VideoTaskListResponse, summary="获取视频任务列表")
@@ -202,7 +199,7 @@ async def list_video_tasks(
     ).offset((page - 1) * page_size).limit(page_size).all()
 
     return VideoTaskListResponse(
-        items=[VideoTaskResponse.model_validate(item) for item in items],
+        items=_task_responses(db, items),
         total=total,
         page=page,
         page_size=page_size
@@ -229,7 +226,7 @@ async def get_video_task(
             detail="任务不存在"
         )
 
-    return VideoTaskResponse.model_validate(task)
+    return _task_responses(db, [task])[0]
 
 
 @router.delete("/tasks/{task_id}", response_model=MessageResponse, summary="删除任务")
@@ -252,12 +249,241 @@ async def delete_video_task(
             detail="任务不存在"
         )
 
+    # 进行中的跟随任务改为独立生成；已复用本任务结果的任务中最早的一个接替本任务，
+    # 分段与本地镜像转到它名下，其余跟随任务改为跟随它
+    followers = detach_followers(db, task_id)
+    heir_id = promote_follower(db, task)
+    mirrored = task.mirror_status == MIRROR_COMPLETED
+    referenced = is_referenced(db, task_id)
+    if heir_id is None and not referenced:
+        db.query(VideoSegment).filter(VideoSegment.task_id == task_id).delete(synchronize_session=False)
     db.delete(task)
     db.commit()
+    if heir_id is not None and mirrored:
+        await asyncio.to_thread(move_mirror, task_id, heir_id)
+    elif not referenced:
+        await asyncio.to_thread(remove_mirror, task_id)
+    await publish_task_deleted(current_user.id, task_id)
+    for follower_id, user_id in followers:
+        await publish_task_update(user_id, follower_id, {"status": VideoGenerationStatus.PENDING.value, "progress": 0})
+    if followers:
+        notify_new_job()
 
     return MessageResponse(message="任务已删除")
 
 
+def _get_completed_task(db: Session, task_id: int, user: User) -> VideoGenerationTask:
+    """当前用户已完成的任务"""
+    task = db.query(VideoGenerationTask).filter(
+        VideoGenerationTask.id == task_id,
+        VideoGenerationTask.user_id == user.id
+    ).first()
+
+    if not task:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="任务不存在"
+        )
+    if task.status != VideoGenerationStatus.COMPLETED.value:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="视频尚未生成完成"
+        )
+    return task
+
+
+async def _send_video(request: Request, path: str, remote_url: Optional[str], filename: str) -> Response:
+    """发送本地镜像；尚未镜像（或镜像失败）时重定向到服务商地址"""
+    if await asyncio.to_thread(os.path.exists, path):
+        return await file_response(request, path, filename=filename, media_type="video/mp4")
+    if remote_url and remote_url.startswith(("http://", "https://")):
+        return RedirectResponse(remote_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="视频文件不存在"
+    )
+
+
+@router.get("/tasks/{task_id}/file", summary="播放或下载视频")
+async def get_video_file(
+    task_id: int,
+    request: Request,
+    current_user: User = Depends(get_stream_user),
+    db: Session = Depends(get_db)
+):
+    """
+    已完成视频的本地镜像，支持 Range（拖动播放）与缓存校验
+
+    尚未镜像到本地时重定向到服务商地址；长视频请使用播放列表。
+    播放器无法设置请求头时可通过 ?token= 传递令牌
+    """
+    task = _get_completed_task(db, task_id, current_user)
+    if task.segment_count:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="长视频请使用播放列表或逐段播放（segment_urls）"
+        )
+    # 复用其他任务结果时镜像属于来源任务
+    path = mirror_path(task.source_task_id or task.id)
+    return await _send_video(request, path, task.video_url, f"video_{task.id}.mp4")
+
+
+def _get_segment(db: Session, task: VideoGenerationTask, segment_index: int) -> VideoSegment:
+    """长视频任务的分段（复用其他任务结果时分段属于来源任务）"""
+    segment = None
+    if task.segment_count:
+        segment = db.query(VideoSegment).filter(
+            VideoSegment.task_id == (task.source_task_id or task.id),
+            VideoSegment.segment_index == segment_index
+        ).first()
+    if not segment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="视频分段不存在"
+        )
+    return segment
+
+
+@router.get("/tasks/{task_id}/segments/{segment_index}/file", summary="下载长视频分段")
+async def get_video_segment_file(
+    task_id: int,
+    segment_index: int,
+    request: Request,
+    current_user: User = Depends(get_stream_user),
+    db: Session = Depends(get_db)
+):
+    """长视频单个分段（MP4）的本地镜像，尚未镜像时重定向到服务商地址"""
+    task = _get_completed_task(db, task_id, current_user)
+    segment = _get_segment(db, task, segment_index)
+    path = mirror_path(task.source_task_id or task.id, segment_index)
+    return await _send_video(request, path, segment.video_url, f"video_{task.id}_{segment_index}.mp4")
+
+
+def _playlist_resource(task_id: int) -> str:
+    """播放列表签发的分段签名对应的资源"""
+    return f"video:{task_id}"
+
+
+def _get_segment_user(
+    task_id: int,
+    db: Session = Depends(get_db),
+    header_token: Optional[str] = Depends(optional_oauth2_scheme),
+    token: Optional[str] = Query(None, description="JWT 令牌"),
+    sig: Optional[str] = Query(None, description="播放列表中附带的短期签名")
+) -> User:
+    """HLS 分段的当前用户：优先使用登录令牌，其次使用播放列表签发的签名"""
+    if sig and not (header_token or token):
+        return get_signed_user(db, sig, _playlist_resource(task_id))
+    return get_stream_user(db, header_token, token)
+
+
+@router.get("/tasks/{task_id}/segments/{segment_index}/stream.ts", summary="长视频 HLS 分段")
+async def get_video_segment_stream(
+    task_id: int,
+    segment_index: int,
+    request: Request,
+    current_user: User = Depends(_get_segment_user),
+    db: Session = Depends(get_db)
+):
+    """长视频单个分段转封装后的 MPEG-TS（由播放列表引用，地址附带短期签名）"""
+    task = _get_completed_task(db, task_id, current_user)
+    _get_segment(db, task, segment_index)
+    path = hls_segment_path(task.source_task_id or task.id, segment_index)
+    return await file_response(request, path, filename=f"video_{task.id}_{segment_index}.ts", media_type="video/mp2t")
+
+
+@router.get("/tasks/{task_id}/playlist.m3u8", summary="长视频 HLS 播放列表")
+async def get_video_playlist(
+    task_id: int,
+    current_user: User = Depends(get_stream_user),
+    db: Session = Depends(get_db)
+):
+    """
+    已完成的长视频（分段生成）按顺序组成的 HLS 播放列表
+
+    分段需先由 worker 镜像并转封装为 MPEG-TS，完成前返回 409（可先逐段播放 MP4）；
+    未开启镜像、镜像失败或 worker 没有 ffmpeg 时不会生成 MPEG-TS，返回 404；
+    播放器无法设置请求头时可通过 ?token= 传递令牌；
+    分段地址附带短期签名 ?sig=，不在播放列表中暴露登录令牌
+    """
+    task = _get_completed_task(db, task_id, current_user)
+    if not task.segment_count:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="任务不存在或不是长视频任务"
+        )
+
+    # 复用其他任务结果时分段属于来源任务
+    source_id = task.source_task_id or task.id
+    segments = db.query(VideoSegment).filter(
+        VideoSegment.task_id == source_id
+    ).order_by(VideoSegment.segment_index).all()
+    if not segments:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="视频分段不存在"
+        )
+
+    paths = [hls_segment_path(source_id, segment.segment_index) for segment in segments]
+    if not await asyncio.to_thread(lambda: all(os.path.exists(path) for path in paths)):
+        source = task if source_id == task.id else db.get(VideoGenerationTask, source_id)
+        mirror_status = source.mirror_status if source is not None else None
+        if not settings.VIDEO_MIRROR_ENABLED or mirror_status in (MIRROR_COMPLETED, MIRROR_FAILED):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="该视频没有可用的播放列表（未开启镜像或服务器不支持转封装），请逐段播放（segment_urls）"
+            )
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="视频正在转存，请稍后再试"
+        )
+
+    suffix = "?sig=" + create_file_token(current_user.id, _playlist_resource(task.id))
+    uris = [segment_stream_url(task.id, segment.segment_index) + suffix for segment in segments]
+    return Response(
+        content=build_playlist(segments, uris),
+        media_type="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "private, max-age=300"}
+    )
+
+
+@router.get("/events", summary="订阅视频任务状态（SSE）")
+async def subscribe_video_events(
+    last_event_id: Optional[str] = Query(None, description="从该事件之后继续接收（首次连接时使用）"),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+    current_user: User = Depends(get_stream_user)
+):
+    """
+    订阅当前用户全部视频任务的状态与进度变化，替代轮询任务详情
+
+    - 连接建立时（或断线太久无法续传时）先发送 snapshot 事件：未结束及最近结束的任务全量状态
+    - 之后每次变化发送 task 事件：task_id 与变化的字段（status、progress、video_url 等），
+      任务删除时为 {"task_id": ..., "deleted": true}
+    - 断线重连时浏览器自动回传 Last-Event-ID，从中断处继续
+    - EventSource 无法设置请求头，可通过 ?token= 传递令牌
+    """
+    user_id = current_user.id
+    resume_from = last_event_id_header or last_event_id
+
+    async def event_generator():
+        # 客户端断线后的重连间隔（毫秒）
+        yield "retry: 3000\n\n"
+        subscription = get_event_bus().subscribe(user_id, resume_from, settings.EVENT_KEEPALIVE_SECONDS)
+        try:
+            async for item in subscription:
+                if item is None:
+                    yield ": keepalive\n\n"
+                elif item.event == EVENT_RESET:
+                    snapshot = await asyncio.to_thread(load_task_snapshot, user_id)
+                    yield sse_event({"tasks": snapshot}, event=EVENT_SNAPSHOT)
+                else:
+                    yield sse_event(item.data, event=item.event, event_id=item.id)
+        finally:
+            await subscription.aclose()
+
+    return sse_response(event_generator())
+
+
 # ========== 视频模板管理 ==========
 
 @router.get("/templates", response_model=VideoTemplateListResponse, summary="获取视频模板列表")
@@ -401,11 +627,27 @@ async def delete_video_template(
 
 # ========== AI 文案生成辅助接口 ==========
 
+def _script_system_prompt(style: Optional[str], duration: Optional[int]) -> str:
+    """视频脚本生成的系统提示词"""
+    return f"""你是一个专业的视频脚本创作助手。
+请根据用户提供的主题，创作一个约 {duration} 秒的视频脚本。
+
+脚本格式要求：
+1. 开场钩子（吸引注意力的前3秒）
+2. 主要内容
+3. 结尾号召
+
+风格要求：{style or "自然、有趣、有吸引力"}
+
+请直接输出脚本内容，不要有额外的解释。"""
+
+
 @router.post("/generate-script", summary="AI 生成视频脚本")
 async def generate_video_script(
     prompt: str,
     style: Optional[str] = None,
     duration: Optional[int] = 30,
+    use_cache: bool = True,
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -415,6 +657,7 @@ async def generate_video_script(
     - **prompt**: 主题或关键词
     - **style**: 风格（如：幽默、专业、情感等）
     - **duration**: 视频时长（秒）
+    - **use_cache**: 是否允许返回相同参数下缓存的脚本（false 时重新生成）
     """
     # 检查配额
     check_user_quota(current_user)
@@ -428,22 +671,14 @@ async def generate_video_script(
             detail="通义千问服务未配置，请设置 QWEN_API_KEY 环境变量"
         )
 
-    system_prompt = f"""你是一个专业的视频脚本创作助手。
-请根据用户提供的主题，创作一个约 {duration} 秒的视频脚本。
-
-脚本格式要求：
-1. 开场钩子（吸引注意力的前3秒）
-2. 主要内容
-3. 结尾号召
-
-风格要求：{style or "自然、有趣、有吸引力"}
-
-请直接输出脚本内容，不要有额外的解释。"""
+    system_prompt = _script_system_prompt(style, duration)
 
     try:
         script = await qwen_service.chat(
             prompt=prompt,
             system_prompt=system_prompt,
+            use_cache=use_cache,
+            priority=priority_for(current_user),
             temperature=0.8
         )
 
@@ -453,8 +688,74 @@ async def generate_video_script(
 
         return {"script": script}
 
+    except AdmissionTimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI 服务繁忙，请稍后重试",
+            headers={"Retry-After": "5"}
+        )
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(int(settings.QWEN_CIRCUIT_RECOVERY_TIMEOUT))}
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"脚本生成失败: {str(e)}"
         )
+
+
+@router.post("/generate-script/stream", summary="AI 生成视频脚本（流式）")
+async def generate_video_script_stream(
+    prompt: str,
+    style: Optional[str] = None,
+    duration: Optional[int] = 30,
+    use_cache: bool = True,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    视频脚本生成的 Server-Sent Events 版本，脚本逐段推送
+
+    事件：delta {"content": "..."}（多个）→ done {"script": "完整脚本"}，失败时为 error {"detail": "..."}；
+    仅在收到 done 时消耗配额
+    """
+    # 检查配额
+    check_user_quota(current_user)
+
+    # 尝试导入通义千问服务
+    try:
+        from app.services.qwen_service import qwen_service
+    except ImportError:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="通义千问服务未配置，请设置 QWEN_API_KEY 环境变量"
+        )
+
+    system_prompt = _script_system_prompt(style, duration)
+    user_id = current_user.id
+    priority = priority_for(current_user)
+
+    async def events():
+        parts = []
+        try:
+            async for content in qwen_service.chat_stream(
+                prompt=prompt,
+                system_prompt=system_prompt,
+                use_cache=use_cache,
+                priority=priority,
+                temperature=0.8
+            ):
+                parts.append(content)
+                yield sse_event({"content": content}, event="delta")
+        except Exception as e:
+            logger.warning(f"视频脚本流式生成失败: {e}")
+            yield sse_event({"detail": f"脚本生成失败: {str(e)}"}, event="error")
+            return
+
+        # 消耗配额
+        consume_user_quota_by_id(user_id, 1)
+        yield sse_event({"script": "".join(parts)}, event="done")
+
+    return sse_response(events())
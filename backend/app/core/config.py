@@ -3,6 +3,7 @@
 """
 import os
 from typing import Optional
+from pydantic import field_validator
 from pydantic_settings import BaseSettings
 from functools import lru_cache
 
@@ -48,6 +49,7 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "your-secret-key-change-in-production"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7天
+    FILE_TOKEN_EXPIRE_MINUTES: int = 120  # 播放列表中文件签名的有效期（分钟）
 
     # 通义千问配置
     QWEN_API_KEY: str = ""
@@ -56,14 +58,116 @@ class Settings(BaseSettings):
     # 通义万相视频生成配置
     DASHSCOPE_API_KEY: str = ""
 
+    # DashScope 接口地址（压测时可指向本地模拟服务，见 scripts/dashscope_simulator.py）
+    DASHSCOPE_BASE_URL: str = "https://dashscope.aliyuncs.com"
+
     # 向量数据库配置 (Milvus)
     MILVUS_HOST: str = "localhost"
     MILVUS_PORT: int = 19530
     MILVUS_COLLECTION_NAME: str = "knowledge_base"
 
+    # 向量存储配置
+    VECTOR_STORE_BACKEND: str = "numpy"  # numpy / milvus
+    VECTOR_STORE_DIR: str = "vectors"  # 与 UPLOAD_DIR 并列，存放 .npy 向量文件
+    IVF_MIN_TRAIN_SIZE: int = 10000  # 向量数达到该值才训练 IVF 索引，之前使用精确检索
+    IVF_DEFAULT_NPROBE: int = 16  # 知识库未设置 nprobe 时的默认探测聚类数
+    IVF_RETRAIN_FACTOR: float = 4.0  # 向量数增长到训练时的倍数后重新训练聚类中心
+
+    # 知识库检索配置
+    RETRIEVAL_VECTOR_TIMEOUT: float = 0.8  # 向量检索时间预算（秒，含查询向量化）
+    RETRIEVAL_KEYWORD_TIMEOUT: float = 0.3  # 关键词检索时间预算（秒）
+    RETRIEVAL_RRF_K: int = 60  # 倒数排名融合常数
+    RETRIEVAL_CANDIDATE_FACTOR: int = 3  # 每路检索取 top_k 的倍数作为融合候选
+
+    # 文本嵌入配置
+    EMBEDDING_BATCH_SIZE: int = 25  # DashScope text-embedding 单次最多 25 条
+    EMBEDDING_CONCURRENCY: int = 4  # 同时发送的向量化请求批数
+
+    # 文档解析配置
+    INGESTION_WORKERS: int = 2  # 解析 PDF/DOC/DOCX 的进程数
+    DOCUMENT_LEASE_SECONDS: int = 300  # 文档处理租约（秒），处理中的进程每 1/3 租约续期，失联超过该时间后由其他进程接手
+
+    # 上游 HTTP 连接池配置
+    HTTP_MAX_CONNECTIONS: int = 100  # 连接总数上限
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20  # 保持空闲的长连接数（httpx）
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0  # 空闲长连接保留时间（秒）
+    HTTP_CONNECT_TIMEOUT: float = 5.0  # 建立连接超时（秒）
+    HTTP_TIMEOUT: float = 60.0  # 单次请求默认超时（秒）
+    HTTP2_ENABLED: bool = False  # httpx 使用 HTTP/2（需安装 h2）
+    HTTP_WARMUP: bool = True  # 启动时预热到 DashScope 的连接
+
+    # 视频任务队列
+    VIDEO_WORKER_IN_PROCESS: bool = True  # 在 API 进程内运行 worker；独立部署 worker.py 时关闭
+    VIDEO_WORKER_CONCURRENCY: int = 20  # 每个 worker 同时处理的任务数
+    VIDEO_WORKER_BATCH_SIZE: int = 10  # 每次最多领取的任务数
+    VIDEO_WORKER_POLL_INTERVAL: float = 2.0  # 没有任务时的领取间隔（秒）
+    VIDEO_JOB_LEASE_SECONDS: int = 120  # 租约时长（秒），worker 失联超过该时间后任务被重新领取
+    VIDEO_JOB_HEARTBEAT_SECONDS: int = 30  # 续约间隔（秒），需小于租约时长
+    VIDEO_JOB_MAX_ATTEMPTS: int = 3  # 创建上游任务的最多尝试次数
+    VIDEO_JOB_RETRY_DELAY: float = 10.0  # 重试基础延迟（秒），按次数指数增长
+    VIDEO_POLLER_MAX_TASKS: int = 5000  # 每个 worker 同时轮询的上游任务数上限
+    VIDEO_POLL_CONCURRENCY: int = 10  # 每轮同时发出的任务查询数
+    VIDEO_POLL_BATCH_SIZE: int = 100  # 每轮最多查询的任务数（另受 WANXIANG_MAX_QPS × 续约间隔限制），每轮结束都会续约
+    VIDEO_POLL_DEFAULT_INTERVAL: float = 15.0  # 完成耗时样本不足时的查询间隔（秒）
+    VIDEO_POLL_MIN_INTERVAL: float = 2.0  # 查询间隔下限（秒）
+    VIDEO_POLL_MAX_INTERVAL: float = 60.0  # 查询间隔上限（秒）
+    VIDEO_PROVIDER_TIMEOUT: int = 900  # 提交后超过该时间（秒）仍未完成视为失败
+    VIDEO_LONG_MODE_ENABLED: bool = True  # 超过单段时长的视频拆成多段并发生成；关闭时截断为单段
+    VIDEO_SEGMENT_SECONDS: int = 10  # 每段时长（秒），通义万相单次最长 10 秒
+    VIDEO_SEGMENT_USER_CONCURRENCY: int = 4  # 每个 worker 中同一用户同时提交的分段数
+    VIDEO_RESULT_CACHE_ENABLED: bool = True  # 相同生成参数的任务复用已完成或进行中任务的结果
+    VIDEO_RESULT_CACHE_TTL: int = 12 * 3600  # 已完成结果的复用有效期（秒），通义万相视频地址 24 小时后失效
+    VIDEO_QUEUE_DEFAULT_RUN_SECONDS: int = 180  # 缺少历史数据时估计的单个任务处理时长（秒），用于预计开始时间
+    VIDEO_MIRROR_ENABLED: bool = True  # 任务完成后由 worker 把视频下载到 {UPLOAD_DIR}/videos/
+    VIDEO_MIRROR_CONCURRENCY: int = 2  # 每个 worker 同时镜像的任务数
+    VIDEO_MIRROR_INTERVAL: float = 10.0  # 查找待镜像任务的间隔（秒）
+    VIDEO_MIRROR_LEASE_SECONDS: int = 300  # 镜像租约时长（秒），下载期间每 1/3 租约续期，到期未续约视为 worker 失联
+    VIDEO_MIRROR_MAX_ATTEMPTS: int = 5  # 镜像最多尝试次数
+    VIDEO_MIRROR_MAX_AGE: int = 23 * 3600  # 完成超过该时间（秒）的任务不再镜像，服务商地址已接近失效
+    FFMPEG_PATH: str = "ffmpeg"  # 镜像长视频时把各分段转封装为 MPEG-TS（HLS 分段）；不可用时长视频不提供播放列表
+
+    # 文件下载（app.services.downloader）
+    DOWNLOAD_PART_SIZE: int = 8 * 1024 * 1024  # 分段大小（字节）
+    DOWNLOAD_CONCURRENCY: int = 4  # 单个文件同时下载的分段数
+    DOWNLOAD_RETRY_ATTEMPTS: int = 3  # 每个分段最多请求次数（含首次）
+
+    # 任务状态推送（GET /video/events）
+    EVENT_BUS_BACKEND: str = "memory"  # memory（worker 在 API 进程内）/ redis（多实例或独立 worker）
+    EVENT_HISTORY_SIZE: int = 100  # 每个用户保留的最近事件数，用于断线续传
+    EVENT_HISTORY_TTL: int = 600  # 事件保留时间（秒）
+    EVENT_KEEPALIVE_SECONDS: float = 15.0  # 没有事件时发送保活注释的间隔（秒）
+
+    # 上游调用准入控制（超过后排队，按会员优先级放行）
+    QWEN_MAX_QPS: float = 10.0  # 通义千问每秒请求数，0 表示不限
+    QWEN_BURST: int = 10  # 令牌桶容量（允许的瞬时突发）
+    QWEN_MAX_CONCURRENCY: int = 20  # 通义千问同时进行的请求数
+    WANXIANG_MAX_QPS: float = 2.0  # 通义万相每秒请求数
+    WANXIANG_BURST: int = 2
+    WANXIANG_MAX_CONCURRENCY: int = 5
+    ADMISSION_QUEUE_TIMEOUT: float = 30.0  # 最长排队时间（秒），超时返回 503
+    ADMISSION_BACKGROUND_QUEUE_TIMEOUT: float = 0  # 后台任务最长排队时间（秒），0 表示一直等待，繁忙时让出给用户请求
+
+    # 通义千问调用容错
+    QWEN_RETRY_ATTEMPTS: int = 3  # 每次调用最多请求次数（含首次）
+    QWEN_RETRY_BACKOFF_BASE: float = 0.5  # 重试退避基数（秒），指数增长并随机抖动
+    QWEN_RETRY_BACKOFF_MAX: float = 8.0  # 单次重试最长等待（秒）
+    QWEN_HEDGE_ENABLED: bool = True  # 慢请求是否发出对冲请求
+    QWEN_HEDGE_PERCENTILE: float = 0.95  # 按近期耗时的该分位数决定何时对冲
+    QWEN_HEDGE_MIN_DELAY: float = 1.0  # 对冲延迟下限（秒）
+    QWEN_HEDGE_MAX_DELAY: float = 30.0  # 对冲延迟上限（秒）
+    QWEN_CIRCUIT_FAILURE_THRESHOLD: int = 5  # 连续失败多少次后熔断
+    QWEN_CIRCUIT_RECOVERY_TIMEOUT: float = 30.0  # 熔断持续时间（秒），之后放行试探请求
+
+    # 大模型响应缓存配置
+    LLM_CACHE_BACKEND: str = "memory"  # memory / sqlite / redis / none
+    LLM_CACHE_TTL: int = 3600  # 缓存有效期（秒）
+    LLM_CACHE_MAX_ENTRIES: int = 10000  # memory / sqlite 后端的最大条目数
+    LLM_CACHE_SQLITE_PATH: str = "cache/llm_cache.sqlite3"
+
     # 文件存储配置
     UPLOAD_DIR: str = "uploads"
     MAX_UPLOAD_SIZE: int = 100 * 1024 * 1024  # 100MB
+    FILE_ACCEL_REDIRECT_PREFIX: str = ""  # 设置后（如 /protected-files/）文件由 nginx 发送，见 docker/nginx/nginx.conf；为空时由应用发送
     ALLOWED_EXTENSIONS: set = {
         ".txt", ".pdf", ".doc", ".docx",
         ".jpg", ".jpeg", ".png", ".gif",
@@ -101,18 +205,32 @@ class Settings(BaseSettings):
     MEMBERSHIP_CONFIG: dict = {
         "free": {
             "daily_quota": 5,
-            "features": ["basic_ai_text", "basic_kb_query"]
+            "features": ["basic_ai_text", "basic_kb_query"],
+            "video_concurrency": 1,  # 同时处理的视频任务数
+            "video_weight": 1  # 视频任务排队权重
         },
         "standard": {
             "daily_quota": 100,
-            "features": ["all_ai_text", "ai_video", "ai_image", "kb_manage"]
+            "features": ["all_ai_text", "ai_video", "ai_image", "kb_manage"],
+            "video_concurrency": 3,
+            "video_weight": 2
         },
         "professional": {
             "daily_quota": -1,  # 无限
-            "features": ["all_features", "priority", "dedicated_support"]
+            "features": ["all_features", "priority", "dedicated_support"],
+            "video_concurrency": 10,
+            "video_weight": 4
         }
     }
 
+    @field_validator("VIDEO_SEGMENT_SECONDS")
+    @classmethod
+    def check_segment_seconds(cls, value: int) -> int:
+        """通义万相只支持生成 5 秒或 10 秒的视频"""
+        if value not in (5, 10):
+            raise ValueError("VIDEO_SEGMENT_SECONDS 只能为 5 或 10")
+        return value
+
     class Config:
         env_file = ".env"
         case_sensitive = True
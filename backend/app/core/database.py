@@ -1,11 +1,19 @@
 """
 数据库连接配置
 """
-from sqlalchemy import create_engine
+from loguru import logger
+from sqlalchemy import create_engine, inspect, literal, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from typing import Generator
 
+from app.core.config import settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
 # 直接使用 SQLite，绕过配置文件
 DATABASE_URL = "sqlite:///./ai_agent_platform.db"
 
@@ -35,15 +43,67 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+# Redis 客户端（延迟创建，首次使用时才建立连接）
+_redis_client = None
+
+
 def get_redis():
     """
-    获取 Redis 连接
+    获取 Redis 连接（redis.asyncio 客户端）
+
+    未安装 redis 包或未配置 REDIS_URL 时返回 None
+    """
+    global _redis_client
+    if _redis_client is None and aioredis is not None and settings.REDIS_URL:
+        _redis_client = aioredis.from_url(
+            settings.REDIS_URL,
+            password=settings.REDIS_PASSWORD,
+            decode_responses=True
+        )
+    return _redis_client
+
+
+def _column_default(column) -> str:
+    """新增列的 DEFAULT 子句：取 server_default 或标量 default，已有行按该值填充"""
+    if column.server_default is not None:
+        return f" DEFAULT {column.server_default.arg}"
+    default = column.default
+    if default is None or not default.is_scalar:
+        return ""
+    value = literal(default.arg, column.type).compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    return f" DEFAULT {value}"
+
+
+def _upgrade_tables() -> None:
+    """
+    为已存在的表补齐模型中新增的列及索引（create_all 不修改已存在的表）
+
+    可重复执行：只添加数据库中不存在的列；新增列按默认值填充已有行，
+    没有标量默认值的列允许为空
     """
-    return None  # 暂时禁用 Redis
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in existing]
+        if not missing:
+            continue
+        with engine.begin() as conn:
+            for column in missing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(
+                    f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}{_column_default(column)}'
+                ))
+                logger.info(f"数据库升级: {table.name} 新增列 {column.name}")
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 
 def init_db() -> None:
     """
-    初始化数据库表
+    初始化数据库表，并为旧版本创建的表补齐新增的列
     """
     Base.metadata.create_all(bind=engine)
+    _upgrade_tables()
@@ -98,6 +98,46 @@ def decode_access_token(token: str) -> Optional[Dict[str, Any]]:
             settings.SECRET_KEY,
             algorithms=[settings.ALGORITHM]
         )
-        return payload
     except JWTError:
         return None
+    if "resource" in payload:
+        # 文件签名只能访问签发时的资源，不能作为登录令牌
+        return None
+    return payload
+
+
+def create_file_token(user_id: int, resource: str) -> str:
+    """
+    生成访问单个资源的短期签名（写入播放列表等地址，避免暴露登录令牌）
+
+    Args:
+        user_id: 用户 ID
+        resource: 资源标识，如 "video:1"
+
+    Returns:
+        str: 签名令牌
+    """
+    return create_access_token(
+        {"sub": str(user_id), "resource": resource},
+        expires_delta=timedelta(minutes=settings.FILE_TOKEN_EXPIRE_MINUTES)
+    )
+
+
+def decode_file_token(token: str, resource: str) -> Optional[str]:
+    """
+    校验资源签名
+
+    Returns:
+        Optional[str]: 签名对应的用户 ID，签名无效、过期或不属于该资源时返回 None
+    """
+    try:
+        payload = jwt.decode(
+            token,
+            settings.SECRET_KEY,
+            algorithms=[settings.ALGORITHM]
+        )
+    except JWTError:
+        return None
+    if payload.get("resource") != resource:
+        return None
+    return payload.get("sub")
@@ -2,8 +2,9 @@
 数据库模型
 """
 from app.models.user import User, MembershipType, UserStatus
-from app.models.knowledge_base import KnowledgeBase, KnowledgeDocument
-from app.models.video import VideoGenerationTask, VideoTemplate, VideoGenerationStatus
+from app.models.knowledge_base import KnowledgeBase, KnowledgeDocument, KnowledgeChunk
+from app.models.storage import FileBlob
+from app.models.video import VideoGenerationTask, VideoSegment, VideoTemplate, VideoGenerationStatus
 
 __all__ = [
     "User",
@@ -11,7 +12,10 @@ __all__ = [
     "UserStatus",
     "KnowledgeBase",
     "KnowledgeDocument",
+    "KnowledgeChunk",
+    "FileBlob",
     "VideoGenerationTask",
+    "VideoSegment",
     "VideoTemplate",
     "VideoGenerationStatus",
 ]
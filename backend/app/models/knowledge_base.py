@@ -25,6 +25,8 @@ class KnowledgeBase(Base):
     embedding_model = Column(String(50), default="text-embedding-v1", comment="嵌入模型")
     chunk_size = Column(Integer, default=500, comment="分块大小")
     chunk_overlap = Column(Integer, default=50, comment="分块重叠")
+    index_type = Column(String(20), default="flat", comment="向量索引类型：flat/ivf")
+    index_nprobe = Column(Integer, default=16, comment="IVF 检索探测聚类数（越大召回越高、延迟越高）")
 
     # 统计
     document_count = Column(Integer, default=0, comment="文档数量")
@@ -59,11 +61,17 @@ class KnowledgeDocument(Base):
     file_url = Column(String(500), nullable=True, comment="文件URL")
     file_size = Column(Integer, nullable=True, comment="文件大小（字节）")
     file_type = Column(String(50), nullable=True, comment="文件类型")
+    content_hash = Column(String(64), nullable=True, index=True, comment="文件内容 SHA-256")
 
     # 处理信息
     vector_id = Column(String(100), nullable=True, comment="向量ID（Milvus）")
     chunk_count = Column(Integer, default=0, comment="分块数量")
+    char_count = Column(Integer, default=0, comment="文本字符数")
     status = Column(String(20), default="processing", comment="处理状态：processing/completed/failed")
+    progress = Column(Integer, default=0, comment="处理进度（0-100）")
+    error_message = Column(Text, nullable=True, comment="处理失败原因")
+    locked_by = Column(String(100), nullable=True, comment="正在后台处理该文档的进程")
+    lease_expires_at = Column(DateTime, nullable=True, comment="处理租约到期时间，到期未续约视为进程失联")
 
     # 文本内容（用于搜索）
     content = Column(Text, nullable=True, comment="提取的文本内容")
@@ -78,3 +86,25 @@ class KnowledgeDocument(Base):
 
     def __repr__(self):
         return f"<KnowledgeDocument(id={self.id}, file_name={self.file_name})>"
+
+
+class KnowledgeChunk(Base):
+    """知识库文档分块表"""
+
+    __tablename__ = "knowledge_chunks"
+
+    id = Column(Integer, primary_key=True, index=True, comment="分块ID")
+    kb_id = Column(Integer, ForeignKey("knowledge_bases.id", ondelete="CASCADE"), nullable=False, index=True, comment="知识库ID")
+    doc_id = Column(Integer, ForeignKey("knowledge_documents.id", ondelete="CASCADE"), nullable=False, index=True, comment="文档ID")
+
+    # 分块信息
+    chunk_index = Column(Integer, nullable=False, comment="分块序号")
+    start_offset = Column(Integer, nullable=False, comment="在原文中的起始字符偏移")
+    end_offset = Column(Integer, nullable=False, comment="在原文中的结束字符偏移")
+    content = Column(Text, nullable=False, comment="分块内容")
+
+    # 时间戳
+    created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
+
+    def __repr__(self):
+        return f"<KnowledgeChunk(id={self.id}, doc_id={self.doc_id}, index={self.chunk_index})>"
@@ -0,0 +1,25 @@
+"""
+文件存储模型
+"""
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime
+
+from app.core.database import Base
+
+
+class FileBlob(Base):
+    """内容寻址文件表（按 SHA-256 去重，多个文档共享同一份文件）"""
+
+    __tablename__ = "file_blobs"
+
+    sha256 = Column(String(64), primary_key=True, comment="文件内容 SHA-256")
+    size = Column(Integer, nullable=False, comment="文件大小（字节）")
+    storage_path = Column(String(500), nullable=False, comment="存储路径")
+    ref_count = Column(Integer, default=0, nullable=False, comment="引用计数")
+
+    # 时间戳
+    created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
+
+    def __repr__(self):
+        return f"<FileBlob(sha256={self.sha256}, ref_count={self.ref_count})>"
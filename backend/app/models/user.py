@@ -99,8 +99,8 @@ class User(Base):
 
         return feature in available_features
 
-    def has_quota(self) -> bool:
-        """检查用户是否有配额"""
+    def has_quota(self, amount: int = 1) -> bool:
+        """检查用户剩余配额是否足够 amount"""
         # 无限配额
         if self.daily_quota < 0:
             return True
@@ -110,11 +110,11 @@ class User(Base):
             self.used_quota = 0
             self.quota_reset_at = None
 
-        return self.used_quota < self.daily_quota
+        return self.used_quota + amount <= self.daily_quota
 
     def consume_quota(self, amount: int = 1) -> bool:
         """消耗配额"""
-        if not self.has_quota():
+        if not self.has_quota(amount):
             return False
 
         self.used_quota += amount
@@ -53,6 +53,36 @@ class VideoGenerationTask(Base):
     # 第三方服务信息
     provider_task_id = Column(String(100), nullable=True, comment="第三方服务任务ID")
     provider = Column(String(50), default="jianying", comment="服务提供商：jianying/heygen/custom")
+    submitted_at = Column(DateTime, nullable=True, comment="提交到服务商的时间")
+
+    # 长视频分段生成（见 app.services.video_segments）
+    segment_count = Column(Integer, nullable=True, comment="分段数，为空表示单段生成")
+
+    # 生成结果复用（见 app.services.video_cache）
+    generation_key = Column(String(64), nullable=True, index=True, comment="规范化生成参数的哈希")
+    source_task_id = Column(
+        Integer,
+        ForeignKey("video_generation_tasks.id", ondelete="SET NULL"),
+        nullable=True,
+        index=True,
+        comment="复用结果的来源任务ID（已完成时直接复用，进行中时随其完成）"
+    )
+
+    # 本地镜像（完成后由 worker 下载，见 app.services.video_mirror）
+    local_path = Column(String(500), nullable=True, comment="本地镜像路径（长视频为分段所在目录）")
+    mirror_status = Column(String(20), nullable=True, comment="镜像状态：为空表示待镜像，downloading/completed/failed")
+    mirror_attempts = Column(Integer, default=0, comment="镜像已尝试次数")
+    mirror_locked_by = Column(String(100), nullable=True, comment="正在镜像的 worker")
+    mirror_available_at = Column(DateTime, nullable=True, comment="镜像租约到期时间，或失败后下次重试的时间")
+
+    # 任务队列（由 worker 领取执行，见 app.services.video_jobs）
+    virtual_start = Column(Float, nullable=True, index=True, comment="加权公平排队的虚拟开始时间，按此顺序领取")
+    virtual_finish = Column(Float, nullable=True, comment="加权公平排队的虚拟结束时间")
+    available_at = Column(DateTime, default=datetime.utcnow, index=True, comment="可被领取的时间（失败重试时延后）")
+    attempts = Column(Integer, default=0, comment="已领取执行的次数")
+    locked_by = Column(String(100), nullable=True, comment="持有租约的 worker")
+    lease_expires_at = Column(DateTime, nullable=True, index=True, comment="租约到期时间，到期未续约视为 worker 失联")
+    heartbeat_at = Column(DateTime, nullable=True, comment="最近一次心跳时间")
 
     # 时间戳
     created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
@@ -67,6 +97,46 @@ class VideoGenerationTask(Base):
         return f"<VideoGenerationTask(id={self.id}, status={self.status})>"
 
 
+class VideoSegment(Base):
+    """长视频分段表：每段单独提交给服务商，完成后按顺序组成 HLS 播放列表"""
+
+    __tablename__ = "video_segments"
+
+    id = Column(Integer, primary_key=True, index=True, comment="分段ID")
+    task_id = Column(
+        Integer,
+        ForeignKey("video_generation_tasks.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+        comment="所属任务ID"
+    )
+    segment_index = Column(Integer, nullable=False, comment="分段序号（从 0 开始）")
+    prompt = Column(Text, nullable=False, comment="分镜提示词")
+    duration = Column(Integer, nullable=False, comment="分段时长（秒）")
+
+    # 状态信息
+    status = Column(
+        String(20),
+        default=VideoGenerationStatus.PENDING.value,
+        comment="分段状态"
+    )
+    progress = Column(Integer, default=0, comment="处理进度（0-100）")
+    video_url = Column(String(500), nullable=True, comment="分段视频URL")
+    error_message = Column(Text, nullable=True, comment="错误信息")
+    provider_task_id = Column(String(100), nullable=True, comment="第三方服务任务ID")
+    submitted_at = Column(DateTime, nullable=True, comment="提交到服务商的时间")
+    local_path = Column(String(500), nullable=True, comment="本地镜像路径")
+    video_size = Column(Integer, nullable=True, comment="视频大小（字节）")
+
+    # 时间戳
+    created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
+    completed_at = Column(DateTime, nullable=True, comment="完成时间")
+
+    def __repr__(self):
+        return f"<VideoSegment(task_id={self.task_id}, index={self.segment_index}, status={self.status})>"
+
+
 class VideoTemplate(Base):
     """视频模板表"""
 
@@ -18,6 +18,8 @@ class KnowledgeBaseCreate(KnowledgeBaseBase):
     embedding_model: str = Field("text-embedding-v1", description="嵌入模型")
     chunk_size: int = Field(500, ge=100, le=2000, description="分块大小")
     chunk_overlap: int = Field(50, ge=0, le=500, description="分块重叠")
+    index_type: str = Field("flat", pattern=r"^(flat|ivf)$", description="向量索引类型：flat 精确检索 / ivf 近似检索")
+    index_nprobe: int = Field(16, ge=1, le=1024, description="IVF 检索探测聚类数，越大召回越高、延迟越高")
     is_public: bool = Field(False, description="是否公开")
 
 
@@ -26,6 +28,8 @@ class KnowledgeBaseUpdate(BaseModel):
     name: Optional[str] = Field(None, min_length=1, max_length=100, description="知识库名称")
     description: Optional[str] = Field(None, description="知识库描述")
     avatar: Optional[str] = Field(None, max_length=500, description="知识库头像")
+    index_type: Optional[str] = Field(None, pattern=r"^(flat|ivf)$", description="向量索引类型")
+    index_nprobe: Optional[int] = Field(None, ge=1, le=1024, description="IVF 检索探测聚类数")
     is_public: Optional[bool] = Field(None, description="是否公开")
 
 
@@ -38,6 +42,8 @@ class KnowledgeBaseResponse(KnowledgeBaseBase):
     embedding_model: str
     chunk_size: int
     chunk_overlap: int
+    index_type: str = "flat"
+    index_nprobe: int = 16
 
     document_count: int
     total_chars: int
@@ -70,13 +76,17 @@ class KnowledgeDocumentResponse(KnowledgeDocumentBase):
     file_url: Optional[str] = None
     file_size: Optional[int] = None
     file_type: Optional[str] = None
+    content_hash: Optional[str] = None
 
     vector_id: Optional[str] = None
     chunk_count: int
+    char_count: Optional[int] = None
     status: str
+    progress: Optional[int] = None
+    error_message: Optional[str] = None
 
     content: Optional[str] = None
-    metadata: Optional[str] = None
+    metadata: Optional[str] = Field(None, validation_alias="doc_metadata")
 
     created_at: datetime
     updated_at: datetime
@@ -90,6 +100,7 @@ class KnowledgeQueryRequest(BaseModel):
     kb_id: int = Field(..., description="知识库ID")
     query: str = Field(..., min_length=1, max_length=500, description="查询问题")
     top_k: int = Field(5, ge=1, le=20, description="返回结果数量")
+    use_cache: bool = Field(True, description="是否允许返回缓存的回答")
 
 
 class KnowledgeQueryResponse(BaseModel):
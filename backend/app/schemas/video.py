@@ -20,6 +20,7 @@ class VideoTaskBase(BaseModel):
 class VideoTaskCreate(VideoTaskBase):
     """视频生成任务创建 Schema"""
     template_id: Optional[int] = Field(None, description="模板ID")
+    use_cache: bool = Field(True, description="是否复用相同参数任务的生成结果（false 时总是重新生成）")
 
 
 class VideoTaskResponse(VideoTaskBase):
@@ -40,6 +41,13 @@ class VideoTaskResponse(VideoTaskBase):
 
     provider_task_id: Optional[str] = None
     provider: str
+    segment_count: Optional[int] = None
+    # 已完成的长视频：各分段 MP4 地址（没有播放列表时逐段播放）
+    segment_urls: Optional[List[str]] = None
+
+    # 排队中的任务：全局排队位置（从 1 开始）与预计开始处理的时间
+    queue_position: Optional[int] = None
+    estimated_start_at: Optional[datetime] = None
 
     created_at: datetime
     updated_at: datetime
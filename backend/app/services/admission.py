@@ -0,0 +1,231 @@
+"""
+上游 AI 调用准入控制
+按服务商的 QPS（令牌桶）与并发上限放行请求，超出时排队；
+排队请求按会员优先级放行，同一优先级先到先得，排队耗时计入指标；
+后台任务优先级最低，使用单独的排队超时（默认一直等待），上游持续繁忙时不会因排队超时而失败
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+# 优先级：数值越小越先放行
+PRIORITY_HIGH = 0        # 会员配置中带 priority 功能的用户
+PRIORITY_NORMAL = 1      # 其他付费会员
+PRIORITY_LOW = 2         # 免费用户
+PRIORITY_BACKGROUND = 3  # 后台任务（文档向量化、任务状态轮询等）
+
+PRIORITY_NAMES = {
+    PRIORITY_HIGH: "high",
+    PRIORITY_NORMAL: "normal",
+    PRIORITY_LOW: "low",
+    PRIORITY_BACKGROUND: "background",
+}
+
+# 每个优先级保留的最近排队耗时样本数
+WAIT_SAMPLES = 1000
+
+
+class AdmissionTimeoutError(Exception):
+    """排队超时，上游繁忙"""
+
+
+def priority_for(user) -> int:
+    """根据会员类型获取调用优先级"""
+    if user.can_use_feature("priority"):
+        return PRIORITY_HIGH
+    if user.is_premium:
+        return PRIORITY_NORMAL
+    return PRIORITY_LOW
+
+
+class TokenBucket:
+    """令牌桶：平均速率 rate 个/秒，最多累积 burst 个"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self) -> bool:
+        """有令牌时取走一个并返回 True"""
+        if self.rate <= 0:
+            return True  # 不限速
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def time_until_token(self) -> float:
+        """距下一个令牌可用的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class AdmissionController:
+    """
+    单个上游服务的准入控制器
+
+    同时满足两个条件才放行：未超过并发上限、令牌桶有令牌；
+    不满足时请求进入优先级队列，由释放并发或令牌补充时的调度按优先级放行
+    """
+
+    def __init__(
+        self,
+        name: str,
+        qps: float,
+        burst: int,
+        max_concurrency: int,
+        queue_timeout: float,
+        background_queue_timeout: float = 0
+    ):
+        self.name = name
+        self.bucket = TokenBucket(qps, burst)
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.background_queue_timeout = background_queue_timeout
+        self.in_flight = 0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 指标
+        self.admitted = 0
+        self.timeouts = 0
+        self._waits: Dict[int, Deque[float]] = {}
+
+    @property
+    def queued(self) -> int:
+        """排队中的请求数"""
+        return sum(1 for _, _, future in self._queue if not future.done())
+
+    def _can_start(self) -> bool:
+        return self.in_flight < self.max_concurrency and self.bucket.try_take()
+
+    def _record_wait(self, priority: int, seconds: float) -> None:
+        self.admitted += 1
+        self._waits.setdefault(priority, deque(maxlen=WAIT_SAMPLES)).append(seconds)
+
+    def _dispatch(self) -> None:
+        """按优先级放行排队中的请求"""
+        self._timer = None
+        while self._queue:
+            _, _, future = self._queue[0]
+            if future.done():
+                # 已超时或被取消的等待者
+                heapq.heappop(self._queue)
+                continue
+            if self.in_flight >= self.max_concurrency:
+                return
+            if not self.bucket.try_take():
+                # 等令牌补充后再调度
+                self._timer = asyncio.get_running_loop().call_later(
+                    self.bucket.time_until_token(), self._dispatch
+                )
+                return
+            heapq.heappop(self._queue)
+            self.in_flight += 1
+            future.set_result(None)
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL) -> None:
+        """
+        获取调用许可，必须与 release 成对使用
+
+        Raises:
+            AdmissionTimeoutError: 排队超过 queue_timeout（后台任务为 background_queue_timeout，0 表示不超时）
+        """
+        start = time.monotonic()
+        timeout: Optional[float] = self.queue_timeout
+        if priority >= PRIORITY_BACKGROUND:
+            timeout = self.background_queue_timeout or None
+        if not self._queue and self._can_start():
+            self.in_flight += 1
+            self._record_wait(priority, 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        if self._timer is None:
+            self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # 超时的同时已被放行：归还许可
+                self.release()
+            future.cancel()
+            self.timeouts += 1
+            raise AdmissionTimeoutError(f"{self.name} 调用排队超时（{timeout}s）")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            future.cancel()
+            raise
+        self._record_wait(priority, time.monotonic() - start)
+
+    def release(self) -> None:
+        """归还调用许可"""
+        self.in_flight -= 1
+        if self._queue and self._timer is None:
+            self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_NORMAL) -> AsyncIterator[None]:
+        """在许可范围内执行一次上游调用"""
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """并发、排队与各优先级排队耗时（毫秒）"""
+        queue_wait = {}
+        for priority, samples in sorted(self._waits.items()):
+            ordered = sorted(samples)
+            queue_wait[PRIORITY_NAMES.get(priority, str(priority))] = {
+                "samples": len(ordered),
+                "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+                "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+                "max_ms": round(ordered[-1] * 1000, 1),
+            }
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "timeouts": self.timeouts,
+            "queue_wait": queue_wait,
+        }
+
+
+# 各上游服务的准入控制器
+qwen_admission = AdmissionController(
+    "qwen",
+    qps=settings.QWEN_MAX_QPS,
+    burst=settings.QWEN_BURST,
+    max_concurrency=settings.QWEN_MAX_CONCURRENCY,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+    background_queue_timeout=settings.ADMISSION_BACKGROUND_QUEUE_TIMEOUT,
+)
+wanxiang_admission = AdmissionController(
+    "wanxiang",
+    qps=settings.WANXIANG_MAX_QPS,
+    burst=settings.WANXIANG_BURST,
+    max_concurrency=settings.WANXIANG_MAX_CONCURRENCY,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+    background_queue_timeout=settings.ADMISSION_BACKGROUND_QUEUE_TIMEOUT,
+)
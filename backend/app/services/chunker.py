@@ -0,0 +1,122 @@
+"""
+文本分块服务
+以生成器方式流式切分文本，内存占用与文件大小无关
+"""
+import codecs
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Union
+
+# 句子结束符（中英文）
+SENTENCE_ENDINGS = frozenset("。！？；!?;…\n")
+# 次级断点（逗号、空白等）
+SOFT_BREAKS = frozenset("，、,：: \t")
+
+# 每次从文件读取的字节数
+READ_BLOCK_SIZE = 64 * 1024
+
+
+@dataclass(frozen=True)
+class TextChunk:
+    """文本分块"""
+    index: int          # 分块序号
+    start: int          # 在原文中的起始字符偏移
+    end: int            # 在原文中的结束字符偏移（不含）
+    text: str           # 分块内容
+
+
+def iter_file_text(
+    file_path: str,
+    encoding: str = "utf-8",
+    block_size: int = READ_BLOCK_SIZE
+) -> Iterator[str]:
+    """
+    按块读取并增量解码文本文件
+
+    Args:
+        file_path: 文件路径
+        encoding: 文件编码
+        block_size: 每次读取的字节数
+
+    Yields:
+        str: 解码后的文本片段
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            text = decoder.decode(block)
+            if text:
+                yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _find_cut(buffer: str, limit: int, min_pos: int) -> int:
+    """
+    在 buffer[:limit] 中寻找最合适的切分位置
+
+    优先在句末切分，其次在逗号/空白处，都找不到则硬切
+    """
+    for pos in range(limit, min_pos, -1):
+        if buffer[pos - 1] in SENTENCE_ENDINGS:
+            return pos
+    for pos in range(limit, min_pos, -1):
+        if buffer[pos - 1] in SOFT_BREAKS:
+            return pos
+    return limit
+
+
+def split_text(
+    text: Union[str, Iterable[str]],
+    chunk_size: int = 500,
+    chunk_overlap: int = 50
+) -> Iterator[TextChunk]:
+    """
+    将文本流切分为带偏移量的分块
+
+    Args:
+        text: 完整文本或文本片段迭代器（如 iter_file_text 的输出）
+        chunk_size: 分块最大字符数
+        chunk_overlap: 相邻分块重叠字符数
+
+    Yields:
+        TextChunk: 文本分块，偏移量基于原文字符位置
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size 必须大于 0")
+
+    # 重叠不超过分块大小的一半，保证每次切分都能前进
+    overlap = max(0, min(chunk_overlap, chunk_size // 2 - 1))
+    min_pos = chunk_size // 2
+
+    pieces = [text] if isinstance(text, str) else text
+    buffer = ""
+    offset = 0  # buffer[0] 在原文中的位置
+    index = 0
+
+    def emit(start: int, end: int) -> Iterator[TextChunk]:
+        nonlocal index
+        raw = buffer[start:end]
+        stripped = raw.strip()
+        if stripped:
+            begin = offset + start + len(raw) - len(raw.lstrip())
+            yield TextChunk(index=index, start=begin, end=begin + len(stripped), text=stripped)
+            index += 1
+
+    for piece in pieces:
+        buffer += piece
+        pos = 0
+        while len(buffer) - pos > chunk_size:
+            window = buffer[pos:pos + chunk_size]
+            cut = _find_cut(window, chunk_size, min_pos)
+            yield from emit(pos, pos + cut)
+            pos += cut - overlap
+        # 只保留未切分的尾部，缓冲区大小不超过 chunk_size + 读取块大小
+        buffer = buffer[pos:]
+        offset += pos
+
+    if buffer:
+        yield from emit(0, len(buffer))
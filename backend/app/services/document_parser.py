@@ -0,0 +1,166 @@
+"""
+文档文本提取
+PDF / DOCX / DOC 解析是 CPU 密集型操作，由 ingestion_worker 在进程池中调用；
+提取的文本直接写入文件而不是作为返回值，避免大段文本在进程间序列化
+"""
+import os
+import shutil
+import subprocess
+from typing import Callable, Optional, TextIO
+
+try:
+    from pypdf import PdfReader
+    PDF_AVAILABLE = True
+except ImportError:
+    PDF_AVAILABLE = False
+
+try:
+    import docx
+    DOCX_AVAILABLE = True
+except ImportError:
+    DOCX_AVAILABLE = False
+
+# 进度回调：(已处理数, 总数)
+ProgressCallback = Callable[[int, int], None]
+
+# antiword 单个 .doc 文件的解析超时（秒）
+DOC_CONVERT_TIMEOUT = 300
+
+
+class DocumentParseError(Exception):
+    """文档无法解析"""
+
+
+def _noop_progress(done: int, total: int) -> None:
+    pass
+
+
+def _extract_pdf(src: str, out: TextIO, progress: ProgressCallback) -> int:
+    """逐页提取 PDF 文本"""
+    if not PDF_AVAILABLE:
+        raise DocumentParseError("未安装 pypdf，无法解析 PDF")
+
+    reader = PdfReader(src)
+    if reader.is_encrypted:
+        try:
+            reader.decrypt("")
+        except Exception:
+            raise DocumentParseError("PDF 已加密")
+
+    total = len(reader.pages)
+    chars = 0
+    for i, page in enumerate(reader.pages, start=1):
+        text = (page.extract_text() or "").strip()
+        if text:
+            out.write(text)
+            out.write("\n\n")
+            chars += len(text) + 2
+        progress(i, total)
+    return chars
+
+
+def _extract_docx(src: str, out: TextIO, progress: ProgressCallback) -> int:
+    """提取 DOCX 段落与表格文本"""
+    if not DOCX_AVAILABLE:
+        raise DocumentParseError("未安装 python-docx，无法解析 DOCX")
+
+    document = docx.Document(src)
+    paragraphs = document.paragraphs
+    tables = document.tables
+    total = len(paragraphs) + len(tables)
+    chars = 0
+
+    for i, paragraph in enumerate(paragraphs, start=1):
+        text = paragraph.text.strip()
+        if text:
+            out.write(text)
+            out.write("\n")
+            chars += len(text) + 1
+        if i % 200 == 0:
+            progress(i, total)
+
+    for i, table in enumerate(tables, start=len(paragraphs) + 1):
+        for row in table.rows:
+            text = "\t".join(cell.text.strip() for cell in row.cells)
+            if text.strip():
+                out.write(text)
+                out.write("\n")
+                chars += len(text) + 1
+        progress(i, total)
+
+    progress(total, total)
+    return chars
+
+
+def _extract_doc(src: str, out: TextIO, progress: ProgressCallback) -> int:
+    """通过 antiword 提取旧版 Word（.doc）文本"""
+    antiword = shutil.which("antiword")
+    if antiword is None:
+        raise DocumentParseError("服务器未安装 antiword，无法解析 .doc，请转换为 .docx 后上传")
+
+    result = subprocess.run(
+        [antiword, "-w", "0", src],
+        capture_output=True,
+        timeout=DOC_CONVERT_TIMEOUT
+    )
+    if result.returncode != 0:
+        raise DocumentParseError(result.stderr.decode("utf-8", errors="replace").strip() or "antiword 解析失败")
+
+    text = result.stdout.decode("utf-8", errors="replace")
+    out.write(text)
+    progress(1, 1)
+    return len(text)
+
+
+_EXTRACTORS = {
+    ".pdf": _extract_pdf,
+    ".docx": _extract_docx,
+    ".doc": _extract_doc,
+}
+
+
+def supports(file_type: str) -> bool:
+    """是否支持提取该类型文件的文本"""
+    return file_type in _EXTRACTORS
+
+
+def extract_text_to_file(
+    src: str,
+    file_type: str,
+    dest: str,
+    progress: Optional[ProgressCallback] = None
+) -> int:
+    """
+    提取文档文本并写入 UTF-8 文本文件
+
+    先写入临时文件，成功后原子替换为 dest，失败时不留下半成品
+
+    Args:
+        src: 源文件路径
+        file_type: 文件扩展名（如 .pdf）
+        dest: 文本输出路径
+        progress: 进度回调
+
+    Returns:
+        int: 提取的字符数
+
+    Raises:
+        DocumentParseError: 不支持的类型或解析失败
+    """
+    extractor = _EXTRACTORS.get(file_type)
+    if extractor is None:
+        raise DocumentParseError(f"不支持解析 {file_type} 文件")
+
+    tmp_path = f"{dest}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            chars = extractor(src, out, progress or _noop_progress)
+        os.replace(tmp_path, dest)
+    except DocumentParseError:
+        raise
+    except Exception as e:
+        raise DocumentParseError(f"{type(e).__name__}: {e}") from e
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return chars
@@ -0,0 +1,308 @@
+"""
+分段并行下载
+服务端支持 Range 时按 DOWNLOAD_PART_SIZE 把文件切成若干段，最多 DOWNLOAD_CONCURRENCY 段同时下载，
+各段用 os.pwrite 写入预分配的 <目标>.part 的对应偏移（在线程池中执行，不阻塞事件循环）；
+已写入的进度定期记录在 <目标>.part.json，下载失败后再次下载同一目标时只补齐缺失部分；
+全部完成后校验文件大小，再原子重命名为目标文件
+"""
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import httpx
+from loguru import logger
+
+from app.core.config import settings
+from app.services.http_clients import get_httpx_client
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 攒够该大小再写盘，减少线程切换
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# 进度文件的最短保存间隔（秒）
+STATE_SAVE_INTERVAL = 1.0
+
+
+class DownloadError(Exception):
+    """下载失败（HTTP 错误、数据不完整或大小不符）"""
+
+
+class _RangeIgnored(Exception):
+    """分段请求返回了整个文件（源文件已变化，或服务端不支持 If-Range）"""
+
+
+@dataclass
+class _Part:
+    """一个下载分段：[start, end] 闭区间，done 为已写入的字节数"""
+
+    start: int
+    end: int
+    done: int = 0
+
+    @property
+    def offset(self) -> int:
+        return self.start + self.done
+
+    @property
+    def remaining(self) -> int:
+        return self.end - self.start + 1 - self.done
+
+    @property
+    def complete(self) -> bool:
+        return self.remaining <= 0
+
+
+def _split(total: int, part_size: int) -> List[_Part]:
+    return [_Part(start, min(start + part_size, total) - 1) for start in range(0, total, part_size)]
+
+
+def _parse_total(content_range: Optional[str]) -> Optional[int]:
+    """从 “bytes 0-0/12345” 中取出文件总大小"""
+    if not content_range or "/" not in content_range:
+        return None
+    total = content_range.rsplit("/", 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+
+async def _probe(client: httpx.AsyncClient, url: str) -> Tuple[Optional[int], bool, Optional[str]]:
+    """
+    请求第一个字节，判断文件大小与是否支持 Range
+
+    不用 HEAD：对象存储的签名地址通常只对 GET 有效
+
+    Returns:
+        (文件大小, 是否支持 Range, 校验标识 ETag/Last-Modified)
+    """
+    async with client.stream("GET", url, headers={"Range": "bytes=0-0"}) as response:
+        etag = response.headers.get("etag")
+        if etag and etag.startswith("W/"):
+            # If-Range 只接受强校验：弱 ETag 会使服务端总是返回 200 整个文件
+            etag = None
+        validator = etag or response.headers.get("last-modified")
+        if response.status_code == 206:
+            total = _parse_total(response.headers.get("content-range"))
+            return total, total is not None, validator
+        if response.status_code == 200:
+            length = response.headers.get("content-length")
+            return (int(length) if length and length.isdigit() else None), False, validator
+        raise DownloadError(f"下载失败: HTTP {response.status_code}")
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _load_state(state_path: str, total: int, validator: Optional[str]) -> Optional[List[_Part]]:
+    """读取上次的进度；文件大小或校验标识变化（源文件已更新）时返回 None"""
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("total") != total or state.get("validator") != validator:
+            return None
+        return [_Part(start, end, done) for start, end, done in state["parts"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _save_state(state_path: str, total: int, validator: Optional[str], parts: List[_Part]) -> None:
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "total": total,
+            "validator": validator,
+            "parts": [[part.start, part.end, part.done] for part in parts],
+        }, f)
+    os.replace(tmp_path, state_path)
+
+
+def _lock(fd: int, path: str) -> None:
+    """独占 .part 文件，防止同一目标被两个下载同时写入"""
+    if fcntl is None:
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        raise DownloadError(f"文件正在被其他进程下载: {path}")
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class RangedDownload:
+    """单个文件的下载过程"""
+
+    def __init__(self, url: str, dest: str, client: Optional[httpx.AsyncClient] = None):
+        self.url = url
+        self.dest = dest
+        self.part_path = f"{dest}.part"
+        self.state_path = f"{dest}.part.json"
+        self.client = client or get_httpx_client()
+        self.total: Optional[int] = None
+        self.validator: Optional[str] = None
+        self.parts: List[_Part] = []
+        self.resumed_bytes = 0
+        self._fd = -1
+        self._saved_at = 0.0
+        self._state_lock = asyncio.Lock()
+
+    async def run(self) -> int:
+        """下载到 dest，返回文件大小"""
+        os.makedirs(os.path.dirname(self.dest) or ".", exist_ok=True)
+        self.total, ranged, self.validator = await _probe(self.client, self.url)
+
+        self._fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            _lock(self._fd, self.part_path)
+            if ranged and self.total:
+                try:
+                    await self._download_parts()
+                except _RangeIgnored:
+                    logger.warning(f"服务端未按分段返回，改为整体下载: {self.dest}")
+                    self.parts = []
+                    await self._download_single()
+            else:
+                await self._download_single()
+            await asyncio.to_thread(os.fsync, self._fd)
+            size = os.fstat(self._fd).st_size
+        finally:
+            os.close(self._fd)
+
+        if self.total is not None and size != self.total:
+            raise DownloadError(f"文件大小不符: 期望 {self.total}，实际 {size}")
+        os.replace(self.part_path, self.dest)
+        _remove(self.state_path)
+        return size
+
+    async def _download_parts(self) -> None:
+        parts = await asyncio.to_thread(_load_state, self.state_path, self.total, self.validator)
+        if parts is not None and os.fstat(self._fd).st_size == self.total:
+            self.resumed_bytes = sum(part.done for part in parts)
+            if self.resumed_bytes:
+                logger.info(f"继续下载: {self.dest}, 已完成 {self.resumed_bytes}/{self.total} 字节")
+        else:
+            parts = _split(self.total, settings.DOWNLOAD_PART_SIZE)
+            await asyncio.to_thread(os.ftruncate, self._fd, self.total)
+        self.parts = parts
+
+        semaphore = asyncio.Semaphore(settings.DOWNLOAD_CONCURRENCY)
+        tasks = [
+            asyncio.create_task(self._fetch_part(semaphore, part))
+            for part in parts if not part.complete
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # 保留已写入的进度，下次从断点继续
+            await self._save_state(force=True)
+            raise
+
+    async def _fetch_part(self, semaphore: asyncio.Semaphore, part: _Part) -> None:
+        async with semaphore:
+            for attempt in range(settings.DOWNLOAD_RETRY_ATTEMPTS):
+                try:
+                    await self._fetch_range(part)
+                    return
+                except (httpx.TransportError, DownloadError) as e:
+                    if attempt + 1 >= settings.DOWNLOAD_RETRY_ATTEMPTS:
+                        raise DownloadError(f"分段下载失败: bytes={part.offset}-{part.end}, {e}") from e
+                    await self._save_state(force=True)
+                    await asyncio.sleep(min(2 ** attempt, 10))
+
+    async def _fetch_range(self, part: _Part) -> None:
+        headers = {"Range": f"bytes={part.offset}-{part.end}"}
+        if self.validator:
+            # 源文件已变化时服务端返回 200 整个文件，而不是拼接出错的内容
+            headers["If-Range"] = self.validator
+        async with self.client.stream("GET", self.url, headers=headers) as response:
+            if response.status_code == 200:
+                raise _RangeIgnored()
+            if response.status_code != 206:
+                raise DownloadError(f"HTTP {response.status_code}")
+            buffer = bytearray()
+            async for chunk in response.aiter_bytes():
+                buffer += chunk
+                if len(buffer) >= WRITE_BUFFER_SIZE:
+                    await self._write(part, buffer)
+                    buffer = bytearray()
+            if buffer:
+                await self._write(part, buffer)
+        if not part.complete:
+            raise DownloadError("分段数据不完整")
+
+    async def _write(self, part: _Part, buffer: bytearray) -> None:
+        data = bytes(buffer[:part.remaining])
+        await asyncio.to_thread(_pwrite_all, self._fd, data, part.offset)
+        part.done += len(data)
+        await self._save_state()
+
+    async def _save_state(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._saved_at < STATE_SAVE_INTERVAL:
+            return
+        self._saved_at = now
+        async with self._state_lock:
+            try:
+                await asyncio.to_thread(_save_state, self.state_path, self.total, self.validator, self.parts)
+            except OSError as e:
+                logger.warning(f"保存下载进度失败: {self.state_path}, {e}")
+
+    async def _download_single(self) -> None:
+        """服务端不支持 Range（或分段请求返回了整个文件）：顺序下载整个文件，无法续传"""
+        await asyncio.to_thread(os.ftruncate, self._fd, 0)
+        _remove(self.state_path)
+        async with self.client.stream("GET", self.url) as response:
+            if response.status_code != 200:
+                raise DownloadError(f"下载失败: HTTP {response.status_code}")
+            length = response.headers.get("content-length")
+            # 源文件可能已变化，按本次响应校验大小
+            self.total = int(length) if length and length.isdigit() else None
+            offset = 0
+            buffer = bytearray()
+            async for chunk in response.aiter_bytes():
+                buffer += chunk
+                if len(buffer) >= WRITE_BUFFER_SIZE:
+                    await asyncio.to_thread(_pwrite_all, self._fd, bytes(buffer), offset)
+                    offset += len(buffer)
+                    buffer = bytearray()
+            if buffer:
+                await asyncio.to_thread(_pwrite_all, self._fd, bytes(buffer), offset)
+
+
+async def download_file(url: str, dest: str, client: Optional[httpx.AsyncClient] = None) -> int:
+    """
+    下载文件到 dest，返回文件大小
+
+    Raises:
+        DownloadError: 下载失败；已下载的部分保留在 <dest>.part，再次调用时继续
+    """
+    download = RangedDownload(url, dest, client)
+    start = time.perf_counter()
+    try:
+        size = await download.run()
+    except httpx.HTTPError as e:
+        raise DownloadError(f"下载失败: {e}") from e
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"下载完成: {dest}, {size} 字节, {len(download.parts) or 1} 段, "
+        f"续传 {download.resumed_bytes} 字节, {elapsed:.1f}s"
+    )
+    return size
+
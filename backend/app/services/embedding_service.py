@@ -0,0 +1,158 @@
+"""
+文本向量化服务
+在 QwenService.embed 之上提供批量并发请求、内容去重与磁盘缓存
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+
+
+class EmbeddingCache:
+    """
+    基于 SQLite 的向量磁盘缓存
+
+    以 (模型, sha256(文本)) 为键保存 float32 向量，
+    同一文本只需向量化一次，文档重新上传或小幅修改时只需处理变化的分块
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.path.join(settings.VECTOR_STORE_DIR, "embedding_cache.sqlite3")
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程一个连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, "
+                "text_hash TEXT NOT NULL, "
+                "vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        """批量读取缓存，返回命中的 {hash: 向量}"""
+        conn = self._connect()
+        found = {}
+        # SQLite 默认最多 999 个绑定参数
+        for start in range(0, len(hashes), 900):
+            part = hashes[start:start + 900]
+            placeholders = ",".join("?" * len(part))
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *part]
+            ).fetchall()
+            for text_hash, blob in rows:
+                found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, model: str, items: Dict[str, Sequence[float]]) -> None:
+        """批量写入缓存"""
+        if not items:
+            return
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [
+                    (model, text_hash, np.asarray(vector, dtype=np.float32).tobytes())
+                    for text_hash, vector in items.items()
+                ]
+            )
+
+
+def text_hash(text: str) -> str:
+    """文本内容哈希"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingService:
+    """文本向量化服务"""
+
+    def __init__(self, cache: Optional[EmbeddingCache] = None):
+        self.cache = cache or EmbeddingCache()
+        self.batch_size = settings.EMBEDDING_BATCH_SIZE
+        self.concurrency = settings.EMBEDDING_CONCURRENCY
+
+    async def embed_texts(
+        self,
+        texts: Sequence[str],
+        model: str = "text-embedding-v1",
+        text_type: str = "document"
+    ) -> List[List[float]]:
+        """
+        批量向量化文本
+
+        相同内容只请求一次，缓存命中的文本不再请求；
+        未命中的文本按 EMBEDDING_BATCH_SIZE 分批、最多 EMBEDDING_CONCURRENCY 批并发请求
+
+        Args:
+            texts: 待向量化的文本列表
+            model: 嵌入模型
+            text_type: document（入库文本）/ query（查询文本）
+
+        Returns:
+            与 texts 顺序一致的向量列表
+        """
+        if not texts:
+            return []
+
+        from app.services.qwen_service import qwen_service
+        from app.services.admission import PRIORITY_NORMAL, PRIORITY_BACKGROUND
+
+        # document 与 query 的向量不同，分别缓存
+        cache_model = model if text_type == "document" else f"{model}#{text_type}"
+        # 查询向量化在用户请求路径上，文档向量化是后台任务，排在用户请求之后
+        priority = PRIORITY_BACKGROUND if text_type == "document" else PRIORITY_NORMAL
+        hashes = [text_hash(text) for text in texts]
+
+        unique: Dict[str, str] = {}
+        for h, text in zip(hashes, texts):
+            unique.setdefault(h, text)
+
+        vectors = await asyncio.to_thread(self.cache.get_many, cache_model, list(unique))
+        missing = [h for h in unique if h not in vectors]
+
+        if missing:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def embed_batch(batch_hashes: List[str]) -> Dict[str, List[float]]:
+                async with semaphore:
+                    result = await qwen_service.embed(
+                        [unique[h] for h in batch_hashes],
+                        model=model,
+                        text_type=text_type,
+                        priority=priority
+                    )
+                fresh = dict(zip(batch_hashes, result))
+                await asyncio.to_thread(self.cache.put_many, cache_model, fresh)
+                return fresh
+
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            for fresh in await asyncio.gather(*(embed_batch(batch) for batch in batches)):
+                vectors.update(fresh)
+
+        logger.debug(
+            f"文本向量化: 共 {len(texts)} 条, 去重后 {len(unique)} 条, "
+            f"缓存命中 {len(unique) - len(missing)} 条, 请求 {len(missing)} 条"
+        )
+        return [vectors[h] for h in hashes]
+
+
+# 全局实例
+embedding_service = EmbeddingService()
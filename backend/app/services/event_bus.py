@@ -0,0 +1,236 @@
+"""
+按用户分发的事件通道
+发布方（视频任务 worker、轮询等）推送事件，订阅方（SSE 连接）实时接收；
+每个用户保留最近的事件，客户端断线重连时可从 Last-Event-ID 之后继续接收。
+后端由 EVENT_BUS_BACKEND 配置：memory（进程内，worker 与 API 同进程时使用）
+或 redis（Redis Streams，多实例或独立部署 worker 时使用）
+"""
+import asyncio
+import itertools
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Set
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.database import get_redis
+
+# 重置事件：客户端状态未知（首次连接或断线太久），需要发送全量快照
+EVENT_RESET = "reset"
+
+# Redis Stream 键前缀
+STREAM_PREFIX = "events:user:"
+
+# 进程内后端每发布多少次清理一次过期用户
+PRUNE_INTERVAL = 1000
+
+
+@dataclass
+class Event:
+    """单个事件"""
+
+    id: Optional[str]
+    event: str
+    data: Any = None
+
+
+class EventBus(ABC):
+    """事件通道接口"""
+
+    name = "base"
+
+    @abstractmethod
+    async def publish(self, user_id: int, event: str, data: Any) -> str:
+        """向用户发布事件，返回事件 ID"""
+
+    @abstractmethod
+    def subscribe(
+        self,
+        user_id: int,
+        last_event_id: Optional[str],
+        keepalive: float
+    ) -> AsyncIterator[Optional[Event]]:
+        """
+        订阅用户事件
+
+        先产出 last_event_id 之后的历史事件；无法续传（未提供或已过期）时先产出一个 reset 事件。
+        之后持续产出新事件，keepalive 秒内没有事件时产出 None（用于发送保活）
+        """
+
+
+class MemoryEventBus(EventBus):
+    """
+    进程内事件通道
+
+    事件 ID 为 “启动时间戳-序号”，进程重启后旧 ID 无法续传，订阅时返回 reset
+    """
+
+    name = "memory"
+
+    def __init__(self, history_size: int, history_ttl: float):
+        self.history_size = history_size
+        self.history_ttl = history_ttl
+        self._epoch = str(int(time.time() * 1000))
+        self._seq = itertools.count(1)
+        self._history: Dict[int, Deque[Event]] = {}
+        self._last_publish: Dict[int, float] = {}
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._published = 0
+
+    def _parse(self, event_id: Optional[str]) -> Optional[int]:
+        """返回本进程事件 ID 的序号，其他进程或格式错误返回 None"""
+        if not event_id:
+            return None
+        epoch, _, seq = event_id.partition("-")
+        if epoch != self._epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    async def publish(self, user_id: int, event: str, data: Any) -> str:
+        item = Event(id=f"{self._epoch}-{next(self._seq)}", event=event, data=data)
+        history = self._history.get(user_id)
+        if history is None:
+            history = self._history[user_id] = deque(maxlen=self.history_size)
+        history.append(item)
+        self._last_publish[user_id] = time.monotonic()
+        for queue in self._subscribers.get(user_id, ()):
+            queue.put_nowait(item)
+
+        self._published += 1
+        if self._published % PRUNE_INTERVAL == 0:
+            self._prune()
+        return item.id
+
+    def _prune(self) -> None:
+        """清理长时间没有新事件、也没有订阅者的用户"""
+        deadline = time.monotonic() - self.history_ttl
+        for user_id in [uid for uid, ts in self._last_publish.items() if ts < deadline]:
+            if not self._subscribers.get(user_id):
+                self._history.pop(user_id, None)
+                self._last_publish.pop(user_id, None)
+
+    async def subscribe(
+        self,
+        user_id: int,
+        last_event_id: Optional[str],
+        keepalive: float
+    ) -> AsyncIterator[Optional[Event]]:
+        queue: asyncio.Queue = asyncio.Queue()
+        # 先注册再读取历史，两者之间发布的事件不会丢失（按序号去重）
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        try:
+            last_seq = self._parse(last_event_id)
+            history = list(self._history.get(user_id, ()))
+            oldest = self._parse(history[0].id) if history else None
+            if last_seq is None or (oldest is not None and last_seq < oldest - 1):
+                yield Event(id=None, event=EVENT_RESET)
+                last_seq = self._parse(history[-1].id) if history else 0
+            else:
+                for item in history:
+                    if self._parse(item.id) > last_seq:
+                        last_seq = self._parse(item.id)
+                        yield item
+
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                seq = self._parse(item.id)
+                if seq > last_seq:
+                    last_seq = seq
+                    yield item
+        finally:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+
+def _stream_id_tuple(event_id: str):
+    ms, _, seq = event_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+class RedisEventBus(EventBus):
+    """
+    Redis Streams 事件通道，多个 API 实例与 worker 共享
+
+    每个用户一个 Stream，按 history_size 近似裁剪，history_ttl 秒无新事件后整体过期
+    """
+
+    name = "redis"
+
+    def __init__(self, redis, history_size: int, history_ttl: float):
+        self.redis = redis
+        self.history_size = history_size
+        self.history_ttl = int(history_ttl)
+
+    async def publish(self, user_id: int, event: str, data: Any) -> str:
+        key = f"{STREAM_PREFIX}{user_id}"
+        event_id = await self.redis.xadd(
+            key,
+            {"event": event, "data": json.dumps(data, ensure_ascii=False, default=str)},
+            maxlen=self.history_size,
+            approximate=True
+        )
+        await self.redis.expire(key, self.history_ttl)
+        return event_id
+
+    async def subscribe(
+        self,
+        user_id: int,
+        last_event_id: Optional[str],
+        keepalive: float
+    ) -> AsyncIterator[Optional[Event]]:
+        key = f"{STREAM_PREFIX}{user_id}"
+        resumable = False
+        if last_event_id:
+            try:
+                last = _stream_id_tuple(last_event_id)
+                first = await self.redis.xrange(key, count=1)
+                # Stream 已过期，或最早保留的事件晚于客户端最后收到的事件：中间的事件可能已丢失
+                resumable = bool(first) and _stream_id_tuple(first[0][0]) <= last
+            except ValueError:
+                resumable = False
+
+        if not resumable:
+            latest = await self.redis.xrevrange(key, count=1)
+            last_event_id = latest[0][0] if latest else "0-0"
+            yield Event(id=None, event=EVENT_RESET)
+
+        block_ms = max(1, int(keepalive * 1000))
+        while True:
+            response = await self.redis.xread({key: last_event_id}, count=100, block=block_ms)
+            if not response:
+                yield None
+                continue
+            for _, entries in response:
+                for entry_id, fields in entries:
+                    last_event_id = entry_id
+                    yield Event(id=entry_id, event=fields.get("event", "message"), data=json.loads(fields.get("data", "null")))
+
+
+# 延迟初始化事件通道实例
+_event_bus_instance: Optional[EventBus] = None
+
+
+def get_event_bus() -> EventBus:
+    """根据 EVENT_BUS_BACKEND 获取事件通道"""
+    global _event_bus_instance
+    if _event_bus_instance is None:
+        if settings.EVENT_BUS_BACKEND == "redis":
+            redis = get_redis()
+            if redis is not None:
+                _event_bus_instance = RedisEventBus(redis, settings.EVENT_HISTORY_SIZE, settings.EVENT_HISTORY_TTL)
+            else:
+                logger.warning("Redis 不可用（未安装 redis 包），事件通道使用进程内后端")
+        if _event_bus_instance is None:
+            _event_bus_instance = MemoryEventBus(settings.EVENT_HISTORY_SIZE, settings.EVENT_HISTORY_TTL)
+    return _event_bus_instance
@@ -0,0 +1,214 @@
+"""
+受保护文件的发送
+接口先完成认证与归属检查，文件传输不占用应用：
+配置 FILE_ACCEL_REDIRECT_PREFIX 时只返回 X-Accel-Redirect 头，由 nginx 从 internal location 直接发送
+（Range、缓存校验由 nginx 处理）；未配置时由应用发送，支持单段 Range、If-Range、
+If-None-Match 与 If-Modified-Since，ASGI 服务器支持 zerocopysend 扩展时用 sendfile 发送，
+否则在线程池中按块 pread，内存占用与文件大小无关
+"""
+import asyncio
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import Response
+
+from app.core.config import settings
+
+# 应用发送时每次读取的块大小
+CHUNK_SIZE = 256 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    """请求的范围超出文件大小"""
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段 Range 头，返回 [start, end] 闭区间
+
+    没有 Range、格式无法识别、范围无效（last < first）或请求多段时返回 None（发送整个文件）
+
+    Raises:
+        RangeNotSatisfiable: 范围超出文件大小
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, sep, last = header[6:].strip().partition("-")
+    first, last = first.strip(), last.strip()
+    if not sep or not (first or last) or not all(value.isascii() and value.isdigit() for value in (first, last) if value):
+        return None
+    if first:
+        start = int(first)
+        end = size - 1
+        if last:
+            if int(last) < start:
+                # 语法上无效的范围按 RFC 7233 忽略，而不是返回 416
+                return None
+            end = min(int(last), end)
+    else:
+        # bytes=-N：最后 N 个字节
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        start, end = max(0, size - length), size - 1
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def _etag_list(header: str) -> List[str]:
+    return [tag.strip().removeprefix("W/") for tag in header.split(",") if tag.strip()]
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """If-None-Match 优先；没有时按 If-Modified-Since 判断"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = _etag_list(if_none_match)
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _range_applies(request: Request, etag: str, last_modified: str) -> bool:
+    """If-Range 与当前版本不一致时忽略 Range，发送整个文件"""
+    if_range = request.headers.get("if-range")
+    if not if_range:
+        return True
+    return if_range.strip() in (etag, last_modified)
+
+
+def _content_disposition(filename: str, inline: bool) -> str:
+    """兼容中文文件名（RFC 6266 / 5987）"""
+    kind = "inline" if inline else "attachment"
+    if filename.isascii():
+        fallback = filename.replace('"', "")
+    else:
+        fallback = "download" + os.path.splitext(filename)[1].encode("ascii", "ignore").decode()
+    return f"{kind}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def _accel_uri(path: str) -> Optional[str]:
+    """UPLOAD_DIR 下文件在 nginx internal location 中的地址，不在 UPLOAD_DIR 下时返回 None"""
+    prefix = settings.FILE_ACCEL_REDIRECT_PREFIX
+    if not prefix:
+        return None
+    relative = os.path.relpath(os.path.realpath(path), os.path.realpath(settings.UPLOAD_DIR))
+    if relative.startswith(os.pardir):
+        return None
+    return prefix.rstrip("/") + "/" + quote(relative.replace(os.sep, "/"))
+
+
+class FileRangeResponse(Response):
+    """发送文件的 [start, end] 区间，不把文件读入内存"""
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: dict, media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-length"] = str(max(0, end - start + 1))
+
+    async def __call__(self, scope, receive, send) -> None:
+        file = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            count = self.end - self.start + 1
+            if scope.get("method") == "HEAD" or count <= 0:
+                await send({"type": "http.response.body", "body": b""})
+            elif "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.start,
+                    "count": count,
+                })
+            else:
+                fd = file.fileno()
+                offset = self.start
+                while count > 0:
+                    data = await asyncio.to_thread(os.pread, fd, min(CHUNK_SIZE, count), offset)
+                    if not data:
+                        # 发送期间文件被截断
+                        break
+                    offset += len(data)
+                    count -= len(data)
+                    await send({"type": "http.response.body", "body": data, "more_body": count > 0})
+                if count > 0:
+                    await send({"type": "http.response.body", "body": b""})
+        finally:
+            await asyncio.to_thread(file.close)
+        if self.background is not None:
+            await self.background()
+
+
+async def file_response(
+    request: Request,
+    path: str,
+    filename: Optional[str] = None,
+    media_type: Optional[str] = None,
+    inline: bool = True,
+    etag: Optional[str] = None
+) -> Response:
+    """
+    发送已通过权限检查的本地文件
+
+    Args:
+        path: 文件路径
+        filename: 下载时的文件名，默认取路径中的文件名
+        media_type: 内容类型，默认按文件名推断
+        inline: 浏览器内直接打开（视频播放）还是作为附件下载
+        etag: 内容不变的文件（如按哈希存储）可传入内容哈希，默认由大小与修改时间生成
+
+    Raises:
+        HTTPException: 文件不存在
+    """
+    try:
+        stat = await asyncio.to_thread(os.stat, path)
+    except OSError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="文件不存在")
+
+    filename = filename or os.path.basename(path)
+    media_type = media_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    headers = {
+        "Content-Disposition": _content_disposition(filename, inline),
+        "Cache-Control": "private, max-age=3600",
+    }
+
+    accel_uri = await asyncio.to_thread(_accel_uri, path)
+    if accel_uri is not None:
+        headers["X-Accel-Redirect"] = accel_uri
+        return Response(status_code=status.HTTP_200_OK, headers=headers, media_type=media_type)
+
+    size = stat.st_size
+    etag = f'"{etag}"' if etag else f'"{stat.st_mtime_ns:x}-{size:x}"'
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers.update({"ETag": etag, "Last-Modified": last_modified, "Accept-Ranges": "bytes"})
+
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    start, end, status_code = 0, size - 1, status.HTTP_200_OK
+    if _range_applies(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={"Content-Range": f"bytes */{size}", "Accept-Ranges": "bytes"}
+            )
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    return FileRangeResponse(path, start, end, status_code, headers, media_type)
@@ -0,0 +1,272 @@
+"""
+文件存储服务
+流式接收 multipart 上传：边接收边写盘、边计算哈希、边检查大小，内存占用与文件大小无关
+
+上传文件按内容寻址保存在 {UPLOAD_DIR}/blobs/ab/cd/<sha256>，
+相同内容只存一份，由 file_blobs 表记录被多少个文档引用，引用数归零时删除。
+数据库记录与磁盘文件不在同一事务中：文件只在提交之后放入或删除，事务回滚时磁盘保持不变
+"""
+import hashlib
+import os
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional
+
+import aiofiles
+from fastapi import Request
+from loguru import logger
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.storage import FileBlob
+
+
+class UploadError(Exception):
+    """上传请求格式错误"""
+
+
+class UploadTooLargeError(UploadError):
+    """上传文件超过大小限制"""
+
+
+@dataclass
+class StoredUpload:
+    """已写入磁盘的上传文件"""
+    filename: str       # 客户端提供的文件名
+    path: str           # 临时文件路径
+    size: int           # 文件大小（字节）
+    sha256: str         # 内容哈希
+
+
+class _FilePartCollector:
+    """multipart 解析回调：只收集指定字段的文件数据，其余字段丢弃"""
+
+    def __init__(self, field_name: str):
+        self.field_name = field_name
+        self.filename: Optional[str] = None
+        self.pending: List[bytes] = []
+        self.finished = False
+        self._in_target = False
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+
+    def on_part_begin(self) -> None:
+        self._in_target = False
+        self._disposition = b""
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        if name == self.field_name and b"filename" in options and self.filename is None:
+            self.filename = os.path.basename(options[b"filename"].decode("utf-8", errors="replace"))
+            self._in_target = True
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_target:
+            self.pending.append(data[start:end])
+
+    def on_part_end(self) -> None:
+        if self._in_target:
+            self.finished = True
+            self._in_target = False
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+
+async def receive_upload(
+    request: Request,
+    dest_dir: str,
+    max_size: int,
+    field_name: str = "file"
+) -> StoredUpload:
+    """
+    流式接收 multipart/form-data 中的单个文件
+
+    请求体按网络分片到达即解析并写入临时文件，同时计算 sha256；
+    超过大小限制立即中止并删除临时文件
+
+    Args:
+        request: 请求对象
+        dest_dir: 临时文件目录
+        max_size: 最大文件大小（字节）
+        field_name: 文件字段名
+
+    Returns:
+        StoredUpload: 临时文件信息，调用方负责移动或删除
+
+    Raises:
+        UploadTooLargeError: 文件超过大小限制
+        UploadError: 请求格式错误或缺少文件
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("请求必须为 multipart/form-data")
+
+    # 请求体明显超限时不必接收
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size + 64 * 1024:
+        raise UploadTooLargeError()
+
+    os.makedirs(dest_dir, exist_ok=True)
+    tmp_path = os.path.join(dest_dir, f".upload-{uuid.uuid4().hex}")
+    collector = _FilePartCollector(field_name)
+    parser = MultipartParser(params[b"boundary"], collector.callbacks())
+    hasher = hashlib.sha256()
+    size = 0
+
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                for data in collector.pending:
+                    size += len(data)
+                    if size > max_size:
+                        raise UploadTooLargeError()
+                    hasher.update(data)
+                    await f.write(data)
+                collector.pending.clear()
+        parser.finalize()
+    except BaseException as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if isinstance(e, MultipartParseError):
+            raise UploadError(f"multipart 请求体格式错误: {e}") from e
+        raise
+
+    if collector.filename is None or not collector.finished:
+        os.remove(tmp_path)
+        raise UploadError(f"缺少文件字段 {field_name}")
+
+    return StoredUpload(
+        filename=collector.filename,
+        path=tmp_path,
+        size=size,
+        sha256=hasher.hexdigest(),
+    )
+
+
+# ========== 内容寻址存储 ==========
+
+def blob_dir() -> str:
+    """内容寻址存储根目录"""
+    return os.path.join(settings.UPLOAD_DIR, "blobs")
+
+
+def upload_tmp_dir() -> str:
+    """上传临时文件目录（与存储目录同一文件系统，os.replace 为原子操作）"""
+    return os.path.join(blob_dir(), "tmp")
+
+
+def blob_path(sha256: str) -> str:
+    """内容哈希对应的存储路径，按前两级哈希前缀分目录避免单目录文件过多"""
+    return os.path.join(blob_dir(), sha256[:2], sha256[2:4], sha256)
+
+
+def text_path(sha256: str) -> str:
+    """文档解析出的纯文本缓存路径（同一内容只解析一次）"""
+    return f"{blob_path(sha256)}.txt"
+
+
+# 串行化提交后的放入与删除：删除前确认记录仍不存在，不会删掉并发上传刚放入的同一内容
+_blob_lock = threading.Lock()
+
+
+def acquire_blob(db: Session, upload: StoredUpload) -> FileBlob:
+    """
+    增加内容的引用计数（不提交事务），提交后需调用 install_blob 放入文件
+
+    Args:
+        db: 数据库会话
+        upload: receive_upload 返回的临时文件
+
+    Returns:
+        FileBlob: 存储记录
+    """
+    path = blob_path(upload.sha256)
+    updated = db.query(FileBlob).filter(FileBlob.sha256 == upload.sha256).update(
+        {FileBlob.ref_count: FileBlob.ref_count + 1},
+        synchronize_session=False
+    )
+    if not updated:
+        try:
+            with db.begin_nested():
+                db.add(FileBlob(sha256=upload.sha256, size=upload.size, storage_path=path, ref_count=1))
+        except IntegrityError:
+            # 并发上传了相同内容，对方已插入记录
+            db.query(FileBlob).filter(FileBlob.sha256 == upload.sha256).update(
+                {FileBlob.ref_count: FileBlob.ref_count + 1},
+                synchronize_session=False
+            )
+    return db.query(FileBlob).filter(FileBlob.sha256 == upload.sha256).populate_existing().one()
+
+
+def install_blob(upload: StoredUpload) -> None:
+    """
+    acquire_blob 的事务提交后，把临时文件放入内容寻址存储
+
+    内容已存在时直接覆盖为同一份数据（原子替换），不会产生第二份文件
+    """
+    path = blob_path(upload.sha256)
+    with _blob_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(upload.path, path)
+
+
+def release_blob(db: Session, sha256: Optional[str]) -> bool:
+    """
+    减少引用计数，归零时删除记录（不提交事务），提交后需调用 purge_blob 删除文件
+
+    Returns:
+        bool: 引用是否已归零（旧版本上传、不由内容寻址存储管理的文件返回 False）
+    """
+    if not sha256:
+        return False
+    updated = db.query(FileBlob).filter(FileBlob.sha256 == sha256).update(
+        {FileBlob.ref_count: FileBlob.ref_count - 1},
+        synchronize_session=False
+    )
+    if not updated:
+        return False
+
+    orphaned = db.query(FileBlob).filter(
+        FileBlob.sha256 == sha256,
+        FileBlob.ref_count <= 0
+    ).delete(synchronize_session=False)
+    return bool(orphaned)
+
+
+def purge_blob(db: Session, sha256: str) -> None:
+    """release_blob 的事务提交后删除磁盘文件；期间相同内容被重新上传（记录已存在）时保留"""
+    with _blob_lock:
+        if db.query(FileBlob.sha256).filter(FileBlob.sha256 == sha256).first() is not None:
+            return
+        for path in (blob_path(sha256), text_path(sha256)):
+            if os.path.exists(path):
+                os.remove(path)
+    logger.debug(f"文件已无引用，删除存储: {sha256}")
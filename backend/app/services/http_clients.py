@@ -0,0 +1,109 @@
+"""
+上游 HTTP 连接池
+DashScope 调用共用长连接客户端（httpx 与 aiohttp 各一个），在应用 lifespan 中创建和关闭，
+避免每次调用都重新进行 DNS 解析和 TCP/TLS 握手
+"""
+import asyncio
+import importlib.util
+import time
+from typing import Optional
+
+import aiohttp
+import httpx
+from loguru import logger
+
+from app.core.config import settings
+
+# 预热请求的超时时间（秒），超时不影响启动
+WARMUP_TIMEOUT = 5.0
+
+_httpx_client: Optional[httpx.AsyncClient] = None
+_aiohttp_session: Optional[aiohttp.ClientSession] = None
+
+
+def _http2_enabled() -> bool:
+    """HTTP/2 需要安装 h2（pip install httpx[http2]）"""
+    if not settings.HTTP2_ENABLED:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP2_ENABLED 已开启但未安装 h2，使用 HTTP/1.1")
+        return False
+    return True
+
+
+def get_httpx_client() -> httpx.AsyncClient:
+    """获取共享的 httpx 客户端（未在 lifespan 中创建时按需创建，如脚本中调用）"""
+    global _httpx_client
+    if _httpx_client is None or _httpx_client.is_closed:
+        _httpx_client = httpx.AsyncClient(
+            http2=_http2_enabled(),
+            timeout=httpx.Timeout(settings.HTTP_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _httpx_client
+
+
+def get_aiohttp_session() -> aiohttp.ClientSession:
+    """获取共享的 aiohttp 会话（需在事件循环中调用）"""
+    global _aiohttp_session
+    if _aiohttp_session is None or _aiohttp_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=settings.HTTP_MAX_CONNECTIONS,
+            keepalive_timeout=settings.HTTP_KEEPALIVE_EXPIRY,
+            ttl_dns_cache=300,
+        )
+        _aiohttp_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=settings.HTTP_TIMEOUT,
+                connect=settings.HTTP_CONNECT_TIMEOUT,
+            ),
+        )
+    return _aiohttp_session
+
+
+async def _warm_up_httpx() -> None:
+    await get_httpx_client().head(settings.DASHSCOPE_BASE_URL)
+
+
+async def _warm_up_aiohttp() -> None:
+    async with get_aiohttp_session().head(settings.DASHSCOPE_BASE_URL) as response:
+        await response.read()
+
+
+async def warm_up() -> None:
+    """预先建立到 DashScope 的连接，使首个用户请求不必承担握手耗时"""
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        asyncio.wait_for(_warm_up_httpx(), WARMUP_TIMEOUT),
+        asyncio.wait_for(_warm_up_aiohttp(), WARMUP_TIMEOUT),
+        return_exceptions=True,
+    )
+    errors = [repr(result) for result in results if isinstance(result, BaseException)]
+    if errors:
+        logger.warning(f"上游连接预热失败: {'; '.join(errors)}")
+    else:
+        logger.info(f"上游连接预热完成: {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+async def start_http_clients() -> None:
+    """创建共享客户端（应用启动时调用），配置了 API Key 时预热连接"""
+    get_httpx_client()
+    get_aiohttp_session()
+    if settings.HTTP_WARMUP and (settings.QWEN_API_KEY or settings.DASHSCOPE_API_KEY):
+        await warm_up()
+
+
+async def close_http_clients() -> None:
+    """关闭共享客户端（应用关闭时调用）"""
+    global _httpx_client, _aiohttp_session
+    if _httpx_client is not None:
+        await _httpx_client.aclose()
+        _httpx_client = None
+    if _aiohttp_session is not None:
+        await _aiohttp_session.close()
+        _aiohttp_session = None
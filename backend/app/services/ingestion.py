@@ -0,0 +1,298 @@
+"""
+知识库文档入库服务
+负责文档分块、写入分块表与全文索引以及向量化
+"""
+import asyncio
+from dataclasses import dataclass
+from typing import Iterable, Optional, Union
+
+from loguru import logger
+from sqlalchemy import insert, select, literal
+from sqlalchemy.orm import Session
+
+from app.models.knowledge_base import KnowledgeBase, KnowledgeDocument, KnowledgeChunk
+from app.services.chunker import split_text, iter_file_text
+from app.services.vector_store import get_vector_store, INDEX_IVF
+from app.services import keyword_index
+
+# 每批写入数据库的分块数量
+CHUNK_INSERT_BATCH = 500
+# 每批向量化并写入向量存储的分块数量（每次写入会重写 .npy 文件）
+VECTOR_FLUSH_SIZE = 1000
+
+
+@dataclass
+class IngestResult:
+    """入库结果"""
+    chunk_count: int
+    total_chars: int
+
+
+def _count_chars(pieces: Iterable[str], counter: list) -> Iterable[str]:
+    """透传文本片段并累计字符数"""
+    for piece in pieces:
+        counter[0] += len(piece)
+        yield piece
+
+
+def _insert_chunks(db: Session, kb_id: int, rows: list) -> int:
+    """写入一批分块及其全文索引"""
+    chunk_ids = db.execute(
+        insert(KnowledgeChunk).returning(KnowledgeChunk.id, sort_by_parameter_order=True),
+        rows
+    ).scalars().all()
+    keyword_index.index_chunks(db, kb_id, zip(chunk_ids, (row["content"] for row in rows)))
+    return len(rows)
+
+
+def index_document_text(
+    db: Session,
+    kb: KnowledgeBase,
+    doc: KnowledgeDocument,
+    text: Union[str, Iterable[str]]
+) -> IngestResult:
+    """
+    将文档文本分块写入分块表和全文索引（不提交事务）
+
+    Args:
+        db: 数据库会话
+        kb: 所属知识库（提供 chunk_size / chunk_overlap）
+        doc: 文档对象（需已分配 ID）
+        text: 完整文本或文本片段迭代器
+
+    Returns:
+        IngestResult: 分块数量与字符总数
+    """
+    delete_document_chunks(db, doc.id)
+
+    pieces = [text] if isinstance(text, str) else text
+    char_counter = [0]
+    batch = []
+    chunk_count = 0
+
+    for chunk in split_text(
+        _count_chars(pieces, char_counter),
+        chunk_size=kb.chunk_size or 500,
+        chunk_overlap=kb.chunk_overlap or 0
+    ):
+        batch.append({
+            "kb_id": kb.id,
+            "doc_id": doc.id,
+            "chunk_index": chunk.index,
+            "start_offset": chunk.start,
+            "end_offset": chunk.end,
+            "content": chunk.text,
+        })
+        if len(batch) >= CHUNK_INSERT_BATCH:
+            chunk_count += _insert_chunks(db, kb.id, batch)
+            batch = []
+
+    if batch:
+        chunk_count += _insert_chunks(db, kb.id, batch)
+
+    doc.chunk_count = chunk_count
+    return IngestResult(chunk_count=chunk_count, total_chars=char_counter[0])
+
+
+def index_document_file(
+    db: Session,
+    kb: KnowledgeBase,
+    doc: KnowledgeDocument,
+    file_path: str,
+    encoding: str = "utf-8"
+) -> IngestResult:
+    """从磁盘流式读取文本文件并分块入库（不提交事务）"""
+    return index_document_text(db, kb, doc, iter_file_text(file_path, encoding=encoding))
+
+
+def find_reusable_document(
+    db: Session,
+    kb: KnowledgeBase,
+    content_hash: str,
+    exclude_doc_id: Optional[int] = None
+) -> Optional[KnowledgeDocument]:
+    """
+    查找内容相同、已完成分块且分块参数相同的文档（可属于任意知识库）
+
+    优先选择同一嵌入模型的知识库中的文档，以便连同向量一起复用
+    """
+    query = db.query(KnowledgeDocument).join(
+        KnowledgeBase, KnowledgeBase.id == KnowledgeDocument.kb_id
+    ).filter(
+        KnowledgeDocument.content_hash == content_hash,
+        KnowledgeDocument.status == "completed",
+        KnowledgeDocument.chunk_count > 0,
+        KnowledgeBase.chunk_size == kb.chunk_size,
+        KnowledgeBase.chunk_overlap == kb.chunk_overlap,
+    )
+    if exclude_doc_id is not None:
+        query = query.filter(KnowledgeDocument.id != exclude_doc_id)
+    same_model = query.filter(KnowledgeBase.embedding_model == kb.embedding_model).first()
+    return same_model or query.first()
+
+
+def copy_document_index(
+    db: Session,
+    kb: KnowledgeBase,
+    doc: KnowledgeDocument,
+    source: KnowledgeDocument
+) -> IngestResult:
+    """
+    复用相同内容文档的分块与全文索引（不提交事务）
+
+    分块行和全文索引都在数据库内整体复制，不读取文件、不重新切分
+
+    Args:
+        db: 数据库会话
+        kb: 目标知识库
+        doc: 目标文档（需已分配 ID）
+        source: find_reusable_document 找到的源文档
+
+    Returns:
+        IngestResult: 分块数量与字符总数
+    """
+    delete_document_chunks(db, doc.id)
+
+    columns = ["kb_id", "doc_id", "chunk_index", "start_offset", "end_offset", "content"]
+    rows = select(
+        literal(kb.id),
+        literal(doc.id),
+        KnowledgeChunk.chunk_index,
+        KnowledgeChunk.start_offset,
+        KnowledgeChunk.end_offset,
+        KnowledgeChunk.content,
+    ).where(KnowledgeChunk.doc_id == source.id).order_by(KnowledgeChunk.chunk_index)
+    db.execute(insert(KnowledgeChunk).from_select(columns, rows))
+    keyword_index.copy_document(db, kb.id, source.id, doc.id)
+
+    doc.chunk_count = source.chunk_count
+    return IngestResult(chunk_count=source.chunk_count, total_chars=source.char_count or 0)
+
+
+def copy_document_vectors(
+    db: Session,
+    kb: KnowledgeBase,
+    doc: KnowledgeDocument,
+    source: KnowledgeDocument
+) -> int:
+    """
+    从源文档所在知识库复制向量到目标文档的同序号分块
+
+    嵌入模型不同或源文档缺少向量时返回 0，由调用方改为 embed_document_chunks
+
+    Returns:
+        int: 写入的向量数量
+    """
+    source_kb = db.query(KnowledgeBase).filter(KnowledgeBase.id == source.kb_id).first()
+    if source_kb is None or source_kb.embedding_model != kb.embedding_model:
+        return 0
+
+    target = KnowledgeChunk.__table__.alias("target")
+    pairs = db.execute(
+        select(KnowledgeChunk.id, target.c.id).join(
+            target, target.c.chunk_index == KnowledgeChunk.chunk_index
+        ).where(
+            KnowledgeChunk.doc_id == source.id,
+            target.c.doc_id == doc.id
+        ).order_by(KnowledgeChunk.chunk_index)
+    ).all()
+
+    store = get_vector_store()
+    vectors = store.get(source.kb_id, [source_id for source_id, _ in pairs])
+    if len(vectors) != len(pairs):
+        return 0
+
+    store.add(kb.id, [target_id for _, target_id in pairs], [vectors[source_id] for source_id, _ in pairs])
+    if kb.index_type == INDEX_IVF:
+        store.build_ivf(kb.id)
+    logger.info(f"复用文档向量: doc_id={doc.id}, 来源 doc_id={source.id}, 向量数={len(pairs)}")
+    return len(pairs)
+
+
+async def embed_document_chunks(
+    db: Session,
+    kb: KnowledgeBase,
+    doc: KnowledgeDocument
+) -> int:
+    """
+    对文档分块向量化并写入向量存储
+
+    向量化经过 embedding_service，已缓存的分块内容不会重复请求
+
+    Args:
+        db: 数据库会话
+        kb: 所属知识库（提供 embedding_model）
+        doc: 已完成分块的文档
+
+    Returns:
+        int: 写入的向量数量
+    """
+    from app.services.embedding_service import embedding_service
+
+    store = get_vector_store()
+    written = 0
+    last_id = 0
+
+    while True:
+        rows = db.query(KnowledgeChunk.id, KnowledgeChunk.content).filter(
+            KnowledgeChunk.doc_id == doc.id,
+            KnowledgeChunk.id > last_id
+        ).order_by(KnowledgeChunk.id).limit(VECTOR_FLUSH_SIZE).all()
+        if not rows:
+            break
+
+        vectors = await embedding_service.embed_texts(
+            [row.content for row in rows],
+            model=kb.embedding_model,
+            text_type="document"
+        )
+        ids = [row.id for row in rows]
+        await asyncio.to_thread(store.add, kb.id, ids, vectors)
+        written += len(ids)
+        last_id = ids[-1]
+
+    if kb.index_type == INDEX_IVF:
+        # 首次达到训练规模时建立 IVF 索引，已有索引时新向量已增量分配到聚类
+        await asyncio.to_thread(store.build_ivf, kb.id)
+    logger.info(f"文档向量化完成: doc_id={doc.id}, 向量数={written}")
+    return written
+
+
+def adjust_kb_counters(db: Session, kb_id: int, documents: int, chars: int) -> None:
+    """
+    原子更新知识库的文档数与字符数（不提交事务）
+
+    使用 SQL 表达式自增，多个文档并发完成时不会互相覆盖
+    """
+    db.query(KnowledgeBase).filter(KnowledgeBase.id == kb_id).update(
+        {
+            KnowledgeBase.document_count: KnowledgeBase.document_count + documents,
+            KnowledgeBase.total_chars: KnowledgeBase.total_chars + chars,
+        },
+        synchronize_session=False
+    )
+
+
+def delete_document_chunks(db: Session, doc_id: int) -> None:
+    """删除文档的全部分块及其向量、全文索引（不提交事务）"""
+    rows = db.query(KnowledgeChunk.id, KnowledgeChunk.kb_id).filter(
+        KnowledgeChunk.doc_id == doc_id
+    ).all()
+    if not rows:
+        return
+
+    chunk_ids = [row.id for row in rows]
+    get_vector_store().delete(rows[0].kb_id, chunk_ids)
+    keyword_index.delete_chunks(db, chunk_ids)
+    db.query(KnowledgeChunk).filter(
+        KnowledgeChunk.doc_id == doc_id
+    ).delete(synchronize_session=False)
+
+
+def delete_knowledge_base_chunks(db: Session, kb_id: int) -> None:
+    """删除知识库的全部分块及其向量、全文索引（不提交事务）"""
+    get_vector_store().drop(kb_id)
+    keyword_index.delete_knowledge_base(db, kb_id)
+    db.query(KnowledgeChunk).filter(
+        KnowledgeChunk.kb_id == kb_id
+    ).delete(synchronize_session=False)
@@ -0,0 +1,378 @@
+"""
+文档后台解析
+文档上传后立即返回，PDF / DOC / DOCX 的文本提取在独立进程池中执行，
+不占用事件循环和 API 进程的 GIL；之后（纯文本文件直接）在线程中分块、写入全文索引并向量化，
+处理进度写入 KnowledgeDocument.progress，结束时状态为 completed 或 failed。
+多个 API 进程共用一个数据库：处理前领取文档的租约（locked_by / lease_expires_at，
+与视频任务相同的带条件抢占），同一文档只由一个进程处理，进程失联后租约到期由其他进程接手
+"""
+import asyncio
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.knowledge_base import KnowledgeBase, KnowledgeDocument
+from app.services.document_parser import extract_text_to_file
+from app.services.file_storage import text_path
+from app.services.ingestion import (
+    adjust_kb_counters,
+    find_reusable_document,
+    copy_document_index,
+    copy_document_vectors,
+    index_document_file,
+    embed_document_chunks,
+    IngestResult,
+)
+
+# 不需要提取、直接分块的纯文本类型
+TEXT_EXTENSIONS = {".txt", ".md"}
+
+# 各阶段完成时的进度
+PROGRESS_EXTRACTED = 80
+PROGRESS_INDEXED = 100
+
+# 子进程写入进度的最小间隔（秒）
+PROGRESS_REPORT_INTERVAL = 1.0
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+# 后台任务引用，防止任务在完成前被垃圾回收
+_tasks = set()
+
+# 本进程持有文档处理租约时使用的标识
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class DocumentGoneError(Exception):
+    """处理期间文档被删除，或租约已被其他进程接管"""
+
+
+def start_ingestion_pool() -> None:
+    """创建解析进程池（应用启动时调用）"""
+    global _executor
+    if _executor is None:
+        # spawn 启动的子进程不继承父进程的数据库连接和事件循环
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.INGESTION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"文档解析进程池已启动: workers={settings.INGESTION_WORKERS}")
+
+
+def shutdown_ingestion_pool() -> None:
+    """关闭解析进程池（应用关闭时调用），未开始的解析任务会在下次启动时恢复"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+class _ProgressReporter:
+    """子进程中的进度回调：按时间节流写入数据库"""
+
+    def __init__(self, doc_id: int):
+        self.doc_id = doc_id
+        self.last_value = -1
+        self.last_time = 0.0
+
+    def __call__(self, done: int, total: int) -> None:
+        value = PROGRESS_EXTRACTED * done // max(total, 1)
+        now = time.monotonic()
+        if value <= self.last_value or now - self.last_time < PROGRESS_REPORT_INTERVAL:
+            return
+        self.last_value, self.last_time = value, now
+        db = SessionLocal()
+        try:
+            db.query(KnowledgeDocument).filter(KnowledgeDocument.id == self.doc_id).update(
+                {KnowledgeDocument.progress: value},
+                synchronize_session=False
+            )
+            db.commit()
+        except Exception as e:
+            logger.debug(f"写入解析进度失败: doc_id={self.doc_id}, {e}")
+        finally:
+            db.close()
+
+
+def _extract_in_process(src: str, file_type: str, dest: str, doc_id: int) -> int:
+    """在子进程中执行的文本提取"""
+    return extract_text_to_file(src, file_type, dest, _ProgressReporter(doc_id))
+
+
+async def _extract_text(doc: KnowledgeDocument) -> str:
+    """提取文档文本，相同内容已提取过时直接复用，返回文本文件路径"""
+    if doc.file_type in TEXT_EXTENSIONS:
+        return doc.file_url
+    # 旧版本上传的文件没有内容哈希，文本保存在原文件旁
+    dest = text_path(doc.content_hash) if doc.content_hash else f"{doc.file_url}.txt"
+    if os.path.exists(dest):
+        return dest
+
+    start_ingestion_pool()
+    loop = asyncio.get_running_loop()
+    chars = await loop.run_in_executor(
+        _executor,
+        _extract_in_process,
+        doc.file_url,
+        doc.file_type,
+        dest,
+        doc.id
+    )
+    logger.info(f"文档文本提取完成: doc_id={doc.id}, 字符数={chars}")
+    return dest
+
+
+def _ensure_owned(db: Session, doc_id: int) -> None:
+    """提交前确认文档仍存在且租约仍由本进程持有，否则回滚本次写入"""
+    owned = db.query(KnowledgeDocument.id).filter(
+        KnowledgeDocument.id == doc_id,
+        KnowledgeDocument.locked_by == WORKER_ID
+    ).with_for_update().first()
+    if owned is None:
+        db.rollback()
+        raise DocumentGoneError(f"文档已删除或由其他进程处理: doc_id={doc_id}")
+
+
+def _mark_completed(db: Session, kb: KnowledgeBase, doc: KnowledgeDocument, result: IngestResult) -> None:
+    """标记文档处理完成并累加知识库统计"""
+    _ensure_owned(db, doc.id)
+    doc.char_count = result.total_chars
+    doc.status = "completed"
+    doc.progress = PROGRESS_INDEXED
+    doc.error_message = None
+    adjust_kb_counters(db, kb.id, 1, result.total_chars)
+    db.commit()
+
+
+def _index_text_file(db: Session, kb: KnowledgeBase, doc: KnowledgeDocument, text_file: str) -> None:
+    """分块入库并标记完成（在线程中执行）"""
+    _mark_completed(db, kb, doc, index_document_file(db, kb, doc, text_file))
+
+
+def _copy_text_index(db: Session, kb: KnowledgeBase, doc: KnowledgeDocument, source: KnowledgeDocument) -> None:
+    """复制相同内容文档的分块与全文索引并标记完成（在线程中执行）"""
+    _mark_completed(db, kb, doc, copy_document_index(db, kb, doc, source))
+
+
+def _set_progress(db: Session, doc: KnowledgeDocument, value: int) -> None:
+    doc.progress = value
+    db.commit()
+
+
+def _mark_failed(db: Session, doc_id: int, message: str) -> None:
+    db.query(KnowledgeDocument).filter(
+        KnowledgeDocument.id == doc_id,
+        KnowledgeDocument.locked_by == WORKER_ID
+    ).update({
+        KnowledgeDocument.status: "failed",
+        KnowledgeDocument.error_message: message[:1000],
+    }, synchronize_session=False)
+    db.commit()
+
+
+def _claim_document(doc_id: int) -> Tuple[bool, Optional[datetime]]:
+    """
+    领取处理中文档的租约
+
+    Returns:
+        (是否领取成功, 未领取到时其他进程租约的到期时间；文档已不需要处理时为 None)
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        claimed = db.query(KnowledgeDocument).filter(
+            KnowledgeDocument.id == doc_id,
+            KnowledgeDocument.status == "processing",
+            or_(
+                KnowledgeDocument.locked_by.is_(None),
+                KnowledgeDocument.locked_by == WORKER_ID,
+                KnowledgeDocument.lease_expires_at < now,
+            )
+        ).update({
+            KnowledgeDocument.locked_by: WORKER_ID,
+            KnowledgeDocument.lease_expires_at: now + timedelta(seconds=settings.DOCUMENT_LEASE_SECONDS),
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return True, None
+        row = db.query(KnowledgeDocument.status, KnowledgeDocument.lease_expires_at).filter(
+            KnowledgeDocument.id == doc_id
+        ).first()
+        if row is None or row.status != "processing":
+            return False, None
+        return False, row.lease_expires_at or now
+    finally:
+        db.close()
+
+
+def _renew_document_lease(doc_id: int) -> bool:
+    """续约，租约已失效（文档已删除或被接管）时返回 False"""
+    db = SessionLocal()
+    try:
+        renewed = db.query(KnowledgeDocument).filter(
+            KnowledgeDocument.id == doc_id,
+            KnowledgeDocument.locked_by == WORKER_ID
+        ).update({
+            KnowledgeDocument.lease_expires_at: datetime.utcnow() + timedelta(seconds=settings.DOCUMENT_LEASE_SECONDS),
+        }, synchronize_session=False)
+        db.commit()
+        return bool(renewed)
+    finally:
+        db.close()
+
+
+def _release_documents(doc_ids: Optional[List[int]] = None) -> None:
+    """释放本进程持有的文档租约（doc_ids 为空时释放全部）"""
+    db = SessionLocal()
+    try:
+        query = db.query(KnowledgeDocument).filter(KnowledgeDocument.locked_by == WORKER_ID)
+        if doc_ids is not None:
+            query = query.filter(KnowledgeDocument.id.in_(doc_ids))
+        query.update({
+            KnowledgeDocument.locked_by: None,
+            KnowledgeDocument.lease_expires_at: None,
+        }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _keep_lease(doc_id: int) -> None:
+    """处理期间定期续约"""
+    while True:
+        await asyncio.sleep(settings.DOCUMENT_LEASE_SECONDS / 3)
+        try:
+            if not await asyncio.to_thread(_renew_document_lease, doc_id):
+                logger.warning(f"文档处理租约已失效: doc_id={doc_id}")
+                return
+        except Exception as e:
+            logger.warning(f"文档处理续约失败: doc_id={doc_id}, {e}")
+
+
+async def process_document(doc_id: int, wait_for_lease: bool = False) -> None:
+    """
+    领取租约后在后台处理文档，处理结束后释放租约
+
+    Args:
+        wait_for_lease: 文档由其他进程处理时，等其租约到期后再尝试接手（启动时恢复的文档），
+            否则直接返回
+    """
+    while True:
+        try:
+            claimed, held_until = await asyncio.to_thread(_claim_document, doc_id)
+        except Exception as e:
+            logger.error(f"领取文档处理租约失败: doc_id={doc_id}, {e}")
+            return
+        if claimed:
+            break
+        if not wait_for_lease or held_until is None:
+            return
+        await asyncio.sleep(max((held_until - datetime.utcnow()).total_seconds(), 0) + 1)
+
+    renewal = asyncio.create_task(_keep_lease(doc_id))
+    try:
+        await _process_document(doc_id)
+    finally:
+        renewal.cancel()
+        try:
+            await asyncio.to_thread(_release_documents, [doc_id])
+        except Exception as e:
+            logger.warning(f"释放文档处理租约失败: doc_id={doc_id}, {e}")
+
+
+async def _process_document(doc_id: int) -> None:
+    """
+    后台处理单个文档：提取文本 → 分块与全文索引 → 向量化
+
+    使用独立的数据库会话，不依赖发起上传的请求；处理期间文档被删除时放弃本次写入
+    """
+    db = SessionLocal()
+    try:
+        doc = db.query(KnowledgeDocument).filter(KnowledgeDocument.id == doc_id).first()
+        if doc is None or doc.status != "processing":
+            return
+        kb = db.query(KnowledgeBase).filter(KnowledgeBase.id == doc.kb_id).first()
+
+        try:
+            source = None
+            if doc.content_hash:
+                source = await asyncio.to_thread(
+                    find_reusable_document, db, kb, doc.content_hash, exclude_doc_id=doc.id
+                )
+            if source:
+                await asyncio.to_thread(_copy_text_index, db, kb, doc, source)
+            else:
+                text_file = await _extract_text(doc)
+                # 写事务在线程内开始并提交，不跨越 await：
+                # SQLite 写锁被挂起的协程持有时，其他协程在事件循环线程上等锁会互相阻塞
+                await asyncio.to_thread(_set_progress, db, doc, PROGRESS_EXTRACTED)
+                # 分块为纯 Python 计算，同样放到线程中执行
+                await asyncio.to_thread(_index_text_file, db, kb, doc, text_file)
+        except (DocumentGoneError, StaleDataError):
+            db.rollback()
+            logger.info(f"文档已删除或由其他进程处理，停止处理: doc_id={doc_id}")
+            return
+        except Exception as e:
+            db.rollback()
+            logger.error(f"文档处理失败: doc_id={doc_id}, {e}")
+            await asyncio.to_thread(_mark_failed, db, doc_id, str(e))
+            return
+
+        # 向量化失败不影响文档状态，文档仍可通过关键词检索
+        from app.services.qwen_service import qwen_service
+        try:
+            copied = await asyncio.to_thread(copy_document_vectors, db, kb, doc, source) if source else 0
+            if not copied and qwen_service.api_key:
+                await embed_document_chunks(db, kb, doc)
+        except Exception as e:
+            logger.warning(f"文档向量化失败: doc_id={doc_id}, {e}")
+    finally:
+        db.close()
+
+
+def schedule_document(doc_id: int, wait_for_lease: bool = False) -> None:
+    """在事件循环中调度文档后台处理"""
+    task = asyncio.create_task(process_document(doc_id, wait_for_lease))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def resume_pending_documents() -> int:
+    """
+    重新调度上次退出时仍在处理中的文档（应用启动时调用），返回调度数量
+
+    每个 API 进程启动时都会调用：由其他进程正在处理的文档等其租约到期后再尝试接手
+    """
+    db = SessionLocal()
+    try:
+        doc_ids = [row.id for row in db.query(KnowledgeDocument.id).filter(
+            KnowledgeDocument.status == "processing"
+        ).all()]
+    finally:
+        db.close()
+
+    for doc_id in doc_ids:
+        schedule_document(doc_id, wait_for_lease=True)
+    if doc_ids:
+        logger.info(f"恢复未完成的文档处理: {len(doc_ids)} 个")
+    return len(doc_ids)
+
+
+def release_document_leases() -> None:
+    """释放本进程持有的全部文档租约（应用关闭时调用），未处理完的文档可被立即接手"""
+    try:
+        _release_documents()
+    except Exception as e:
+        logger.warning(f"释放文档处理租约失败: {e}")
@@ -0,0 +1,275 @@
+"""
+知识库全文检索（关键词）索引
+SQLite 使用 FTS5 + bm25()，PostgreSQL 使用 tsvector + GIN 索引
+
+中文没有空格分词，入库前先把文本切成词元：
+连续的中日韩字符输出单字与相邻二字组合（bigram），其他字母数字按单词小写输出，
+查询使用同样的切分方式，因此数据库端只需按空格分词。
+
+写入索引的词项带知识库前缀（k<知识库ID>k<词元>），每个知识库的倒排列表相互独立，
+检索只读取本知识库的倒排列表，不随其他知识库的数据量变慢
+"""
+import re
+from typing import Any, Dict, Iterable, List, Sequence, Tuple, Union
+
+from loguru import logger
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+FTS_TABLE = "knowledge_chunks_fts2"
+PG_TABLE = "knowledge_chunk_search2"
+
+# 词项不带知识库前缀的旧版本索引表，启动时删除并按分块表重建
+LEGACY_TABLES = {"sqlite": "knowledge_chunks_fts", "postgresql": "knowledge_chunk_search"}
+
+# 重建索引时每批读取的分块数
+REBUILD_BATCH_SIZE = 1000
+
+# 单次查询最多使用的词元数
+MAX_QUERY_TOKENS = 64
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TOKEN_RE = re.compile(f"[{_CJK}]+|[0-9A-Za-z\u00c0-\u024f]+")
+_CJK_RE = re.compile(f"[{_CJK}]")
+
+
+def tokenize(content: str, unigrams: bool = True) -> List[str]:
+    """
+    切分文本为检索词元
+
+    Args:
+        content: 原始文本
+        unigrams: 两个字以上的中日韩文本是否输出单字（为 False 时只输出 bigram）
+
+    Returns:
+        词元列表（中日韩文本为单字 + bigram，其余为小写单词）
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(content):
+        run = match.group()
+        if _CJK_RE.match(run):
+            if unigrams or len(run) == 1:
+                tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+
+def _kb_term(kb_id: int, token: str) -> str:
+    """带知识库前缀的词项；知识库ID只含数字，以 k 结尾的前缀不会与其他知识库混淆"""
+    return f"k{kb_id}k{token}"
+
+
+def _index_terms(kb_id: int, content: str) -> str:
+    return " ".join(_kb_term(kb_id, token) for token in tokenize(content))
+
+
+def _query_tokens(query: str) -> List[str]:
+    """
+    查询词元去重并限制数量
+
+    已有 bigram 覆盖的单字不参与查询：单字的倒排列表最长，而 bigram 已包含它的信息
+    """
+    seen = []
+    for token in tokenize(query, unigrams=False):
+        if token not in seen:
+            seen.append(token)
+    # 优先保留 bigram 和长单词，它们的区分度更高
+    seen.sort(key=len, reverse=True)
+    return seen[:MAX_QUERY_TOKENS]
+
+
+def _dialect(db: Session) -> str:
+    return db.get_bind().dialect.name
+
+
+def init_keyword_index(engine: Engine) -> None:
+    """创建全文检索表（幂等）；存在旧版本索引表时删除并按分块表重建"""
+    dialect = engine.dialect.name
+    if dialect not in LEGACY_TABLES:
+        logger.warning(f"数据库 {dialect} 不支持全文检索索引，关键词检索将不可用")
+        return
+
+    inspector = inspect(engine)
+    table = FTS_TABLE if dialect == "sqlite" else PG_TABLE
+    created = not inspector.has_table(table)
+    legacy = inspector.has_table(LEGACY_TABLES[dialect])
+    with engine.begin() as conn:
+        if dialect == "sqlite":
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                "tokens, tokenize = 'unicode61 remove_diacritics 2')"
+            ))
+        else:
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {PG_TABLE} ("
+                "chunk_id INTEGER PRIMARY KEY, kb_id INTEGER NOT NULL, tsv TSVECTOR NOT NULL)"
+            ))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{PG_TABLE}_tsv ON {PG_TABLE} USING GIN (tsv)"))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{PG_TABLE}_kb_id ON {PG_TABLE} (kb_id)"))
+        if legacy:
+            conn.execute(text(f"DROP TABLE {LEGACY_TABLES[dialect]}"))
+        if created and inspector.has_table("knowledge_chunks"):
+            _rebuild(conn, dialect)
+
+
+def _rebuild(conn: Connection, dialect: str) -> None:
+    """按分块表重建全部全文索引"""
+    last_id, total = 0, 0
+    while True:
+        rows = conn.execute(
+            text("SELECT id, kb_id, content FROM knowledge_chunks WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": REBUILD_BATCH_SIZE}
+        ).fetchall()
+        if not rows:
+            break
+        _insert_rows(conn, dialect, [
+            {"chunk_id": chunk_id, "kb_id": kb_id, "tokens": _index_terms(kb_id, content or "")}
+            for chunk_id, kb_id, content in rows
+        ])
+        last_id = rows[-1][0]
+        total += len(rows)
+    if total:
+        logger.info(f"全文索引已重建: 分块数={total}")
+
+
+def _insert_rows(conn: Union[Connection, Session], dialect: str, rows: List[Dict[str, Any]]) -> None:
+    if dialect == "sqlite":
+        conn.execute(
+            text(f"INSERT INTO {FTS_TABLE} (rowid, tokens) VALUES (:chunk_id, :tokens)"),
+            rows
+        )
+    elif dialect == "postgresql":
+        conn.execute(
+            text(
+                f"INSERT INTO {PG_TABLE} (chunk_id, kb_id, tsv) "
+                "VALUES (:chunk_id, :kb_id, to_tsvector('simple', :tokens)) "
+                "ON CONFLICT (chunk_id) DO UPDATE SET kb_id = EXCLUDED.kb_id, tsv = EXCLUDED.tsv"
+            ),
+            rows
+        )
+
+
+def index_chunks(db: Session, kb_id: int, chunks: Iterable[Tuple[int, str]]) -> None:
+    """
+    写入分块全文索引（不提交事务）
+
+    Args:
+        db: 数据库会话
+        kb_id: 知识库ID
+        chunks: (分块ID, 分块内容) 序列
+    """
+    rows = [
+        {"chunk_id": chunk_id, "kb_id": kb_id, "tokens": _index_terms(kb_id, content)}
+        for chunk_id, content in chunks
+    ]
+    if rows:
+        _insert_rows(db, _dialect(db), rows)
+
+
+def copy_document(db: Session, kb_id: int, source_doc_id: int, target_doc_id: int) -> None:
+    """
+    将源文档分块的全文索引复制给目标文档的同序号分块（不提交事务）
+
+    用于相同内容的文档复用已有分块，省去重新切分词元；源文档属于其他知识库时替换词项前缀。
+    PostgreSQL 的 tsvector 无法改写词项，按目标分块内容重新写入
+    """
+    dialect = _dialect(db)
+    params = {"kb_id": kb_id, "source": source_doc_id, "target": target_doc_id}
+    if dialect == "sqlite":
+        # 词项以空格分隔，在开头补一个空格后只替换位于词项开头的前缀
+        db.execute(
+            text(
+                f"INSERT INTO {FTS_TABLE} (rowid, tokens) "
+                "SELECT t.id, substr(replace(' ' || f.tokens, ' k' || s.kb_id || 'k', ' k' || :kb_id || 'k'), 2) "
+                "FROM knowledge_chunks t "
+                "JOIN knowledge_chunks s ON s.doc_id = :source AND s.chunk_index = t.chunk_index "
+                f"JOIN {FTS_TABLE} f ON f.rowid = s.id "
+                "WHERE t.doc_id = :target"
+            ),
+            params
+        )
+    elif dialect == "postgresql":
+        rows = db.execute(
+            text("SELECT id, content FROM knowledge_chunks WHERE doc_id = :target"),
+            {"target": target_doc_id}
+        ).fetchall()
+        index_chunks(db, kb_id, rows)
+
+
+def delete_chunks(db: Session, chunk_ids: Sequence[int]) -> None:
+    """删除分块全文索引（不提交事务）"""
+    dialect = _dialect(db)
+    table, key = {
+        "sqlite": (FTS_TABLE, "rowid"),
+        "postgresql": (PG_TABLE, "chunk_id"),
+    }.get(dialect, (None, None))
+    if table is None:
+        return
+
+    for start in range(0, len(chunk_ids), 500):
+        part = list(chunk_ids[start:start + 500])
+        params = {f"id{i}": chunk_id for i, chunk_id in enumerate(part)}
+        placeholders = ", ".join(f":{name}" for name in params)
+        db.execute(text(f"DELETE FROM {table} WHERE {key} IN ({placeholders})"), params)
+
+
+def delete_knowledge_base(db: Session, kb_id: int) -> None:
+    """删除知识库的全部全文索引（需在删除分块之前调用，不提交事务）"""
+    dialect = _dialect(db)
+    if dialect == "sqlite":
+        db.execute(
+            text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT id FROM knowledge_chunks WHERE kb_id = :kb_id)"),
+            {"kb_id": kb_id}
+        )
+    elif dialect == "postgresql":
+        db.execute(text(f"DELETE FROM {PG_TABLE} WHERE kb_id = :kb_id"), {"kb_id": kb_id})
+
+
+def search(db: Session, kb_id: int, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+    """
+    关键词检索
+
+    Args:
+        db: 数据库会话
+        kb_id: 知识库ID
+        query: 查询文本
+        top_k: 返回数量
+
+    Returns:
+        [(分块ID, 得分)]，得分越高越相关
+    """
+    tokens = _query_tokens(query)
+    if not tokens:
+        return []
+
+    terms = [_kb_term(kb_id, token) for token in tokens]
+    dialect = _dialect(db)
+    if dialect == "sqlite":
+        match = " OR ".join(f'"{term}"' for term in terms)
+        rows = db.execute(
+            text(
+                f"SELECT rowid, bm25({FTS_TABLE}) AS rank FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH :match "
+                "ORDER BY rank LIMIT :top_k"
+            ),
+            {"match": match, "top_k": top_k}
+        ).fetchall()
+        # bm25() 越小越相关，取反使得分越高越相关
+        return [(int(row[0]), -float(row[1])) for row in rows]
+
+    if dialect == "postgresql":
+        rows = db.execute(
+            text(
+                f"SELECT chunk_id, ts_rank_cd(tsv, q) AS rank "
+                f"FROM {PG_TABLE}, to_tsquery('simple', :query) AS q "
+                "WHERE kb_id = :kb_id AND tsv @@ q "
+                "ORDER BY rank DESC LIMIT :top_k"
+            ),
+            {"query": " | ".join(terms), "kb_id": kb_id, "top_k": top_k}
+        ).fetchall()
+        return [(int(row[0]), float(row[1])) for row in rows]
+
+    return []
@@ -0,0 +1,311 @@
+"""
+大模型响应缓存
+以 (模型, 消息, temperature, top_p, max_tokens) 的规范化哈希为键缓存 QwenService.chat 的回复，
+后端可选内存（LRU + TTL）、SQLite 或 Redis，由 LLM_CACHE_BACKEND 配置
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.database import get_redis
+
+# 缓存键前缀（Redis 中与其他数据区分）
+KEY_PREFIX = "llm:"
+
+# SQLite 后端每写入多少次检查一次容量
+SQLITE_PRUNE_INTERVAL = 100
+
+
+def _normalize_text(text: str) -> str:
+    """统一 Unicode 形式并合并空白，使仅空白或全半角不同的提示词命中同一缓存"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def make_cache_key(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    top_p: float,
+    max_tokens: int
+) -> str:
+    """
+    生成缓存键
+
+    Args:
+        model: 模型名称
+        messages: 对话消息
+        temperature / top_p / max_tokens: 采样参数
+
+    Returns:
+        sha256 十六进制字符串
+    """
+    normalized = {
+        "model": model,
+        "messages": [
+            {"role": message["role"], "content": _normalize_text(message["content"])}
+            for message in messages
+        ],
+        "temperature": round(float(temperature), 4),
+        "top_p": round(float(top_p), 4),
+        "max_tokens": int(max_tokens),
+    }
+    raw = json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCacheBackend(ABC):
+    """缓存后端接口"""
+
+    name = "base"
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """读取未过期的缓存，未命中返回 None"""
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        """写入缓存，ttl 秒后过期"""
+
+    @abstractmethod
+    async def clear(self) -> None:
+        """清空缓存"""
+
+    async def size(self) -> Optional[int]:
+        """当前条目数（无法统计时返回 None）"""
+        return None
+
+
+class MemoryLLMCache(LLMCacheBackend):
+    """进程内 LRU 缓存，超过 max_entries 时淘汰最久未使用的条目"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at <= time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        self._data[key] = (time.time() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    async def clear(self) -> None:
+        self._data.clear()
+
+    async def size(self) -> Optional[int]:
+        return len(self._data)
+
+
+class SQLiteLLMCache(LLMCacheBackend):
+    """
+    SQLite 文件缓存，进程重启后仍然有效，同一台机器上的多个进程共享
+
+    按最近访问时间近似 LRU 淘汰
+    """
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str, max_entries: int):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程一个连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, "
+                "value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed_at ON llm_cache (accessed_at)")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, key: str) -> Optional[str]:
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value FROM llm_cache WHERE key = ? AND expires_at > ?",
+            (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def _set(self, key: str, value: str, ttl: int) -> None:
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now)
+            )
+        self._writes += 1
+        if self._writes % SQLITE_PRUNE_INTERVAL == 0:
+            self._prune(conn, now)
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        """删除过期条目，并按访问时间淘汰超出容量的条目"""
+        with conn:
+            conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def _clear(self) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM llm_cache")
+
+    def _size(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def clear(self) -> None:
+        await asyncio.to_thread(self._clear)
+
+    async def size(self) -> Optional[int]:
+        return await asyncio.to_thread(self._size)
+
+
+class RedisLLMCache(LLMCacheBackend):
+    """
+    Redis 缓存，多实例部署时共享
+
+    过期由 Redis TTL 处理，容量淘汰依赖 Redis 的 maxmemory-policy（建议 allkeys-lru）
+    """
+
+    name = "redis"
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.redis.get(KEY_PREFIX + key)
+
+    async def set(self, key: str, value: str, ttl: int) -> None:
+        await self.redis.set(KEY_PREFIX + key, value, ex=ttl)
+
+    async def clear(self) -> None:
+        async for key in self.redis.scan_iter(match=f"{KEY_PREFIX}*", count=500):
+            await self.redis.delete(key)
+
+
+class LLMCache:
+    """缓存入口：统计命中率，后端异常时按未命中处理，不影响正常请求"""
+
+    def __init__(self, backend: LLMCacheBackend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"读取大模型缓存失败: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        try:
+            await self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"写入大模型缓存失败: {e}")
+
+    async def stats(self) -> Dict[str, Any]:
+        """命中率等统计信息"""
+        lookups = self.hits + self.misses
+        try:
+            size = await self.backend.size()
+        except Exception:
+            size = None
+        return {
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "size": size,
+            "ttl": self.ttl,
+        }
+
+
+# 延迟初始化缓存实例
+_llm_cache_instance: Optional[LLMCache] = None
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """根据 LLM_CACHE_BACKEND 获取缓存实例，配置为 none 时返回 None"""
+    global _llm_cache_instance
+    if _llm_cache_instance is None:
+        backend_name = settings.LLM_CACHE_BACKEND
+        if backend_name == "none":
+            return None
+
+        backend: LLMCacheBackend
+        if backend_name == "redis":
+            redis = get_redis()
+            if redis is None:
+                logger.warning("Redis 不可用（未安装 redis 包），大模型缓存使用内存后端")
+                backend = MemoryLLMCache(settings.LLM_CACHE_MAX_ENTRIES)
+            else:
+                backend = RedisLLMCache(redis)
+        elif backend_name == "sqlite":
+            backend = SQLiteLLMCache(settings.LLM_CACHE_SQLITE_PATH, settings.LLM_CACHE_MAX_ENTRIES)
+        else:
+            if backend_name != "memory":
+                logger.warning(f"未知的大模型缓存后端 {backend_name}，使用内存后端")
+            backend = MemoryLLMCache(settings.LLM_CACHE_MAX_ENTRIES)
+
+        _llm_cache_instance = LLMCache(backend, settings.LLM_CACHE_TTL)
+    return _llm_cache_instance
@@ -2,11 +2,16 @@
 通义千问 AI 服务（简化版）
 """
 import json
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator
 import httpx
 from loguru import logger
 
 from app.core.config import settings
+from app.services.http_clients import get_httpx_client
+from app.services.llm_cache import get_llm_cache, make_cache_key
+from app.services.single_flight import SingleFlight
+from app.services.admission import qwen_admission, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_BACKGROUND
+from app.services.resilience import CircuitBreaker, ResilientCaller
 
 
 class QwenService:
@@ -14,24 +19,65 @@ class QwenService:
 
     def __init__(self):
         self.api_key = settings.QWEN_API_KEY
-        self.base_url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
+        api_base = f"{settings.DASHSCOPE_BASE_URL.rstrip('/')}/api/v1"
+        self.base_url = f"{api_base}/services/aigc/text-generation/generation"
+        self.embedding_url = f"{api_base}/services/embeddings/text-embedding/text-embedding"
         self.model = settings.QWEN_MODEL
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
+        # 相同请求并发时只向上游发送一次
+        self.inflight = SingleFlight()
+        # 重试、对冲与熔断（流式请求只经过熔断器）
+        self.resilience = ResilientCaller(
+            "qwen",
+            attempts=settings.QWEN_RETRY_ATTEMPTS,
+            backoff_base=settings.QWEN_RETRY_BACKOFF_BASE,
+            backoff_max=settings.QWEN_RETRY_BACKOFF_MAX,
+            hedge_enabled=settings.QWEN_HEDGE_ENABLED,
+            hedge_percentile=settings.QWEN_HEDGE_PERCENTILE,
+            hedge_min_delay=settings.QWEN_HEDGE_MIN_DELAY,
+            hedge_max_delay=settings.QWEN_HEDGE_MAX_DELAY,
+            breaker=CircuitBreaker(
+                "通义千问",
+                failure_threshold=settings.QWEN_CIRCUIT_FAILURE_THRESHOLD,
+                recovery_timeout=settings.QWEN_CIRCUIT_RECOVERY_TIMEOUT,
+            ),
+        )
 
-    async def _make_request(
+    @staticmethod
+    def _build_messages(
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        history: Optional[List[Dict[str, str]]] = None
+    ) -> List[Dict[str, str]]:
+        """组装对话消息"""
+        messages = []
+
+        if system_prompt:
+            messages.append({
+                "role": "system",
+                "content": system_prompt
+            })
+
+        if history:
+            messages.extend(history)
+
+        messages.append({
+            "role": "user",
+            "content": prompt
+        })
+        return messages
+
+    def _build_payload(
         self,
         messages: List[Dict[str, str]],
         stream: bool = False,
         **kwargs
     ) -> Dict[str, Any]:
-        """发起 API 请求"""
-        if not self.api_key:
-            raise ValueError("通义千问 API Key 未配置，请在 .env 文件中设置 QWEN_API_KEY")
-
-        payload = {
+        """组装请求体"""
+        return {
             "model": kwargs.get("model", self.model),
             "input": {
                 "messages": messages
@@ -45,51 +91,234 @@ class QwenService:
             }
         }
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            try:
-                response = await client.post(
-                    self.base_url,
-                    headers=self.headers,
-                    json=payload
-                )
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPError as e:
-                logger.error(f"通义千问 API 请求失败: {e}")
-                raise
+    def _request_key(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        """请求键（用于响应缓存与请求合并）：模型、消息与采样参数"""
+        parameters = self._build_payload(messages, **kwargs)["parameters"]
+        return make_cache_key(
+            kwargs.get("model", self.model),
+            messages,
+            parameters["temperature"],
+            parameters["top_p"],
+            parameters["max_tokens"]
+        )
+
+    async def _post(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """单次上游请求（由 _call 在准入许可内调用）"""
+        response = await get_httpx_client().post(
+            url,
+            headers=self.headers,
+            json=payload
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _call(self, operation: str, url: str, payload: Dict[str, Any], priority: int):
+        """
+        带重试、对冲与熔断的上游请求
+
+        每次请求经准入控制排队（priority 越小越先执行）；
+        后台任务不对冲；已有请求在排队时也不对冲，避免在上游繁忙时进一步加压
+        """
+        hedge = priority != PRIORITY_BACKGROUND and qwen_admission.queued == 0
+        return self.resilience.call(
+            operation,
+            lambda: self._post(url, payload),
+            hedge=hedge,
+            slot=lambda: qwen_admission.slot(priority)
+        )
+
+    async def _make_request(
+        self,
+        messages: List[Dict[str, str]],
+        stream: bool = False,
+        priority: int = PRIORITY_NORMAL,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """发起 API 请求"""
+        if not self.api_key:
+            raise ValueError("通义千问 API Key 未配置，请在 .env 文件中设置 QWEN_API_KEY")
+
+        payload = self._build_payload(messages, stream=stream, **kwargs)
+
+        try:
+            return await self._call("chat", self.base_url, payload, priority)
+        except httpx.HTTPError as e:
+            logger.error(f"通义千问 API 请求失败: {e}")
+            raise
 
     async def chat(
         self,
         prompt: str,
         system_prompt: Optional[str] = None,
         history: Optional[List[Dict[str, str]]] = None,
+        use_cache: bool = True,
+        priority: int = PRIORITY_NORMAL,
         **kwargs
     ) -> str:
-        """对话生成"""
-        messages = []
+        """
+        对话生成
 
-        if system_prompt:
-            messages.append({
-                "role": "system",
-                "content": system_prompt
-            })
+        相同的 (模型, 消息, 采样参数) 优先返回缓存的回复（见 app.services.llm_cache），
+        use_cache=False 时总是单独请求上游（不合并），但仍会更新缓存；
+        缓存未命中的相同请求并发到达时合并为一次上游调用，只加入优先级不低于自己的进行中调用，
+        高优先级请求不会等待排在后面的低优先级调用；
+        priority 为排队优先级（见 app.services.admission.priority_for）
+        """
+        messages = self._build_messages(prompt, system_prompt, history)
+        key = self._request_key(messages, **kwargs)
 
-        if history:
-            messages.extend(history)
+        if not use_cache:
+            return await self._complete(key, messages, priority, **kwargs)
 
-        messages.append({
-            "role": "user",
-            "content": prompt
-        })
+        cache = get_llm_cache()
+        if cache is not None:
+            cached = await cache.get(key)
+            if cached is not None:
+                return cached
+
+        flight_key = next(
+            (f"{key}:{p}" for p in range(PRIORITY_HIGH, priority) if self.inflight.running(f"{key}:{p}")),
+            f"{key}:{priority}"
+        )
+        return await self.inflight.do(flight_key, lambda: self._complete(key, messages, priority, **kwargs))
 
-        response = await self._make_request(messages, **kwargs)
+    async def _complete(self, key: str, messages: List[Dict[str, str]], priority: int, **kwargs) -> str:
+        """请求上游并写入缓存（由 chat 调用，通常经过请求合并）"""
+        response = await self._make_request(messages, priority=priority, **kwargs)
 
         if "output" in response and "choices" in response["output"]:
-            return response["output"]["choices"][0]["message"]["content"]
+            content = response["output"]["choices"][0]["message"]["content"]
         else:
             logger.error(f"通义千问响应格式错误: {response}")
             raise ValueError("AI 服务响应格式错误")
 
+        cache = get_llm_cache()
+        if cache is not None:
+            await cache.set(key, content)
+        return content
+
+    async def chat_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+        use_cache: bool = True,
+        priority: int = PRIORITY_NORMAL,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """
+        流式对话生成
+
+        使用 DashScope SSE 接口并开启 incremental_output，每个事件只包含新增的文本，
+        逐段产出，首个分段通常在几百毫秒内到达；
+        与 chat 共用响应缓存，命中时一次性产出完整回复
+
+        Yields:
+            新增的回复文本
+        """
+        messages = self._build_messages(prompt, system_prompt, history)
+
+        cache = get_llm_cache()
+        cache_key = self._request_key(messages, **kwargs) if cache is not None else None
+        if cache_key is not None and use_cache:
+            cached = await cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        if not self.api_key:
+            raise ValueError("通义千问 API Key 未配置，请在 .env 文件中设置 QWEN_API_KEY")
+
+        parts = []
+        payload = self._build_payload(messages, stream=True, **kwargs)
+        payload["parameters"]["incremental_output"] = True
+        headers = {
+            **self.headers,
+            "Accept": "text/event-stream",
+            "X-DashScope-SSE": "enable",
+        }
+
+        try:
+            # 流式请求在整个生成期间占用一个并发名额；已产出的内容无法撤回，因此不重试、不对冲
+            async with qwen_admission.slot(priority), self.resilience.breaker.guard(), get_httpx_client().stream(
+                "POST",
+                self.base_url,
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    response.raise_for_status()
+
+                event = None
+                async for line in response.aiter_lines():
+                    if not line:
+                        event = None
+                    elif line.startswith("event:"):
+                        event = line[6:].strip()
+                    elif line.startswith("data:"):
+                        data = json.loads(line[5:])
+                        if event == "error" or data.get("code"):
+                            logger.error(f"通义千问流式响应错误: {data}")
+                            raise ValueError(data.get("message") or "AI 服务响应错误")
+                        choices = data.get("output", {}).get("choices") or []
+                        content = choices[0].get("message", {}).get("content") if choices else None
+                        if content:
+                            parts.append(content)
+                            yield content
+        except httpx.HTTPError as e:
+            logger.error(f"通义千问流式请求失败: {e}")
+            raise
+
+        if cache_key is not None:
+            await cache.set(cache_key, "".join(parts))
+
+    async def embed(
+        self,
+        texts: List[str],
+        model: str = "text-embedding-v1",
+        text_type: str = "document",
+        priority: int = PRIORITY_NORMAL
+    ) -> List[List[float]]:
+        """
+        文本向量化（单次请求，调用方需控制批大小不超过 EMBEDDING_BATCH_SIZE）
+
+        Args:
+            texts: 待向量化的文本列表
+            model: 嵌入模型
+            text_type: document（入库文本）/ query（查询文本）
+            priority: 排队优先级
+
+        Returns:
+            与 texts 顺序一致的向量列表
+        """
+        if not self.api_key:
+            raise ValueError("通义千问 API Key 未配置，请在 .env 文件中设置 QWEN_API_KEY")
+
+        payload = {
+            "model": model,
+            "input": {
+                "texts": texts
+            },
+            "parameters": {
+                "text_type": text_type
+            }
+        }
+
+        try:
+            result = await self._call("embed", self.embedding_url, payload, priority)
+        except httpx.HTTPError as e:
+            logger.error(f"文本向量化请求失败: {e}")
+            raise
+
+        embeddings = result.get("output", {}).get("embeddings")
+        if not embeddings or len(embeddings) != len(texts):
+            logger.error(f"文本向量化响应格式错误: {result}")
+            raise ValueError("AI 服务响应格式错误")
+
+        embeddings.sort(key=lambda item: item["text_index"])
+        return [item["embedding"] for item in embeddings]
+
 
 # 延迟初始化服务实例（避免模块导入时创建）
 _qwen_service_instance = None
@@ -0,0 +1,285 @@
+"""
+上游调用容错
+重试（带随机抖动的指数退避）、对冲请求（慢请求超过近期 p95 耗时后再发一份，取先返回者）
+与熔断（上游持续失败时直接拒绝，定时放行一次试探请求）
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager, nullcontext
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+import httpx
+from loguru import logger
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+T = TypeVar("T")
+
+# 获取调用许可的上下文管理器工厂
+Slot = Callable[[], AsyncContextManager[Any]]
+
+# 计算对冲延迟所需的最少耗时样本数
+MIN_LATENCY_SAMPLES = 20
+
+# 视为上游临时故障的 HTTP 状态码
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# 计入熔断失败的 HTTP 状态码：临时故障之外还包括鉴权失败（密钥失效时每次调用都会失败）
+BREAKER_FAILURE_STATUS_CODES = RETRYABLE_STATUS_CODES | {401, 403}
+
+
+class CircuitOpenError(Exception):
+    """熔断中，上游暂不可用"""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """网络错误、超时、限流与服务端错误可重试；其余（如参数错误）重试无意义"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, httpx.TransportError)
+
+
+def _is_breaker_failure(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in BREAKER_FAILURE_STATUS_CODES
+    return isinstance(exc, httpx.TransportError)
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续 failure_threshold 次上游故障后熔断，recovery_timeout 秒内的调用直接抛出 CircuitOpenError；
+    到期后进入半开状态只放行一个试探请求，成功则恢复，失败则重新熔断
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probing = False
+
+    def _before_call(self) -> bool:
+        """熔断中抛出 CircuitOpenError，返回本次调用是否为半开状态下的试探请求"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name} 服务暂不可用，请稍后重试")
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name} 服务暂不可用，请稍后重试")
+            self._probing = True
+            return True
+        return False
+
+    def _record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info(f"{self.name} 熔断恢复")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def _record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"{self.name} 连续失败 {self.failures} 次，熔断 {self.recovery_timeout}s")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        """
+        包裹一次上游请求：熔断中直接拒绝，并按结果更新状态
+
+        网络错误、限流、服务端错误与鉴权失败计入失败；其他错误（如参数错误）说明上游可达，
+        但也不算成功，不清零失败计数；被取消（如对冲请求的落后者）不影响状态
+        """
+        probe = self._before_call()
+        try:
+            yield
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if _is_breaker_failure(e):
+                self._record_failure()
+            raise
+        else:
+            self._record_success()
+        finally:
+            if probe:
+                self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyTracker:
+    """记录最近若干次成功请求的耗时"""
+
+    def __init__(self, window: int = 500):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """样本不足时返回 None"""
+        if len(self._samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class ResilientCaller:
+    """
+    为一个上游服务提供重试、对冲与熔断
+
+    每次上游请求（包括对冲请求）都经过熔断器；
+    对冲延迟取该操作近期耗时的指定分位数，并限制在 [hedge_min_delay, hedge_max_delay] 内，
+    耗时只统计上游请求本身，不含准入排队时间（排队慢不代表上游慢，对冲反而加剧拥堵）
+    """
+
+    def __init__(
+        self,
+        name: str,
+        attempts: int,
+        backoff_base: float,
+        backoff_max: float,
+        hedge_enabled: bool,
+        hedge_percentile: float,
+        hedge_min_delay: float,
+        hedge_max_delay: float,
+        breaker: CircuitBreaker
+    ):
+        self.name = name
+        self.attempts = max(1, attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.breaker = breaker
+        self._latency: Dict[str, LatencyTracker] = {}
+        # 指标
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def hedge_delay(self, operation: str) -> Optional[float]:
+        """发出对冲请求前的等待时间，样本不足或未启用时返回 None（不对冲）"""
+        if not self.hedge_enabled:
+            return None
+        tracker = self._latency.get(operation)
+        p = tracker.percentile(self.hedge_percentile) if tracker else None
+        if p is None:
+            return None
+        return min(max(p, self.hedge_min_delay), self.hedge_max_delay)
+
+    async def _attempt(self, operation: str, factory: Callable[[], Awaitable[T]], slot: Optional[Slot]) -> T:
+        """单次上游请求：经过熔断器、取得许可后发出，记录成功耗时"""
+        async with self.breaker.guard():
+            async with (slot() if slot is not None else nullcontext()):
+                start = time.monotonic()
+                result = await factory()
+        self._latency.setdefault(operation, LatencyTracker()).record(time.monotonic() - start)
+        return result
+
+    async def _hedged(
+        self,
+        operation: str,
+        factory: Callable[[], Awaitable[T]],
+        hedge: bool,
+        slot: Optional[Slot]
+    ) -> T:
+        """首个请求超过对冲延迟仍未返回时再发一份，返回先成功的结果并取消另一份"""
+        delay = self.hedge_delay(operation) if hedge else None
+        first = asyncio.ensure_future(self._attempt(operation, factory, slot))
+        tasks: List[asyncio.Future] = [first]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self.hedges += 1
+                    logger.debug(f"{self.name} {operation} 超过 {delay:.2f}s 未返回，发出对冲请求")
+                    tasks.append(asyncio.ensure_future(self._attempt(operation, factory, slot)))
+
+            error: Optional[BaseException] = None
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call(
+        self,
+        operation: str,
+        factory: Callable[[], Awaitable[T]],
+        hedge: bool = True,
+        slot: Optional[Slot] = None
+    ) -> T:
+        """
+        执行幂等的上游请求
+
+        Args:
+            operation: 操作名（分别统计耗时，用于计算对冲延迟）
+            factory: 每次调用发起一次上游请求
+            hedge: 是否允许对冲（后台任务或上游繁忙时应关闭）
+            slot: 每次请求前获取调用许可（如 AdmissionController.slot），排队时间不计入耗时
+
+        Raises:
+            CircuitOpenError: 熔断中
+            最后一次请求的异常: 重试耗尽或不可重试
+        """
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(self.attempts),
+            wait=wait_random_exponential(multiplier=self.backoff_base, max=self.backoff_max),
+            retry=retry_if_exception(is_retryable),
+            before_sleep=self._before_retry,
+            reraise=True,
+        )
+        async for attempt in retrying:
+            with attempt:
+                return await self._hedged(operation, factory, hedge, slot)
+
+    def _before_retry(self, retry_state) -> None:
+        self.retries += 1
+        logger.warning(
+            f"{self.name} 请求失败（第 {retry_state.attempt_number} 次），"
+            f"{retry_state.next_action.sleep:.2f}s 后重试: {retry_state.outcome.exception()!r}"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        hedge_delay = {}
+        for operation in self._latency:
+            delay = self.hedge_delay(operation)
+            hedge_delay[operation] = round(delay * 1000, 1) if delay is not None else None
+        return {
+            "circuit": self.breaker.stats(),
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay_ms": hedge_delay,
+        }
@@ -0,0 +1,183 @@
+"""
+知识库检索服务
+向量检索与关键词检索并行执行，结果按倒数排名融合（RRF）
+"""
+import asyncio
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+from loguru import logger
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.knowledge_base import KnowledgeBase, KnowledgeDocument, KnowledgeChunk
+from app.services.vector_store import get_vector_store, INDEX_FLAT
+from app.services import keyword_index
+
+# 拼接到提示词中的单个片段最大字符数
+MAX_PASSAGE_CHARS = 1000
+
+# 检索结果：(分块ID, 得分)
+Hits = List[Tuple[int, float]]
+
+
+def load_sources(
+    db: Session,
+    hits: Sequence[Tuple[int, float]],
+    extra: Optional[Dict[int, Dict[str, Any]]] = None
+) -> List[Dict[str, Any]]:
+    """
+    根据 (分块ID, 得分) 列表加载分块详情，保持输入顺序
+
+    Args:
+        db: 数据库会话
+        hits: (分块ID, 得分) 列表
+        extra: 按分块ID附加到结果中的字段
+
+    Returns:
+        可直接放入 KnowledgeQueryResponse.sources 的字典列表
+    """
+    if not hits:
+        return []
+
+    chunk_ids = [chunk_id for chunk_id, _ in hits]
+    rows = db.query(KnowledgeChunk, KnowledgeDocument.file_name).join(
+        KnowledgeDocument, KnowledgeDocument.id == KnowledgeChunk.doc_id
+    ).filter(KnowledgeChunk.id.in_(chunk_ids)).all()
+    by_id = {chunk.id: (chunk, file_name) for chunk, file_name in rows}
+
+    sources = []
+    for chunk_id, score in hits:
+        if chunk_id not in by_id:
+            continue  # 向量存在但分块已被删除
+        chunk, file_name = by_id[chunk_id]
+        source = {
+            "chunk_id": chunk.id,
+            "doc_id": chunk.doc_id,
+            "file_name": file_name,
+            "chunk_index": chunk.chunk_index,
+            "start_offset": chunk.start_offset,
+            "end_offset": chunk.end_offset,
+            "score": round(score, 6),
+            "content": chunk.content,
+        }
+        if extra and chunk_id in extra:
+            source.update(extra[chunk_id])
+        sources.append(source)
+    return sources
+
+
+async def _vector_hits(kb: KnowledgeBase, query: str, top_k: int) -> Hits:
+    """向量检索：查询向量化后按知识库的索引类型（flat/ivf）取 top_k"""
+    store = get_vector_store()
+    # 首次访问知识库时 count 会从磁盘加载向量矩阵，在线程中执行以免阻塞事件循环
+    if await asyncio.to_thread(store.count, kb.id) == 0:
+        return []
+
+    from app.services.embedding_service import embedding_service
+
+    query_vector = (await embedding_service.embed_texts(
+        [query],
+        model=kb.embedding_model,
+        text_type="query"
+    ))[0]
+    return await asyncio.to_thread(
+        store.search,
+        kb.id,
+        query_vector,
+        top_k,
+        index_type=kb.index_type or INDEX_FLAT,
+        nprobe=kb.index_nprobe
+    )
+
+
+def _keyword_hits_sync(kb_id: int, query: str, top_k: int) -> Hits:
+    """关键词检索（在线程中运行，使用独立的数据库会话）"""
+    db = SessionLocal()
+    try:
+        return keyword_index.search(db, kb_id, query, top_k)
+    finally:
+        db.close()
+
+
+async def _keyword_hits(kb: KnowledgeBase, query: str, top_k: int) -> Hits:
+    """关键词检索：全文索引按 BM25 排序取 top_k"""
+    return await asyncio.to_thread(_keyword_hits_sync, kb.id, query, top_k)
+
+
+async def vector_search(db: Session, kb: KnowledgeBase, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    """仅向量检索，返回来源列表（见 load_sources）"""
+    return load_sources(db, await _vector_hits(kb, query, top_k))
+
+
+async def keyword_search(db: Session, kb: KnowledgeBase, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    """仅关键词检索，返回来源列表（见 load_sources）"""
+    return load_sources(db, await _keyword_hits(kb, query, top_k))
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[Hits], k: int = 60) -> Hits:
+    """
+    倒数排名融合：score = Σ 1 / (k + rank)
+
+    Args:
+        result_lists: 多路检索结果，每路按相关度降序
+        k: 平滑常数，越大越弱化排名靠前结果的优势
+
+    Returns:
+        按融合得分降序的 (分块ID, 得分) 列表
+    """
+    fused: Dict[int, float] = {}
+    for hits in result_lists:
+        for rank, (chunk_id, _) in enumerate(hits, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+async def _run_with_budget(name: str, coro, timeout: float) -> Hits:
+    """在时间预算内执行检索，超时或失败时返回空结果"""
+    try:
+        return await asyncio.wait_for(coro, timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"{name}检索超时（{timeout}s），降级为其他检索结果")
+    except Exception as e:
+        logger.warning(f"{name}检索失败，降级为其他检索结果: {e}")
+    return []
+
+
+async def hybrid_search(
+    db: Session,
+    kb: KnowledgeBase,
+    query: str,
+    top_k: int = 5
+) -> List[Dict[str, Any]]:
+    """
+    混合检索：向量与关键词检索并行执行，各自有独立的时间预算，结果按 RRF 融合
+
+    任意一路超时或失败时仅使用另一路结果，不会导致请求失败
+
+    Returns:
+        来源列表，score 为融合得分，并附带 vector_score / keyword_score
+    """
+    # 每路多取一些候选，融合后再截断
+    candidates = top_k * settings.RETRIEVAL_CANDIDATE_FACTOR
+
+    vector_hits, keyword_hits = await asyncio.gather(
+        _run_with_budget("向量", _vector_hits(kb, query, candidates), settings.RETRIEVAL_VECTOR_TIMEOUT),
+        _run_with_budget("关键词", _keyword_hits(kb, query, candidates), settings.RETRIEVAL_KEYWORD_TIMEOUT),
+    )
+
+    extra: Dict[int, Dict[str, Any]] = {}
+    for field, hits in (("vector_score", vector_hits), ("keyword_score", keyword_hits)):
+        for chunk_id, score in hits:
+            extra.setdefault(chunk_id, {})[field] = round(score, 6)
+
+    fused = reciprocal_rank_fusion([vector_hits, keyword_hits], k=settings.RETRIEVAL_RRF_K)
+    return load_sources(db, fused[:top_k], extra)
+
+
+def build_context_prompt(sources: Sequence[Dict[str, Any]]) -> str:
+    """将检索到的片段拼接为提示词上下文"""
+    passages = []
+    for i, source in enumerate(sources, start=1):
+        passages.append(f"[{i}] 《{source['file_name']}》\n{source['content'][:MAX_PASSAGE_CHARS]}")
+    return "\n\n".join(passages)
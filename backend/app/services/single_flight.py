@@ -0,0 +1,81 @@
+"""
+请求合并（single-flight）
+相同键的并发调用只执行一次，其余调用等待同一个结果或异常
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    """一次正在执行的调用及其等待者数量"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合并相同键的并发异步调用
+
+    首个调用方启动共享任务，后续调用方等待同一任务；
+    某个等待者被取消（如客户端断开）时只退出等待，不影响其他等待者，
+    所有等待者都取消后才取消共享任务，避免为无人接收的结果继续消耗上游配额
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """
+        执行或加入键为 key 的调用
+
+        Args:
+            key: 调用键，相同键视为相同请求
+            factory: 无进行中的调用时用于创建协程
+
+        Returns:
+            共享调用的结果（异常同样传递给所有等待者）
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # 立即移除，之后到达的调用方发起新的调用，而不是加入已取消的任务
+                self._forget(key, call)
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def running(self, key: str) -> bool:
+        """键为 key 的调用是否正在执行"""
+        return key in self._calls
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """合并统计"""
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesce_rate": round(self.coalesced / total, 4) if total else 0.0,
+        }
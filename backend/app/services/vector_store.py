@@ -0,0 +1,525 @@
+"""
+向量存储服务
+定义统一的向量存储接口，并提供基于 NumPy 的本地实现（无需外部服务）
+
+支持两种索引类型（按知识库选择）：
+- flat: 精确检索，一次批量矩阵乘法加 argpartition
+- ivf:  倒排文件近似检索，只扫描与查询最接近的 nprobe 个聚类，nprobe 越大召回越高、延迟越高
+"""
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+
+# 检索结果：(分块ID, 相似度)
+SearchHit = Tuple[int, float]
+
+# 索引类型
+INDEX_FLAT = "flat"
+INDEX_IVF = "ivf"
+INDEX_TYPES = (INDEX_FLAT, INDEX_IVF)
+
+
+class VectorStore(ABC):
+    """向量存储接口，按知识库隔离"""
+
+    @abstractmethod
+    def add(self, kb_id: int, ids: Sequence[int], vectors: Sequence[Sequence[float]]) -> None:
+        """写入向量（同 ID 覆盖）"""
+
+    @abstractmethod
+    def delete(self, kb_id: int, ids: Sequence[int]) -> int:
+        """删除向量，返回删除数量"""
+
+    @abstractmethod
+    def search_batch(
+        self,
+        kb_id: int,
+        queries: Sequence[Sequence[float]],
+        top_k: int = 5,
+        index_type: str = INDEX_FLAT,
+        nprobe: Optional[int] = None
+    ) -> List[List[SearchHit]]:
+        """批量检索，每个查询返回按相似度降序的 top_k 结果"""
+
+    @abstractmethod
+    def get(self, kb_id: int, ids: Sequence[int]) -> Dict[int, np.ndarray]:
+        """按 ID 读取已归一化的向量，不存在的 ID 不返回"""
+
+    @abstractmethod
+    def drop(self, kb_id: int) -> None:
+        """删除整个知识库的向量"""
+
+    @abstractmethod
+    def count(self, kb_id: int) -> int:
+        """知识库中的向量数量"""
+
+    def search(
+        self,
+        kb_id: int,
+        query: Sequence[float],
+        top_k: int = 5,
+        index_type: str = INDEX_FLAT,
+        nprobe: Optional[int] = None
+    ) -> List[SearchHit]:
+        """单条检索"""
+        return self.search_batch(kb_id, [query], top_k, index_type=index_type, nprobe=nprobe)[0]
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    """按行 L2 归一化，使内积等于余弦相似度"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """返回每行得分最高的 top_k 个列下标（降序）"""
+    k = min(top_k, scores.shape[1])
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[1]), (scores.shape[0], k))
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, batch: int = 65536) -> np.ndarray:
+    """将向量分配到最近（内积最大）的聚类中心"""
+    result = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch):
+        block = vectors[start:start + batch]
+        result[start:start + batch] = np.argmax(block @ centroids.T, axis=1)
+    return result
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    球面 k-means 训练聚类中心
+
+    Args:
+        vectors: 已归一化的向量矩阵
+        nlist: 聚类数量
+        iterations: 迭代次数
+        seed: 随机种子
+
+    Returns:
+        np.ndarray: 归一化后的聚类中心 (nlist, dim)
+    """
+    # 向量数少于聚类数时无法各取一个初始中心
+    nlist = max(1, min(nlist, len(vectors)))
+    rng = np.random.default_rng(seed)
+    # 每个聚类最多采样 32 个点参与训练，控制训练耗时
+    sample_size = min(len(vectors), nlist * 32)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums[~empty] = np.add.reduceat(sample[order], starts[~empty], axis=0)
+        if empty.any():
+            # 空聚类重新随机取点
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+
+    return centroids.astype(np.float32)
+
+
+def default_nlist(n: int) -> int:
+    """根据向量数量选择聚类数（约 4·√n）"""
+    return int(min(max(4 * np.sqrt(n), 16), 4096))
+
+
+class _KBMatrix:
+    """单个知识库的向量矩阵（连续 float32）、对应分块 ID 以及可选的 IVF 结构"""
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        ids: np.ndarray,
+        centroids: Optional[np.ndarray] = None,
+        assign: Optional[np.ndarray] = None,
+        trained_size: int = 0
+    ):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.centroids = centroids
+        self.assign = assign
+        self.trained_size = trained_size
+        # 磁盘状态：快照行数、追加日志行数、快照之后删除的 ID
+        self.snapshot_size = len(self.ids)
+        self.appended = 0
+        self.deleted = np.empty(0, dtype=np.int64)
+        self._lists: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    @property
+    def has_ivf(self) -> bool:
+        return self.centroids is not None and self.assign is not None and len(self.assign) == len(self.ids)
+
+    @property
+    def log_size(self) -> int:
+        """快照之后追加与删除的记录数"""
+        return self.appended + len(self.deleted)
+
+    def carry_log(self, other: "_KBMatrix") -> None:
+        """沿用另一个矩阵的磁盘状态"""
+        self.snapshot_size = other.snapshot_size
+        self.appended = other.appended
+        self.deleted = other.deleted
+
+    def inverted_lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        """按聚类排序后的行号及每个聚类的起止偏移"""
+        if self._lists is None:
+            order = np.argsort(self.assign, kind="stable")
+            offsets = np.searchsorted(self.assign[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, offsets)
+        return self._lists
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    基于 NumPy 的本地向量存储
+
+    每个知识库的向量保存为 kb_{id}.npy（float32 矩阵）和 kb_{id}_ids.npy（分块ID），
+    IVF 索引额外保存 kb_{id}_centroids.npy、kb_{id}_assign.npy 与 kb_{id}_meta.json（训练时的向量数）。
+    新增向量直接分配到已有聚类、删除只移除对应行，都不需要重新训练；
+    向量数增长到训练时的 IVF_RETRAIN_FACTOR 倍后才会重新训练聚类中心。
+
+    以上文件是快照；之后的新增向量以原始字节追加到 kb_{id}_log.f32 / kb_{id}_log_ids.i64
+    （IVF 时还有 kb_{id}_log_assign.i32），删除的 ID 追加到 kb_{id}_deleted.i64，
+    单次写入只与本次行数成正比。日志记录数超过快照行数时合并为新快照，总写入量均摊为线性。
+    """
+
+    def __init__(self, base_dir: Optional[str] = None):
+        self.base_dir = base_dir or settings.VECTOR_STORE_DIR
+        self._cache: Dict[int, _KBMatrix] = {}
+        self._lock = threading.RLock()
+
+    def _paths(self, kb_id: int) -> Dict[str, str]:
+        prefix = os.path.join(self.base_dir, f"kb_{kb_id}")
+        return {
+            "vectors": f"{prefix}.npy",
+            "ids": f"{prefix}_ids.npy",
+            "centroids": f"{prefix}_centroids.npy",
+            "assign": f"{prefix}_assign.npy",
+            "meta": f"{prefix}_meta.json",
+            "log_vectors": f"{prefix}_log.f32",
+            "log_ids": f"{prefix}_log_ids.i64",
+            "log_assign": f"{prefix}_log_assign.i32",
+            "deleted": f"{prefix}_deleted.i64",
+        }
+
+    # 追加日志文件，合并快照后按此顺序删除
+    _LOG_KEYS_BY_REMOVAL = ("log_ids", "log_vectors", "log_assign", "deleted")
+
+    def _load(self, kb_id: int) -> Optional[_KBMatrix]:
+        """加载知识库矩阵（带内存缓存）"""
+        cached = self._cache.get(kb_id)
+        if cached is not None:
+            return cached
+
+        paths = self._paths(kb_id)
+        if not os.path.exists(paths["vectors"]) or not os.path.exists(paths["ids"]):
+            return None
+
+        centroids = assign = None
+        if os.path.exists(paths["centroids"]) and os.path.exists(paths["assign"]):
+            centroids = np.load(paths["centroids"])
+            assign = np.load(paths["assign"])
+
+        vectors = np.load(paths["vectors"])
+        trained_size = self._load_trained_size(paths, len(vectors))
+        matrix = _KBMatrix(vectors, np.load(paths["ids"]), centroids, assign, trained_size=trained_size)
+        self._replay_log(paths, matrix)
+        self._cache[kb_id] = matrix
+        return matrix
+
+    @staticmethod
+    def _read_log(path: str, dtype, width: int = 1) -> np.ndarray:
+        if not os.path.exists(path):
+            return np.empty((0, width) if width > 1 else 0, dtype=dtype)
+        data = np.fromfile(path, dtype=dtype)
+        return data[:len(data) // width * width].reshape(-1, width) if width > 1 else data
+
+    def _replay_log(self, paths: Dict[str, str], matrix: _KBMatrix) -> None:
+        """把快照之后的追加与删除日志合并进矩阵"""
+        dim = matrix.vectors.shape[1] if matrix.vectors.ndim == 2 else 0
+        log_ids = self._read_log(paths["log_ids"], np.int64)
+        if len(log_ids) and dim:
+            log_vectors = self._read_log(paths["log_vectors"], np.float32, dim)
+            rows = min(len(log_ids), len(log_vectors))
+            log_assign = None
+            if matrix.has_ivf:
+                log_assign = self._read_log(paths["log_assign"], np.int32)
+                rows = min(rows, len(log_assign))
+            # 写入中断时各文件行数可能不一致，截断到一致的行数，后续追加才能对齐
+            self._truncate(paths["log_ids"], rows * 8)
+            self._truncate(paths["log_vectors"], rows * dim * 4)
+            if log_assign is not None:
+                self._truncate(paths["log_assign"], rows * 4)
+            # 合并快照后、删除日志前中断时，日志中的行已在快照里
+            fresh = ~np.isin(log_ids[:rows], matrix.ids)
+            matrix.vectors = np.concatenate([matrix.vectors, log_vectors[:rows][fresh]])
+            matrix.ids = np.concatenate([matrix.ids, log_ids[:rows][fresh]])
+            if log_assign is not None:
+                matrix.assign = np.concatenate([matrix.assign, log_assign[:rows][fresh]])
+            matrix.appended = rows
+
+        deleted = self._read_log(paths["deleted"], np.int64)
+        if len(deleted):
+            keep = ~np.isin(matrix.ids, deleted)
+            matrix.vectors = matrix.vectors[keep]
+            matrix.ids = matrix.ids[keep]
+            if matrix.assign is not None:
+                matrix.assign = matrix.assign[keep]
+            matrix.deleted = deleted
+
+    @staticmethod
+    def _truncate(path: str, size: int) -> None:
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+    @staticmethod
+    def _append_log(path: str, array: np.ndarray) -> None:
+        with open(path, "ab") as f:
+            f.write(np.ascontiguousarray(array).tobytes())
+
+    @staticmethod
+    def _load_trained_size(paths: Dict[str, str], default: int) -> int:
+        """训练聚类时的向量数；旧版本没有保存时按当前向量数计"""
+        try:
+            with open(paths["meta"], "r", encoding="utf-8") as f:
+                return int(json.load(f)["trained_size"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return default
+
+    @staticmethod
+    def _atomic_save(path: str, array: np.ndarray) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+
+    def _save(self, kb_id: int, matrix: _KBMatrix) -> None:
+        os.makedirs(self.base_dir, exist_ok=True)
+        paths = self._paths(kb_id)
+        self._atomic_save(paths["vectors"], matrix.vectors)
+        self._atomic_save(paths["ids"], matrix.ids)
+        if matrix.has_ivf:
+            self._atomic_save(paths["centroids"], matrix.centroids)
+            self._atomic_save(paths["assign"], matrix.assign)
+            tmp_path = f"{paths['meta']}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"trained_size": matrix.trained_size}, f)
+            os.replace(tmp_path, paths["meta"])
+        # 快照已包含全部数据；先删 ID 日志使追加日志整体失效，再删删除日志
+        for key in self._LOG_KEYS_BY_REMOVAL:
+            if os.path.exists(paths[key]):
+                os.remove(paths[key])
+        matrix.snapshot_size = len(matrix.ids)
+        matrix.appended = 0
+        matrix.deleted = np.empty(0, dtype=np.int64)
+        self._cache[kb_id] = matrix
+
+    def _persist(self, kb_id: int, matrix: _KBMatrix, log: Dict[str, np.ndarray]) -> None:
+        """日志未超过快照行数时只追加本次变更，否则合并为新快照"""
+        if matrix.log_size > matrix.snapshot_size:
+            self._save(kb_id, matrix)
+            return
+        paths = self._paths(kb_id)
+        # ID 最后写入，作为整行写完的标记
+        for key in ("log_vectors", "log_assign", "log_ids", "deleted"):
+            if key in log:
+                self._append_log(paths[key], log[key])
+        self._cache[kb_id] = matrix
+
+    def add(self, kb_id: int, ids: Sequence[int], vectors: Sequence[Sequence[float]]) -> None:
+        if len(ids) == 0:
+            return
+        new_ids = np.asarray(ids, dtype=np.int64)
+        new_vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+
+        with self._lock:
+            current = self._load(kb_id)
+            if current is None or len(current.ids) == 0:
+                self._save(kb_id, _KBMatrix(new_vectors, new_ids))
+                return
+
+            if current.vectors.shape[1] != new_vectors.shape[1]:
+                raise ValueError(
+                    f"向量维度不一致: 已有 {current.vectors.shape[1]}，新增 {new_vectors.shape[1]}"
+                )
+
+            keep = ~np.isin(current.ids, new_ids)
+            merged = _KBMatrix(
+                np.concatenate([current.vectors[keep], new_vectors]),
+                np.concatenate([current.ids[keep], new_ids]),
+                trained_size=current.trained_size,
+            )
+            merged.carry_log(current)
+            log = {"log_vectors": new_vectors, "log_ids": new_ids}
+            if current.has_ivf:
+                # 增量插入：新向量分配到最近的已有聚类
+                new_assign = _assign(new_vectors, current.centroids)
+                merged.centroids = current.centroids
+                merged.assign = np.concatenate([current.assign[keep], new_assign])
+                log["log_assign"] = new_assign
+                if len(merged.ids) >= current.trained_size * settings.IVF_RETRAIN_FACTOR:
+                    self._train(merged)
+                    self._save(kb_id, merged)
+                    return
+            # 覆盖已有 ID 或重新写入已删除的 ID 时日志无法表达先后顺序，直接合并快照
+            if not keep.all() or np.isin(new_ids, current.deleted).any():
+                self._save(kb_id, merged)
+                return
+            merged.appended += len(new_ids)
+            self._persist(kb_id, merged, log)
+
+    def delete(self, kb_id: int, ids: Sequence[int]) -> int:
+        if len(ids) == 0:
+            return 0
+        with self._lock:
+            current = self._load(kb_id)
+            if current is None:
+                return 0
+            keep = ~np.isin(current.ids, np.asarray(ids, dtype=np.int64))
+            removed = int(len(keep) - keep.sum())
+            if removed:
+                remaining = _KBMatrix(
+                    current.vectors[keep],
+                    current.ids[keep],
+                    trained_size=current.trained_size,
+                )
+                remaining.carry_log(current)
+                if current.has_ivf:
+                    remaining.centroids = current.centroids
+                    remaining.assign = current.assign[keep]
+                removed_ids = current.ids[~keep]
+                remaining.deleted = np.concatenate([current.deleted, removed_ids])
+                self._persist(kb_id, remaining, {"deleted": removed_ids})
+            return removed
+
+    @staticmethod
+    def _train(matrix: _KBMatrix) -> None:
+        """训练聚类中心并分配全部向量"""
+        nlist = default_nlist(len(matrix.ids))
+        matrix.centroids = train_centroids(matrix.vectors, nlist)
+        matrix.assign = _assign(matrix.vectors, matrix.centroids)
+        matrix.trained_size = len(matrix.ids)
+        matrix._lists = None
+        logger.info(f"IVF 索引训练完成: 向量数={len(matrix.ids)}, nlist={nlist}")
+
+    def build_ivf(self, kb_id: int, force: bool = False) -> bool:
+        """
+        为知识库训练 IVF 索引
+
+        Args:
+            kb_id: 知识库ID
+            force: 已有索引时是否强制重新训练
+
+        Returns:
+            bool: 是否存在可用的 IVF 索引（向量数不足 IVF_MIN_TRAIN_SIZE 时为 False）
+        """
+        with self._lock:
+            current = self._load(kb_id)
+            if current is None or len(current.ids) < settings.IVF_MIN_TRAIN_SIZE:
+                return False
+            if current.has_ivf and not force:
+                return True
+            self._train(current)
+            self._save(kb_id, current)
+            return True
+
+    def search_batch(
+        self,
+        kb_id: int,
+        queries: Sequence[Sequence[float]],
+        top_k: int = 5,
+        index_type: str = INDEX_FLAT,
+        nprobe: Optional[int] = None
+    ) -> List[List[SearchHit]]:
+        with self._lock:
+            current = self._load(kb_id)
+            if current is None or len(current.ids) == 0 or len(queries) == 0:
+                return [[] for _ in queries]
+            if index_type == INDEX_IVF and not current.has_ivf:
+                self.build_ivf(kb_id)
+                current = self._load(kb_id)
+
+        query_matrix = _normalize(np.asarray(queries, dtype=np.float32))
+        if index_type == INDEX_IVF and current.has_ivf:
+            return self._search_ivf(current, query_matrix, top_k, nprobe or settings.IVF_DEFAULT_NPROBE)
+
+        scores = query_matrix @ current.vectors.T
+        indices = _top_k(scores, top_k)
+        return [
+            [(int(current.ids[i]), float(scores[row, i])) for i in indices[row]]
+            for row in range(indices.shape[0])
+        ]
+
+    @staticmethod
+    def _search_ivf(matrix: _KBMatrix, queries: np.ndarray, top_k: int, nprobe: int) -> List[List[SearchHit]]:
+        """IVF 检索：先选出最近的 nprobe 个聚类，再在候选行中精确打分"""
+        order, offsets = matrix.inverted_lists()
+        probes = _top_k(queries @ matrix.centroids.T, nprobe)
+
+        results = []
+        for row, query in enumerate(queries):
+            candidates = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probes[row]])
+            if len(candidates) == 0:
+                results.append([])
+                continue
+            scores = matrix.vectors[candidates] @ query
+            best = _top_k(scores[np.newaxis, :], top_k)[0]
+            results.append([(int(matrix.ids[candidates[i]]), float(scores[i])) for i in best])
+        return results
+
+    def get(self, kb_id: int, ids: Sequence[int]) -> Dict[int, np.ndarray]:
+        if len(ids) == 0:
+            return {}
+        with self._lock:
+            current = self._load(kb_id)
+        if current is None:
+            return {}
+        rows = np.flatnonzero(np.isin(current.ids, np.asarray(ids, dtype=np.int64)))
+        return {int(current.ids[row]): current.vectors[row] for row in rows}
+
+    def drop(self, kb_id: int) -> None:
+        with self._lock:
+            self._cache.pop(kb_id, None)
+            for path in self._paths(kb_id).values():
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def count(self, kb_id: int) -> int:
+        with self._lock:
+            current = self._load(kb_id)
+        return 0 if current is None else len(current.ids)
+
+
+# 延迟初始化向量存储实例
+_vector_store_instance: Optional[VectorStore] = None
+
+
+def get_vector_store() -> VectorStore:
+    """根据 VECTOR_STORE_BACKEND 获取向量存储实例"""
+    global _vector_store_instance
+    if _vector_store_instance is None:
+        backend = settings.VECTOR_STORE_BACKEND
+        if backend != "numpy":
+            # Milvus 等外部后端可实现 VectorStore 接口后在此接入
+            logger.warning(f"向量存储后端 {backend} 暂未实现，使用本地 NumPy 存储")
+        _vector_store_instance = NumpyVectorStore()
+    return _vector_store_instance
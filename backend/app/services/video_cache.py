@@ -0,0 +1,240 @@
+"""
+视频生成结果复用
+以规范化的生成参数（提示词、宽高比、分段时长、模板、风格）哈希为 generation_key：
+新任务与 VIDEO_RESULT_CACHE_TTL 内已完成的任务相同时直接完成并复用其视频地址；
+与进行中的任务相同时挂到该任务上（source_task_id），不再单独提交服务商，结果随之写入。
+被跟随的任务失败或被删除时，跟随的任务恢复为独立的待处理任务重新生成
+"""
+import hashlib
+import json
+import os
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.video import VideoGenerationTask, VideoSegment, VideoGenerationStatus
+from app.services.video_mirror import MIRROR_COMPLETED, mirror_path
+from app.services.video_segments import is_long_video, is_playlist_url, long_video_url, split_duration
+
+# 从被跟随任务同步到跟随任务的字段
+FOLLOW_FIELDS = (
+    "status",
+    "progress",
+    "video_url",
+    "thumbnail_url",
+    "video_duration_actual",
+    "video_size",
+    "error_message",
+    "completed_at",
+)
+
+# 被跟随任务删除时转给接替任务的字段（完成时间表示视频地址的生成时间，用于复用有效期与镜像期限）
+HEIR_FIELDS = (
+    "provider_task_id",
+    "submitted_at",
+    "completed_at",
+    "video_size",
+)
+
+IN_FLIGHT_STATUSES = (VideoGenerationStatus.PENDING.value, VideoGenerationStatus.PROCESSING.value)
+
+
+def generation_key(
+    prompt: str,
+    aspect_ratio: str,
+    duration: int,
+    template_id: Optional[int] = None,
+    video_style: Optional[str] = None
+) -> str:
+    """
+    生成参数的规范化哈希
+
+    提示词统一 Unicode 形式并合并空白；时长按实际提交给服务商的分段计算
+    （如单段模式下 6 秒与 10 秒的请求生成结果相同）
+    """
+    durations = split_duration(duration) if is_long_video(duration) else [5 if duration <= 5 else 10]
+    normalized = {
+        "prompt": " ".join(unicodedata.normalize("NFKC", prompt).split()),
+        "aspect_ratio": aspect_ratio,
+        "durations": durations,
+        "template_id": template_id,
+        "style": " ".join((video_style or "").split()) or None,
+    }
+    raw = json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def find_reusable_task(db: Session, key: str) -> Optional[VideoGenerationTask]:
+    """
+    查找可复用的任务：优先有效期内已完成的，其次进行中的
+
+    只在独立生成的任务中查找（复用得来的任务完成时间不代表视频地址的生成时间）
+    """
+    if not settings.VIDEO_RESULT_CACHE_ENABLED:
+        return None
+
+    base = db.query(VideoGenerationTask).filter(
+        VideoGenerationTask.generation_key == key,
+        VideoGenerationTask.source_task_id.is_(None)
+    )
+    since = datetime.utcnow() - timedelta(seconds=settings.VIDEO_RESULT_CACHE_TTL)
+    completed = base.filter(
+        VideoGenerationTask.status == VideoGenerationStatus.COMPLETED.value,
+        VideoGenerationTask.video_url.isnot(None),
+        VideoGenerationTask.completed_at >= since
+    ).order_by(VideoGenerationTask.completed_at.desc()).first()
+    if completed is not None:
+        return completed
+
+    return base.filter(
+        VideoGenerationTask.status.in_(IN_FLIGHT_STATUSES)
+    ).order_by(VideoGenerationTask.id).first()
+
+
+def reuse_task(task: VideoGenerationTask, source: VideoGenerationTask) -> None:
+    """
+    让新任务（已 flush，有 id）复用 source 的结果或挂到 source 上等待
+
+    跟随的任务不会被 worker 领取（见 app.services.video_jobs._claimable）
+    """
+    task.source_task_id = source.id
+    task.provider_task_id = source.provider_task_id
+    task.submitted_at = source.submitted_at
+    task.status = source.status
+    task.progress = source.progress
+    if source.status == VideoGenerationStatus.COMPLETED.value:
+        if task.segment_count:
+            task.video_url = long_video_url(task.id, hls=is_playlist_url(source.video_url))
+        else:
+            task.video_url = source.video_url
+        task.thumbnail_url = source.thumbnail_url
+        task.video_duration_actual = source.video_duration_actual
+        task.video_size = source.video_size
+        task.completed_at = datetime.utcnow()
+
+
+def _follower_values(leader_values: Dict[Any, Any], follower_id: int, segmented: bool) -> Dict[Any, Any]:
+    if leader_values.get(VideoGenerationTask.status) == VideoGenerationStatus.FAILED.value:
+        return detach_values()
+    values = {column: value for column, value in leader_values.items() if column.key in FOLLOW_FIELDS}
+    if VideoGenerationTask.video_url in values and segmented:
+        leader_url = values[VideoGenerationTask.video_url]
+        values[VideoGenerationTask.video_url] = long_video_url(follower_id, hls=is_playlist_url(leader_url))
+    return values
+
+
+def detach_values() -> Dict[Any, Any]:
+    """跟随的任务恢复为独立的待处理任务"""
+    return {
+        VideoGenerationTask.source_task_id: None,
+        VideoGenerationTask.provider_task_id: None,
+        VideoGenerationTask.submitted_at: None,
+        VideoGenerationTask.status: VideoGenerationStatus.PENDING.value,
+        VideoGenerationTask.progress: 0,
+        VideoGenerationTask.available_at: datetime.utcnow(),
+    }
+
+
+def propagate_to_followers(
+    db: Session,
+    leader_updates: Dict[int, Dict[Any, Any]]
+) -> Dict[int, Tuple[int, Dict[Any, Any]]]:
+    """
+    把被跟随任务本次写入的状态同步给跟随的任务（在调用方的事务中执行）
+
+    被跟随任务失败时，跟随的任务恢复为独立的待处理任务
+
+    Returns:
+        {跟随任务ID: (用户ID, 写入的字段)}
+    """
+    if not leader_updates:
+        return {}
+    followers = db.query(
+        VideoGenerationTask.id,
+        VideoGenerationTask.user_id,
+        VideoGenerationTask.source_task_id,
+        VideoGenerationTask.segment_count
+    ).filter(
+        VideoGenerationTask.source_task_id.in_(list(leader_updates)),
+        VideoGenerationTask.status.in_(IN_FLIGHT_STATUSES)
+    ).all()
+
+    written: Dict[int, Tuple[int, Dict[Any, Any]]] = {}
+    for follower_id, user_id, leader_id, segment_count in followers:
+        values = _follower_values(leader_updates[leader_id], follower_id, bool(segment_count))
+        if not values:
+            continue
+        db.query(VideoGenerationTask).filter(
+            VideoGenerationTask.id == follower_id
+        ).update(values, synchronize_session=False)
+        written[follower_id] = (user_id, values)
+    return written
+
+
+def detach_followers(db: Session, leader_id: int) -> List[Tuple[int, int]]:
+    """
+    被跟随任务删除时，进行中的跟随任务恢复为独立的待处理任务（在调用方的事务中执行）
+
+    Returns:
+        [(跟随任务ID, 用户ID)]
+    """
+    followers = db.query(VideoGenerationTask.id, VideoGenerationTask.user_id).filter(
+        VideoGenerationTask.source_task_id == leader_id,
+        VideoGenerationTask.status.in_(IN_FLIGHT_STATUSES)
+    ).all()
+    if followers:
+        db.query(VideoGenerationTask).filter(
+            VideoGenerationTask.id.in_([follower_id for follower_id, _ in followers])
+        ).update(detach_values(), synchronize_session=False)
+    return [(follower_id, user_id) for follower_id, user_id in followers]
+
+
+def promote_follower(db: Session, leader: VideoGenerationTask) -> Optional[int]:
+    """
+    被跟随任务删除前，把结果转给最早的已完成跟随任务（在调用方的事务中执行）
+
+    接替的任务成为独立任务，其余跟随任务改为跟随它，长视频的分段随之转移；
+    已镜像时本地路径改为接替任务的路径，文件由调用方在提交后移动（见 app.services.video_mirror.move_mirror），
+    未镜像时接替任务重新进入待镜像
+
+    Returns:
+        接替任务ID，没有已完成的跟随任务时返回 None
+    """
+    heir = db.query(VideoGenerationTask).filter(
+        VideoGenerationTask.source_task_id == leader.id,
+        VideoGenerationTask.status == VideoGenerationStatus.COMPLETED.value
+    ).order_by(VideoGenerationTask.id).first()
+    if heir is None:
+        return None
+
+    mirrored = leader.mirror_status == MIRROR_COMPLETED
+    heir.source_task_id = None
+    for field in HEIR_FIELDS:
+        setattr(heir, field, getattr(leader, field))
+    heir.mirror_status = MIRROR_COMPLETED if mirrored else None
+    heir.mirror_attempts = leader.mirror_attempts if mirrored else 0
+    heir.mirror_locked_by = None
+    heir.mirror_available_at = None
+    heir.local_path = None
+    if mirrored:
+        heir.local_path = os.path.dirname(mirror_path(heir.id, 0)) if heir.segment_count else mirror_path(heir.id)
+
+    db.query(VideoGenerationTask).filter(
+        VideoGenerationTask.source_task_id == leader.id,
+        VideoGenerationTask.id != heir.id
+    ).update({VideoGenerationTask.source_task_id: heir.id}, synchronize_session=False)
+    for segment in db.query(VideoSegment).filter(VideoSegment.task_id == leader.id):
+        segment.task_id = heir.id
+        segment.local_path = mirror_path(heir.id, segment.segment_index) if mirrored and segment.local_path else None
+    db.flush()
+    return heir.id
+
+
+def is_referenced(db: Session, task_id: int) -> bool:
+    """是否有其他任务复用该任务的结果（长视频的分段需要保留）"""
+    return db.query(VideoGenerationTask.id).filter(
+        VideoGenerationTask.source_task_id == task_id
+    ).first() is not None
@@ -0,0 +1,85 @@
+"""
+视频任务状态推送
+任务状态或进度变化时（写库提交之后）向任务所属用户发布 task 事件，
+客户端通过 GET /video/events 订阅，无需再轮询任务详情
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from loguru import logger
+from sqlalchemy import or_
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.video import VideoGenerationTask, VideoGenerationStatus
+from app.services.event_bus import get_event_bus
+
+# 事件类型
+EVENT_TASK = "task"
+EVENT_SNAPSHOT = "snapshot"
+
+# 推送给客户端的任务字段
+TASK_EVENT_FIELDS = ("status", "progress", "video_url", "thumbnail_url", "error_message")
+
+# 快照最多包含的任务数
+SNAPSHOT_LIMIT = 100
+
+
+def task_event(task_id: int, values: Dict[Any, Any]) -> Dict[str, Any]:
+    """
+    从写库的字段中提取需要推送的部分
+
+    values 的键可以是模型列（如 VideoGenerationTask.progress）或列名
+    """
+    payload: Dict[str, Any] = {"task_id": task_id}
+    for key, value in values.items():
+        name = getattr(key, "key", key)
+        if name in TASK_EVENT_FIELDS:
+            payload[name] = value
+    return payload
+
+
+async def publish_task_update(user_id: int, task_id: int, values: Dict[Any, Any]) -> None:
+    """发布任务变化；推送失败只记录日志，不影响任务执行（客户端重连时会收到快照）"""
+    payload = task_event(task_id, values)
+    if len(payload) == 1:
+        return
+    try:
+        await get_event_bus().publish(user_id, EVENT_TASK, payload)
+    except Exception as e:
+        logger.warning(f"推送视频任务事件失败: task_id={task_id}, {e}")
+
+
+async def publish_task_deleted(user_id: int, task_id: int) -> None:
+    """发布任务删除"""
+    try:
+        await get_event_bus().publish(user_id, EVENT_TASK, {"task_id": task_id, "deleted": True})
+    except Exception as e:
+        logger.warning(f"推送视频任务事件失败: task_id={task_id}, {e}")
+
+
+def load_task_snapshot(user_id: int) -> List[Dict[str, Any]]:
+    """
+    用户当前任务的全量状态（订阅开始或无法续传时发送）
+
+    包含未结束的任务，以及事件保留时间内结束的任务（客户端可能错过了完成事件）
+    """
+    db = SessionLocal()
+    try:
+        since = datetime.utcnow() - timedelta(seconds=settings.EVENT_HISTORY_TTL)
+        tasks = db.query(VideoGenerationTask).filter(
+            VideoGenerationTask.user_id == user_id,
+            or_(
+                VideoGenerationTask.status.in_([
+                    VideoGenerationStatus.PENDING.value,
+                    VideoGenerationStatus.PROCESSING.value,
+                ]),
+                VideoGenerationTask.updated_at >= since,
+            )
+        ).order_by(VideoGenerationTask.id.desc()).limit(SNAPSHOT_LIMIT).all()
+        return [
+            task_event(task.id, {name: getattr(task, name) for name in TASK_EVENT_FIELDS})
+            for task in tasks
+        ]
+    finally:
+        db.close()
@@ -0,0 +1,772 @@
+"""
+视频生成任务队列
+任务保存在 video_generation_tasks 表中，worker 按批领取（租约 + 心跳），
+进程崩溃或重启后租约到期的任务会被其他 worker 重新领取，不会丢失；
+worker 负责创建上游任务，之后交给集中轮询（app.services.video_poller）等待完成；
+worker 可以在 API 进程内运行（VIDEO_WORKER_IN_PROCESS），也可以通过 worker.py 单独部署；
+状态变化写库后推送给任务所属用户（app.services.video_events），独立部署 worker 时事件通道需使用 redis 后端；
+完成的视频由 worker 下载到本地（app.services.video_mirror）
+"""
+import asyncio
+import os
+import socket
+import uuid
+import weakref
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import and_, or_
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.user import User
+from app.models.video import VideoGenerationTask, VideoSegment, VideoGenerationStatus
+from app.services.admission import priority_for, PRIORITY_LOW
+from app.services.video_cache import detach_followers
+from app.services.video_events import publish_task_update
+from app.services.video_mirror import VideoMirror
+from app.services.video_scheduler import backfill_virtual_tags, user_slots
+from app.services.video_poller import VideoPoller, TrackedVideo, FINAL_STATUSES, release_leases
+from app.services.video_segments import plan_scenes, split_duration
+
+# 尝试导入通义万相服务，如果失败则任务直接失败
+try:
+    from app.services.wanxiang_service import wanxiang_service
+except ImportError:
+    wanxiang_service = None
+
+# 宽高比到通义万相尺寸的映射
+SIZE_MAP = {
+    "16:9": "1920*1080",
+    "9:16": "1080*1920",
+    "1:1": "1080*1080",
+}
+
+# 领取时多取的候选倍数（部分候选所属用户可能已达并发上限）
+CLAIM_CANDIDATE_FACTOR = 4
+
+
+class LeaseLostError(Exception):
+    """租约已被其他 worker 接管或任务已删除"""
+
+
+def make_worker_id() -> str:
+    """worker 标识：主机名、进程号与随机后缀"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def _claimable(now: datetime):
+    """
+    可领取的任务：到期的待处理任务，或租约已过期的处理中任务
+
+    跟随其他任务（复用结果）的任务不会被领取，见 app.services.video_cache
+    """
+    return and_(
+        VideoGenerationTask.source_task_id.is_(None),
+        or_(
+            and_(
+                VideoGenerationTask.status == VideoGenerationStatus.PENDING.value,
+                or_(VideoGenerationTask.available_at.is_(None), VideoGenerationTask.available_at <= now),
+            ),
+            and_(
+                VideoGenerationTask.status == VideoGenerationStatus.PROCESSING.value,
+                or_(VideoGenerationTask.lease_expires_at.is_(None), VideoGenerationTask.lease_expires_at < now),
+            ),
+        ),
+    )
+
+
+def claim_jobs(worker_id: str, limit: int) -> List[Tuple[int, int]]:
+    """
+    领取最多 limit 个任务，返回 (任务ID, 用户ID)
+
+    按加权公平排队的 virtual_start 顺序领取（见 app.services.video_scheduler），
+    跳过处理中任务数已达会员并发上限的用户；租约过期的处理中任务不受上限限制。
+    先选出候选任务，再逐个用带条件的 UPDATE 抢占：多个 worker 同时领取时
+    只有一个能更新成功（PostgreSQL 上候选查询还会使用 SKIP LOCKED 减少冲突）；
+    并发上限按领取时读到的处理中任务数判断，多个 worker 同时领取同一用户的任务时可能短暂超出
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        slots = user_slots(db)
+        capped = [user_id for user_id, (in_flight, cap) in slots.items() if in_flight >= cap]
+        query = db.query(
+            VideoGenerationTask.id,
+            VideoGenerationTask.user_id,
+            VideoGenerationTask.status
+        ).filter(_claimable(now))
+        if capped:
+            query = query.filter(or_(
+                VideoGenerationTask.status == VideoGenerationStatus.PROCESSING.value,
+                VideoGenerationTask.user_id.notin_(capped),
+            ))
+        candidates = query.order_by(
+            VideoGenerationTask.virtual_start,
+            VideoGenerationTask.id
+        ).limit(limit * CLAIM_CANDIDATE_FACTOR).with_for_update(skip_locked=True).all()
+        new_users = {user_id for _, user_id, _ in candidates if user_id not in slots}
+        if new_users:
+            slots.update(user_slots(db, new_users))
+
+        claimed = []
+        lease_expires_at = now + timedelta(seconds=settings.VIDEO_JOB_LEASE_SECONDS)
+        for task_id, user_id, task_status in candidates:
+            if len(claimed) >= limit:
+                break
+            queued = task_status == VideoGenerationStatus.PENDING.value
+            if queued and slots[user_id][0] >= slots[user_id][1]:
+                continue
+            updated = db.query(VideoGenerationTask).filter(
+                VideoGenerationTask.id == task_id,
+                _claimable(now)
+            ).update({
+                VideoGenerationTask.status: VideoGenerationStatus.PROCESSING.value,
+                VideoGenerationTask.locked_by: worker_id,
+                VideoGenerationTask.lease_expires_at: lease_expires_at,
+                VideoGenerationTask.heartbeat_at: now,
+                VideoGenerationTask.attempts: VideoGenerationTask.attempts + 1,
+            }, synchronize_session=False)
+            if updated:
+                claimed.append((task_id, user_id))
+                if queued:
+                    slots[user_id][0] += 1
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+
+def _update_task(task_id: int, worker_id: str, values: Dict[Any, Any]) -> List[Tuple[int, int]]:
+    """
+    在持有租约的前提下更新任务；标记失败时跟随该任务的任务恢复为独立任务
+
+    Returns:
+        恢复为独立任务的 (任务ID, 用户ID)
+
+    Raises:
+        LeaseLostError: 租约已不属于本 worker（被接管或任务已删除）
+    """
+    db = SessionLocal()
+    try:
+        updated = db.query(VideoGenerationTask).filter(
+            VideoGenerationTask.id == task_id,
+            VideoGenerationTask.locked_by == worker_id
+        ).update(values, synchronize_session=False)
+        followers = []
+        if updated and values.get(VideoGenerationTask.status) == VideoGenerationStatus.FAILED.value:
+            followers = detach_followers(db, task_id)
+        db.commit()
+    finally:
+        db.close()
+    if not updated:
+        raise LeaseLostError(f"视频任务租约已失效: task_id={task_id}")
+    return followers
+
+
+def _heartbeat(task_id: int, worker_id: str) -> None:
+    """续约"""
+    now = datetime.utcnow()
+    _update_task(task_id, worker_id, {
+        VideoGenerationTask.heartbeat_at: now,
+        VideoGenerationTask.lease_expires_at: now + timedelta(seconds=settings.VIDEO_JOB_LEASE_SECONDS),
+    })
+
+
+def _finish(task_id: int, worker_id: str, values: Dict[Any, Any]) -> List[Tuple[int, int]]:
+    """写入最终状态（或延后重试）并释放租约"""
+    values.update({
+        VideoGenerationTask.locked_by: None,
+        VideoGenerationTask.lease_expires_at: None,
+    })
+    return _update_task(task_id, worker_id, values)
+
+
+async def _finish_and_publish(task_id: int, user_id: int, worker_id: str, values: Dict[Any, Any]) -> None:
+    """释放租约并推送状态；任务失败时跟随它的任务恢复为独立任务，重新排队"""
+    followers = await asyncio.to_thread(_finish, task_id, worker_id, values)
+    await publish_task_update(user_id, task_id, values)
+    for follower_id, follower_user_id in followers:
+        await publish_task_update(follower_user_id, follower_id, {
+            VideoGenerationTask.status: VideoGenerationStatus.PENDING.value,
+            VideoGenerationTask.progress: 0,
+        })
+    if followers:
+        notify_new_job()
+
+
+def _load_job(task_id: int) -> Optional[Dict[str, Any]]:
+    """读取执行任务所需的字段与优先级"""
+    db = SessionLocal()
+    try:
+        task = db.query(VideoGenerationTask).filter(VideoGenerationTask.id == task_id).first()
+        if task is None:
+            return None
+        owner = db.query(User).filter(User.id == task.user_id).first()
+        return {
+            "user_id": task.user_id,
+            "prompt": task.prompt,
+            "video_style": task.video_style,
+            "aspect_ratio": task.aspect_ratio,
+            "video_duration": task.video_duration,
+            "segment_count": task.segment_count,
+            "provider_task_id": task.provider_task_id,
+            # 早期版本未记录提交时间，以最后更新时间近似
+            "submitted_at": task.submitted_at or task.updated_at or datetime.utcnow(),
+            "attempts": task.attempts,
+            "priority": priority_for(owner) if owner else PRIORITY_LOW,
+        }
+    finally:
+        db.close()
+
+
+def _segment_dict(segment: VideoSegment) -> Dict[str, Any]:
+    return {
+        "id": segment.id,
+        "prompt": segment.prompt,
+        "duration": segment.duration,
+        "status": segment.status,
+        "progress": segment.progress,
+        "provider_task_id": segment.provider_task_id,
+        "submitted_at": segment.submitted_at,
+    }
+
+
+def _load_segments(task_id: int) -> List[Dict[str, Any]]:
+    """按顺序读取长视频任务的分段"""
+    db = SessionLocal()
+    try:
+        segments = db.query(VideoSegment).filter(
+            VideoSegment.task_id == task_id
+        ).order_by(VideoSegment.segment_index).all()
+        return [_segment_dict(segment) for segment in segments]
+    finally:
+        db.close()
+
+
+def _create_segments(task_id: int, worker_id: str, scenes: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    """
+    在持有租约的前提下写入分段（分镜提示词, 时长）
+
+    Raises:
+        LeaseLostError: 租约已不属于本 worker
+    """
+    db = SessionLocal()
+    try:
+        owned = db.query(VideoGenerationTask.id).filter(
+            VideoGenerationTask.id == task_id,
+            VideoGenerationTask.locked_by == worker_id
+        ).first()
+        if owned is None:
+            raise LeaseLostError(f"视频任务租约已失效: task_id={task_id}")
+        segments = [
+            VideoSegment(task_id=task_id, segment_index=i, prompt=prompt, duration=duration)
+            for i, (prompt, duration) in enumerate(scenes)
+        ]
+        db.add_all(segments)
+        db.commit()
+        return [_segment_dict(segment) for segment in segments]
+    finally:
+        db.close()
+
+
+def _update_segment(task_id: int, segment_id: int, worker_id: str, values: Dict[Any, Any]) -> None:
+    """
+    在持有父任务租约的前提下更新分段
+
+    Raises:
+        LeaseLostError: 租约已不属于本 worker
+    """
+    db = SessionLocal()
+    try:
+        owned = db.query(VideoGenerationTask.id).filter(
+            VideoGenerationTask.id == task_id,
+            VideoGenerationTask.locked_by == worker_id
+        ).first()
+        if owned is None:
+            raise LeaseLostError(f"视频任务租约已失效: task_id={task_id}")
+        db.query(VideoSegment).filter(
+            VideoSegment.id == segment_id
+        ).update(values, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _is_orphaned(locked_by: Optional[str], worker_id: str) -> bool:
+    """
+    租约持有者是否已确定不在运行
+
+    只能判断同一主机上的 worker：同一进程号但标识不同（进程已重启，容器中进程号常被复用），
+    或进程号已不存在；其他主机上的 worker 只能等租约到期
+    """
+    if not locked_by:
+        return True
+    try:
+        host, pid, _ = locked_by.rsplit(":", 2)
+        my_host, my_pid, _ = worker_id.rsplit(":", 2)
+    except ValueError:
+        return False
+    if host != my_host:
+        return False
+    if pid == my_pid:
+        return locked_by != worker_id
+    return not _pid_alive(int(pid))
+
+
+def recover_orphaned_tasks(worker_id: str, reattach: bool) -> Tuple[List[TrackedVideo], List[Tuple[int, int]]]:
+    """
+    恢复上次进程中断时处理中的任务（启动时调用）
+
+    租约持有者已不在运行（或租约已过期）的 processing 任务：
+    - 尚未创建上游任务的重新排队，立即可被领取（用户配额已在提交时扣除，不会重复扣除）
+    - 已有 provider_task_id 的继续等待原上游任务，不会重复创建、重复消耗生成额度；
+      reattach=True 时由 worker_id 接管租约并返回，交给本进程的轮询，否则释放租约由其他 worker 领取
+    - 长视频任务总是重新排队，重新领取时只提交尚未创建上游任务的分段
+
+    每条更新都以原 locked_by 为条件，不会抢走其他 worker 刚续约的任务
+
+    Returns:
+        (由 worker_id 接管的任务, 重新排队的 (任务ID, 用户ID))
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        rows = db.query(VideoGenerationTask).filter(
+            VideoGenerationTask.status == VideoGenerationStatus.PROCESSING.value,
+            VideoGenerationTask.source_task_id.is_(None)
+        ).all()
+
+        recovered: List[TrackedVideo] = []
+        requeued: List[Tuple[int, int]] = []
+        for task in rows:
+            expired = task.lease_expires_at is None or task.lease_expires_at < now
+            if not expired and not _is_orphaned(task.locked_by, worker_id):
+                continue
+
+            if not task.provider_task_id:
+                values = {
+                    VideoGenerationTask.status: VideoGenerationStatus.PENDING.value,
+                    VideoGenerationTask.available_at: now,
+                    VideoGenerationTask.locked_by: None,
+                    VideoGenerationTask.lease_expires_at: None,
+                }
+            elif reattach:
+                values = {
+                    VideoGenerationTask.locked_by: worker_id,
+                    VideoGenerationTask.heartbeat_at: now,
+                    VideoGenerationTask.lease_expires_at: now + timedelta(seconds=settings.VIDEO_JOB_LEASE_SECONDS),
+                }
+            else:
+                values = {
+                    VideoGenerationTask.locked_by: None,
+                    VideoGenerationTask.lease_expires_at: None,
+                }
+
+            holder = (
+                VideoGenerationTask.locked_by.is_(None) if task.locked_by is None
+                else VideoGenerationTask.locked_by == task.locked_by
+            )
+            updated = db.query(VideoGenerationTask).filter(
+                VideoGenerationTask.id == task.id,
+                VideoGenerationTask.status == VideoGenerationStatus.PROCESSING.value,
+                holder
+            ).update(values, synchronize_session=False)
+            if not updated:
+                continue
+
+            if not task.provider_task_id:
+                requeued.append((task.id, task.user_id))
+            elif reattach:
+                recovered.append(TrackedVideo(
+                    task_id=task.id,
+                    user_id=task.user_id,
+                    provider_task_id=task.provider_task_id,
+                    duration=5 if task.video_duration <= 5 else 10,
+                    submitted_at=task.submitted_at or task.updated_at or now,
+                    progress=task.progress or 0,
+                ))
+        db.commit()
+        if requeued or recovered:
+            logger.info(f"恢复中断的视频任务: 重新排队 {len(requeued)} 个, 继续等待上游 {len(recovered)} 个")
+        return recovered, requeued
+    finally:
+        db.close()
+
+
+async def recover_video_tasks(worker: Optional["VideoWorker"] = None) -> None:
+    """恢复中断的任务；传入 worker 时由其接管已提交到上游的任务并立即查询一次状态"""
+    worker_id = worker.worker_id if worker is not None else make_worker_id()
+    backfilled = await asyncio.to_thread(backfill_virtual_tags)
+    if backfilled:
+        logger.info(f"为 {backfilled} 个旧任务补充排队标签")
+    recovered, requeued = await asyncio.to_thread(recover_orphaned_tasks, worker_id, worker is not None)
+    for task_id, user_id in requeued:
+        await publish_task_update(user_id, task_id, {VideoGenerationTask.status: VideoGenerationStatus.PENDING.value})
+    for video in recovered:
+        worker.poller.track(video, poll_now=True)
+
+
+# 同一用户同时提交的分段数（本 worker 内，没有分段在提交时自动回收）
+_segment_slots: "weakref.WeakValueDictionary[int, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+
+def _segment_slot(user_id: int) -> asyncio.Semaphore:
+    slot = _segment_slots.get(user_id)
+    if slot is None:
+        slot = asyncio.Semaphore(settings.VIDEO_SEGMENT_USER_CONCURRENCY)
+        _segment_slots[user_id] = slot
+    return slot
+
+
+async def _submit_single(job: Dict[str, Any], task_id: int, worker_id: str, size: str) -> List[TrackedVideo]:
+    """创建单段视频的上游任务"""
+    # 通义万相只支持 5/10 秒
+    duration = 5 if job["video_duration"] <= 5 else 10
+    values = {VideoGenerationTask.progress: 10}
+    await asyncio.to_thread(_update_task, task_id, worker_id, values)
+    await publish_task_update(job["user_id"], task_id, values)
+
+    logger.info(f"创建视频生成任务: task_id={task_id}")
+    result = await wanxiang_service.create_video_task(
+        prompt=job["prompt"],
+        size=size,
+        duration=duration,
+        watermark=False,
+        priority=job["priority"]
+    )
+    provider_task_id = result.get("task_id")
+    submitted_at = datetime.utcnow()
+    values = {
+        VideoGenerationTask.provider_task_id: provider_task_id,
+        VideoGenerationTask.submitted_at: submitted_at,
+        VideoGenerationTask.progress: 30,
+    }
+    await asyncio.to_thread(_update_task, task_id, worker_id, values)
+    await publish_task_update(job["user_id"], task_id, values)
+    return [TrackedVideo(
+        task_id=task_id,
+        user_id=job["user_id"],
+        provider_task_id=provider_task_id,
+        duration=duration,
+        submitted_at=submitted_at,
+    )]
+
+
+async def _submit_segments(job: Dict[str, Any], task_id: int, worker_id: str, size: str) -> List[TrackedVideo]:
+    """
+    长视频：拆分分镜并并发创建各段的上游任务
+
+    同一用户同时提交的分段数不超过 VIDEO_SEGMENT_USER_CONCURRENCY；
+    已创建上游任务的分段（上次执行中断或部分分段提交失败）不会重复创建
+    """
+    user_id = job["user_id"]
+    segments = await asyncio.to_thread(_load_segments, task_id)
+    if not segments:
+        durations = split_duration(job["video_duration"])
+        prompts = await plan_scenes(job["prompt"], job["video_style"], len(durations), job["priority"])
+        segments = await asyncio.to_thread(_create_segments, task_id, worker_id, list(zip(prompts, durations)))
+        values = {VideoGenerationTask.progress: 10}
+        await asyncio.to_thread(_update_task, task_id, worker_id, values)
+        await publish_task_update(user_id, task_id, values)
+
+    async def submit(segment: Dict[str, Any]) -> None:
+        async with _segment_slot(user_id):
+            result = await wanxiang_service.create_video_task(
+                prompt=segment["prompt"],
+                size=size,
+                duration=segment["duration"],
+                watermark=False,
+                priority=job["priority"]
+            )
+        segment.update({
+            "provider_task_id": result.get("task_id"),
+            "submitted_at": datetime.utcnow(),
+            "status": VideoGenerationStatus.PROCESSING.value,
+            "progress": 30,
+        })
+        await asyncio.to_thread(_update_segment, task_id, segment["id"], worker_id, {
+            VideoSegment.provider_task_id: segment["provider_task_id"],
+            VideoSegment.submitted_at: segment["submitted_at"],
+            VideoSegment.status: segment["status"],
+            VideoSegment.progress: segment["progress"],
+        })
+
+    pending = [segment for segment in segments if not segment["provider_task_id"]]
+    if pending:
+        logger.info(f"创建长视频分段任务: task_id={task_id}, {len(pending)}/{len(segments)} 段")
+    results = await asyncio.gather(*(submit(segment) for segment in pending), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    for error in errors:
+        if isinstance(error, LeaseLostError):
+            raise error
+    if errors:
+        # 已提交的分段保留 provider_task_id，重试时只提交失败的分段
+        raise errors[0]
+
+    values = {
+        VideoGenerationTask.submitted_at: min(segment["submitted_at"] for segment in segments),
+        VideoGenerationTask.progress: 30,
+    }
+    await asyncio.to_thread(_update_task, task_id, worker_id, values)
+    await publish_task_update(user_id, task_id, values)
+    return [
+        TrackedVideo(
+            task_id=task_id,
+            user_id=user_id,
+            provider_task_id=segment["provider_task_id"],
+            duration=segment["duration"],
+            submitted_at=segment["submitted_at"],
+            progress=segment["progress"] or 30,
+            segment_id=segment["id"],
+        )
+        for segment in segments if segment["status"] not in FINAL_STATUSES
+    ]
+
+
+async def submit_video_job(task_id: int, worker_id: str) -> List[TrackedVideo]:
+    """
+    执行一个已领取的视频生成任务：创建通义万相任务（长视频为每个分段各创建一个）
+
+    已保存 provider_task_id 的任务（上次执行中断）不会重复创建上游任务；
+    创建上游任务失败时按退避延后重试，超过 VIDEO_JOB_MAX_ATTEMPTS 次后标记失败
+
+    Returns:
+        需要等待上游完成的任务或分段（交给轮询），任务已结束或延后重试时返回空列表
+    """
+    job = await asyncio.to_thread(_load_job, task_id)
+    if job is None:
+        return []
+
+    user_id = job["user_id"]
+    if wanxiang_service is None:
+        values = {
+            VideoGenerationTask.status: VideoGenerationStatus.FAILED.value,
+            VideoGenerationTask.error_message: "通义万相服务未配置，请设置 DASHSCOPE_API_KEY 环境变量",
+        }
+        await _finish_and_publish(task_id, user_id, worker_id, values)
+        return []
+
+    size = SIZE_MAP.get(job["aspect_ratio"], "1920*1080")
+    if job["segment_count"]:
+        submit = _submit_segments(job, task_id, worker_id, size)
+    elif not job["provider_task_id"]:
+        submit = _submit_single(job, task_id, worker_id, size)
+    else:
+        return [TrackedVideo(
+            task_id=task_id,
+            user_id=user_id,
+            provider_task_id=job["provider_task_id"],
+            duration=5 if job["video_duration"] <= 5 else 10,
+            submitted_at=job["submitted_at"],
+        )]
+
+    try:
+        return await submit
+    except LeaseLostError:
+        raise
+    except Exception as e:
+        if job["attempts"] < settings.VIDEO_JOB_MAX_ATTEMPTS:
+            delay = settings.VIDEO_JOB_RETRY_DELAY * 2 ** (job["attempts"] - 1)
+            logger.warning(f"创建视频任务失败，{delay}s 后重试: task_id={task_id}, {e}")
+            values = {
+                VideoGenerationTask.status: VideoGenerationStatus.PENDING.value,
+                VideoGenerationTask.available_at: datetime.utcnow() + timedelta(seconds=delay),
+                VideoGenerationTask.error_message: str(e),
+            }
+        else:
+            logger.error(f"创建视频任务失败: task_id={task_id}, {e}")
+            values = {
+                VideoGenerationTask.status: VideoGenerationStatus.FAILED.value,
+                VideoGenerationTask.error_message: str(e),
+            }
+        await _finish_and_publish(task_id, user_id, worker_id, values)
+        return []
+
+
+async def _cancel_job(job: asyncio.Task) -> None:
+    """取消并等待创建上游任务的协程结束（取回其异常，避免未处理异常的警告）"""
+    if not job.done():
+        job.cancel()
+    await asyncio.gather(job, return_exceptions=True)
+
+
+class VideoWorker:
+    """
+    视频任务 worker：按批领取任务并发创建上游任务，之后交给集中轮询等待完成
+
+    最多同时创建 VIDEO_WORKER_CONCURRENCY 个上游任务，创建期间定时续约；
+    轮询中的任务超过 VIDEO_POLLER_MAX_TASKS 时暂停领取；
+    停止时释放未完成任务的租约，由其他 worker（或重启后的本 worker）立即接手
+    """
+
+    def __init__(self, worker_id: Optional[str] = None):
+        self.worker_id = worker_id or make_worker_id()
+        self.concurrency = settings.VIDEO_WORKER_CONCURRENCY
+        self.poller = VideoPoller(self.worker_id)
+        self.mirror: Optional[VideoMirror] = None
+        if settings.VIDEO_MIRROR_ENABLED:
+            self.mirror = VideoMirror(self.worker_id)
+            self.poller.on_completed = self.mirror.notify
+        self._running: Dict[int, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.poller.start()
+        if self.mirror is not None:
+            self.mirror.start()
+        self._loop_task = asyncio.create_task(self.run())
+
+    def notify(self) -> None:
+        """有新任务入队时唤醒领取循环"""
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        logger.info(f"视频任务 worker 已启动: {self.worker_id}, 并发={self.concurrency}")
+        while not self._stopping:
+            free = self.concurrency - len(self._running)
+            if free > 0 and len(self.poller) < settings.VIDEO_POLLER_MAX_TASKS:
+                try:
+                    claimed = await asyncio.to_thread(
+                        claim_jobs, self.worker_id, min(free, settings.VIDEO_WORKER_BATCH_SIZE)
+                    )
+                except Exception as e:
+                    logger.error(f"领取视频任务失败: {e}")
+                    claimed = []
+                for task_id, user_id in claimed:
+                    await publish_task_update(user_id, task_id, {
+                        VideoGenerationTask.status: VideoGenerationStatus.PROCESSING.value,
+                    })
+                    self._running[task_id] = asyncio.create_task(self._execute(task_id, user_id))
+                if len(claimed) == free:
+                    # 可能还有积压，继续领取
+                    continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.VIDEO_WORKER_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, task_id: int, user_id: int) -> None:
+        job = asyncio.create_task(submit_video_job(task_id, self.worker_id))
+        try:
+            while True:
+                done, _ = await asyncio.wait({job}, timeout=settings.VIDEO_JOB_HEARTBEAT_SECONDS)
+                if done:
+                    for tracked in job.result():
+                        self.poller.track(tracked)
+                    break
+                try:
+                    await asyncio.to_thread(_heartbeat, task_id, self.worker_id)
+                except LeaseLostError:
+                    # 任务恰好在续约时完成并释放了租约
+                    if not job.done():
+                        raise
+        except LeaseLostError as e:
+            logger.warning(str(e))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 续约失败（如数据库异常）或创建上游任务失败：先停止创建，避免失去租约后仍提交付费任务
+            await _cancel_job(job)
+            logger.error(f"处理视频任务异常: task_id={task_id}, {e}")
+            values = {
+                VideoGenerationTask.status: VideoGenerationStatus.FAILED.value,
+                VideoGenerationTask.error_message: str(e),
+            }
+            try:
+                await _finish_and_publish(task_id, user_id, self.worker_id, values)
+            except LeaseLostError:
+                pass
+            except Exception as db_error:
+                logger.error(f"写入视频任务失败状态失败: task_id={task_id}, {db_error}")
+        finally:
+            await _cancel_job(job)
+            self._running.pop(task_id, None)
+            if not self._stopping:
+                self._wakeup.set()
+
+    async def stop(self) -> None:
+        """停止领取，取消执行中的任务并释放全部租约"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._loop_task is not None:
+            await self._loop_task
+        running = dict(self._running)
+        for task in running.values():
+            task.cancel()
+        await asyncio.gather(*running.values(), return_exceptions=True)
+        if running:
+            try:
+                await asyncio.to_thread(release_leases, self.worker_id, list(running))
+            except Exception as e:
+                logger.warning(f"释放视频任务租约失败: {e}")
+        await self.poller.stop()
+        if self.mirror is not None:
+            await self.mirror.stop()
+        logger.info(f"视频任务 worker 已停止: {self.worker_id}")
+
+
+# API 进程内运行的 worker（VIDEO_WORKER_IN_PROCESS 开启时）
+_in_process_worker: Optional[VideoWorker] = None
+
+
+async def start_in_process_worker() -> None:
+    """
+    恢复上次进程中断的任务，并在当前进程启动 worker（应用启动时调用）
+
+    VIDEO_WORKER_IN_PROCESS 关闭时只做恢复，任务由独立部署的 worker 领取；
+    恢复失败时 worker 照常启动，未恢复的任务在租约到期后被重新领取
+    """
+    global _in_process_worker
+    if not settings.VIDEO_WORKER_IN_PROCESS:
+        await recover_video_tasks()
+        return
+    if _in_process_worker is None:
+        worker = VideoWorker()
+        try:
+            await recover_video_tasks(worker)
+        except Exception as e:
+            logger.error(f"恢复视频任务失败: {e}")
+        worker.start()
+        _in_process_worker = worker
+
+
+async def stop_in_process_worker() -> None:
+    """停止当前进程的 worker（应用关闭时调用）"""
+    global _in_process_worker
+    if _in_process_worker is not None:
+        await _in_process_worker.stop()
+        _in_process_worker = None
+
+
+def worker_stats() -> Optional[Dict[str, Any]]:
+    """本进程 worker 的运行指标（未在 API 进程内运行 worker 时返回 None）"""
+    if _in_process_worker is None:
+        return None
+    return {
+        "worker_id": _in_process_worker.worker_id,
+        "submitting": len(_in_process_worker._running),
+        "poller": _in_process_worker.poller.stats(),
+        "mirror": _in_process_worker.mirror.stats() if _in_process_worker.mirror is not None else None,
+    }
+
+
+def notify_new_job() -> None:
+    """新任务入队后唤醒本进程的 worker；独立部署的 worker 按 VIDEO_WORKER_POLL_INTERVAL 轮询"""
+    if _in_process_worker is not None:
+        _in_process_worker.notify()
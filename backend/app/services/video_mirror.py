@@ -0,0 +1,396 @@
+"""
+已完成视频的本地镜像
+服务商返回的视频地址 24 小时后失效：任务完成后由 worker 用分段并行下载（app.services.downloader）
+保存到 {UPLOAD_DIR}/videos/，写入任务的 local_path 与 video_size；
+长视频的各分段另外用 ffmpeg 无损转封装为 MPEG-TS，供 HLS 播放列表引用（HLS 不支持普通 MP4 分段）。
+多个 worker 通过镜像租约（mirror_locked_by）避免重复下载，下载期间定期续约；失败的任务延后重试，
+worker 停止或失联时下载进度保留在本地，重新领取后从断点继续
+"""
+import asyncio
+import os
+import shutil
+import subprocess
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import and_, or_
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.video import VideoGenerationTask, VideoSegment, VideoGenerationStatus
+from app.services.downloader import download_file
+
+# 镜像状态（mirror_status 为空表示待镜像）
+MIRROR_DOWNLOADING = "downloading"
+MIRROR_COMPLETED = "completed"
+MIRROR_FAILED = "failed"
+
+
+def video_dir() -> str:
+    """镜像视频的根目录"""
+    return os.path.join(settings.UPLOAD_DIR, "videos")
+
+
+def mirror_path(task_id: int, segment_index: Optional[int] = None) -> str:
+    """单段视频为 videos/<任务ID>.mp4，长视频的分段为 videos/<任务ID>/<序号>.mp4"""
+    if segment_index is None:
+        return os.path.join(video_dir(), f"{task_id}.mp4")
+    return os.path.join(video_dir(), str(task_id), f"{segment_index}.mp4")
+
+
+def hls_segment_path(task_id: int, segment_index: int) -> str:
+    """长视频分段转封装后的 MPEG-TS 文件：videos/<任务ID>/<序号>.ts"""
+    return os.path.join(video_dir(), str(task_id), f"{segment_index}.ts")
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_mirror(task_id: int) -> None:
+    """删除任务的镜像文件（含未完成的下载）"""
+    base = mirror_path(task_id)
+    for path in (base, f"{base}.part", f"{base}.part.json"):
+        _remove_quietly(path)
+    shutil.rmtree(os.path.join(video_dir(), str(task_id)), ignore_errors=True)
+
+
+def move_mirror(task_id: int, new_task_id: int) -> None:
+    """把已完成的镜像移到另一个任务名下（被跟随任务删除、结果转给接替任务时），并清理未完成的下载"""
+    for src, dest in (
+        (mirror_path(task_id), mirror_path(new_task_id)),
+        (os.path.join(video_dir(), str(task_id)), os.path.join(video_dir(), str(new_task_id))),
+    ):
+        if os.path.exists(src):
+            os.replace(src, dest)
+    remove_mirror(task_id)
+
+
+def _mirrorable(now: datetime):
+    """
+    可镜像的任务：独立生成且在地址有效期内完成的任务，待镜像且到了重试时间，或镜像租约已过期
+
+    复用结果的任务读取来源任务的镜像，不单独下载
+    """
+    return and_(
+        VideoGenerationTask.status == VideoGenerationStatus.COMPLETED.value,
+        VideoGenerationTask.source_task_id.is_(None),
+        VideoGenerationTask.video_url.isnot(None),
+        VideoGenerationTask.completed_at >= now - timedelta(seconds=settings.VIDEO_MIRROR_MAX_AGE),
+        or_(
+            and_(
+                VideoGenerationTask.mirror_status.is_(None),
+                or_(VideoGenerationTask.mirror_available_at.is_(None), VideoGenerationTask.mirror_available_at <= now),
+            ),
+            and_(
+                VideoGenerationTask.mirror_status == MIRROR_DOWNLOADING,
+                VideoGenerationTask.mirror_available_at < now,
+            ),
+        ),
+    )
+
+
+def claim_mirrors(worker_id: str, limit: int) -> List[Dict[str, Any]]:
+    """
+    领取最多 limit 个待镜像任务（与 app.services.video_jobs.claim_jobs 相同的带条件抢占）
+
+    Returns:
+        [{"task_id", "attempts", "video_url", "segments": [(分段ID, 序号, 地址)] 或 None}]
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        candidates = db.query(
+            VideoGenerationTask.id,
+            VideoGenerationTask.video_url,
+            VideoGenerationTask.segment_count,
+            VideoGenerationTask.mirror_attempts
+        ).filter(
+            _mirrorable(now)
+        ).order_by(VideoGenerationTask.completed_at).limit(limit).with_for_update(skip_locked=True).all()
+
+        claimed = []
+        lease_expires_at = now + timedelta(seconds=settings.VIDEO_MIRROR_LEASE_SECONDS)
+        for task_id, video_url, segment_count, attempts in candidates:
+            updated = db.query(VideoGenerationTask).filter(
+                VideoGenerationTask.id == task_id,
+                _mirrorable(now)
+            ).update({
+                VideoGenerationTask.mirror_status: MIRROR_DOWNLOADING,
+                VideoGenerationTask.mirror_locked_by: worker_id,
+                VideoGenerationTask.mirror_available_at: lease_expires_at,
+                VideoGenerationTask.mirror_attempts: VideoGenerationTask.mirror_attempts + 1,
+            }, synchronize_session=False)
+            if not updated:
+                continue
+            segments = None
+            if segment_count:
+                segments = [
+                    (segment.id, segment.segment_index, segment.video_url)
+                    for segment in db.query(VideoSegment).filter(
+                        VideoSegment.task_id == task_id
+                    ).order_by(VideoSegment.segment_index).all()
+                ]
+            claimed.append({
+                "task_id": task_id,
+                "attempts": (attempts or 0) + 1,
+                "video_url": video_url,
+                "segments": segments,
+            })
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+
+def _finish_mirror(
+    task_id: int,
+    worker_id: str,
+    values: Dict[Any, Any],
+    segment_values: Optional[Dict[int, Dict[Any, Any]]] = None
+) -> bool:
+    """在持有镜像租约的前提下写入结果并释放租约，租约已失效（任务已删除或被接管）时返回 False"""
+    values.update({
+        VideoGenerationTask.mirror_locked_by: None,
+    })
+    db = SessionLocal()
+    try:
+        updated = db.query(VideoGenerationTask).filter(
+            VideoGenerationTask.id == task_id,
+            VideoGenerationTask.mirror_locked_by == worker_id
+        ).update(values, synchronize_session=False)
+        if updated:
+            for segment_id, segment_update in (segment_values or {}).items():
+                db.query(VideoSegment).filter(
+                    VideoSegment.id == segment_id
+                ).update(segment_update, synchronize_session=False)
+        db.commit()
+        return bool(updated)
+    finally:
+        db.close()
+
+
+def renew_mirror(task_id: int, worker_id: str) -> bool:
+    """续约镜像租约，租约已失效（任务已删除或被接管）时返回 False"""
+    db = SessionLocal()
+    try:
+        renewed = db.query(VideoGenerationTask).filter(
+            VideoGenerationTask.id == task_id,
+            VideoGenerationTask.mirror_locked_by == worker_id,
+            VideoGenerationTask.mirror_status == MIRROR_DOWNLOADING
+        ).update({
+            VideoGenerationTask.mirror_available_at: datetime.utcnow() + timedelta(seconds=settings.VIDEO_MIRROR_LEASE_SECONDS),
+        }, synchronize_session=False)
+        db.commit()
+        return bool(renewed)
+    finally:
+        db.close()
+
+
+def release_mirrors(worker_id: str, task_ids: List[int]) -> None:
+    """释放镜像租约（worker 停止时调用），任务可立即被重新领取"""
+    db = SessionLocal()
+    try:
+        db.query(VideoGenerationTask).filter(
+            VideoGenerationTask.id.in_(task_ids),
+            VideoGenerationTask.mirror_locked_by == worker_id
+        ).update({
+            VideoGenerationTask.mirror_status: None,
+            VideoGenerationTask.mirror_locked_by: None,
+            VideoGenerationTask.mirror_available_at: None,
+            VideoGenerationTask.mirror_attempts: VideoGenerationTask.mirror_attempts - 1,
+        }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _remux_to_mpegts(src: str, dest: str) -> bool:
+    """
+    把 MP4 无损转封装为 MPEG-TS（不重新编码），未安装 ffmpeg 时返回 False
+
+    Raises:
+        RuntimeError: ffmpeg 执行失败
+    """
+    ffmpeg = shutil.which(settings.FFMPEG_PATH)
+    if ffmpeg is None:
+        return False
+    tmp_path = f"{dest}.tmp"
+    result = subprocess.run(
+        [ffmpeg, "-nostdin", "-loglevel", "error", "-y", "-i", src, "-c", "copy", "-f", "mpegts", tmp_path],
+        capture_output=True,
+        timeout=300
+    )
+    if result.returncode != 0:
+        _remove_quietly(tmp_path)
+        raise RuntimeError(f"转封装失败: {result.stderr.decode(errors='replace').strip()[-500:]}")
+    os.replace(tmp_path, dest)
+    return True
+
+
+async def mirror_task(job: Dict[str, Any]) -> Tuple[Dict[Any, Any], Dict[int, Dict[Any, Any]]]:
+    """
+    下载任务的视频，返回 (任务写入的字段, {分段ID: 分段写入的字段})
+
+    长视频的分段依次下载（每个文件内部已分段并行）并转封装为 MPEG-TS
+    """
+    task_id = job["task_id"]
+    if job["segments"] is None:
+        path = mirror_path(task_id)
+        size = await download_file(job["video_url"], path)
+        return {VideoGenerationTask.local_path: path, VideoGenerationTask.video_size: size}, {}
+
+    segment_values = {}
+    total = 0
+    for segment_id, index, url in job["segments"]:
+        path = mirror_path(task_id, index)
+        if os.path.exists(path):
+            # 上次镜像中断前已下载完成的分段
+            size = os.path.getsize(path)
+        else:
+            size = await download_file(url, path)
+        ts_path = hls_segment_path(task_id, index)
+        if not os.path.exists(ts_path) and not await asyncio.to_thread(_remux_to_mpegts, path, ts_path):
+            logger.warning(f"未找到 ffmpeg（{settings.FFMPEG_PATH}），长视频分段不转封装，播放列表不可用: task_id={task_id}")
+        segment_values[segment_id] = {VideoSegment.local_path: path, VideoSegment.video_size: size}
+        total += size
+    values = {
+        VideoGenerationTask.local_path: os.path.dirname(mirror_path(task_id, 0)),
+        VideoGenerationTask.video_size: total,
+    }
+    return values, segment_values
+
+
+class VideoMirror:
+    """
+    镜像循环：定时领取已完成但尚未镜像的任务，最多同时下载 VIDEO_MIRROR_CONCURRENCY 个
+
+    随 VideoWorker 启停，停止时释放镜像租约
+    """
+
+    def __init__(self, worker_id: str):
+        self.worker_id = worker_id
+        self.concurrency = settings.VIDEO_MIRROR_CONCURRENCY
+        self._running: Dict[int, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._loop_task: Optional[asyncio.Task] = None
+        self._mirrored = 0
+        self._failed = 0
+        self._bytes = 0
+
+    def start(self) -> None:
+        self._loop_task = asyncio.create_task(self.run())
+
+    def notify(self) -> None:
+        """有任务完成时唤醒领取循环"""
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        while not self._stopping:
+            free = self.concurrency - len(self._running)
+            if free > 0:
+                try:
+                    claimed = await asyncio.to_thread(claim_mirrors, self.worker_id, free)
+                except Exception as e:
+                    logger.error(f"领取镜像任务失败: {e}")
+                    claimed = []
+                for job in claimed:
+                    self._running[job["task_id"]] = asyncio.create_task(self._execute(job))
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.VIDEO_MIRROR_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _download(self, job: Dict[str, Any]) -> Optional[Tuple[Dict[Any, Any], Dict[int, Dict[Any, Any]]]]:
+        """执行 mirror_task 并定期续约；租约失效时取消下载并返回 None"""
+        task_id = job["task_id"]
+        download = asyncio.create_task(mirror_task(job))
+        try:
+            while True:
+                done, _ = await asyncio.wait({download}, timeout=settings.VIDEO_MIRROR_LEASE_SECONDS / 3)
+                if done:
+                    return download.result()
+                try:
+                    renewed = await asyncio.to_thread(renew_mirror, task_id, self.worker_id)
+                except Exception as e:
+                    logger.warning(f"镜像续约失败: task_id={task_id}, {e}")
+                    continue
+                if not renewed:
+                    logger.warning(f"镜像租约已失效，停止下载: task_id={task_id}")
+                    return None
+        finally:
+            if not download.done():
+                download.cancel()
+            await asyncio.gather(download, return_exceptions=True)
+
+    async def _execute(self, job: Dict[str, Any]) -> None:
+        task_id = job["task_id"]
+        try:
+            result = await self._download(job)
+            if result is None:
+                return
+            values, segment_values = result
+            values[VideoGenerationTask.mirror_status] = MIRROR_COMPLETED
+            values[VideoGenerationTask.mirror_available_at] = None
+            if await asyncio.to_thread(_finish_mirror, task_id, self.worker_id, values, segment_values):
+                self._mirrored += 1
+                self._bytes += values[VideoGenerationTask.video_size]
+            else:
+                # 下载期间任务被删除
+                await asyncio.to_thread(remove_mirror, task_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._failed += 1
+            if job["attempts"] >= settings.VIDEO_MIRROR_MAX_ATTEMPTS:
+                logger.error(f"视频镜像失败: task_id={task_id}, {e}")
+                values = {
+                    VideoGenerationTask.mirror_status: MIRROR_FAILED,
+                    VideoGenerationTask.mirror_available_at: None,
+                }
+            else:
+                delay = settings.VIDEO_JOB_RETRY_DELAY * (2 ** (job["attempts"] - 1))
+                logger.warning(f"视频镜像失败，{delay:.0f}s 后重试: task_id={task_id}, {e}")
+                values = {
+                    VideoGenerationTask.mirror_status: None,
+                    VideoGenerationTask.mirror_available_at: datetime.utcnow() + timedelta(seconds=delay),
+                }
+            try:
+                await asyncio.to_thread(_finish_mirror, task_id, self.worker_id, values)
+            except Exception as db_error:
+                logger.error(f"写入镜像状态失败: task_id={task_id}, {db_error}")
+        finally:
+            self._running.pop(task_id, None)
+            if not self._stopping:
+                self._wakeup.set()
+
+    async def stop(self) -> None:
+        """停止领取，取消进行中的下载并释放镜像租约（已下载的部分保留，下次继续）"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._loop_task is not None:
+            await self._loop_task
+        running = dict(self._running)
+        for task in running.values():
+            task.cancel()
+        await asyncio.gather(*running.values(), return_exceptions=True)
+        if running:
+            try:
+                await asyncio.to_thread(release_mirrors, self.worker_id, list(running))
+            except Exception as e:
+                logger.warning(f"释放镜像租约失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "downloading": len(self._running),
+            "mirrored": self._mirrored,
+            "failed": self._failed,
+            "bytes": self._bytes,
+        }
@@ -0,0 +1,496 @@
+"""
+视频任务集中轮询
+每个 worker 用一个轮询循环跟踪自己持有的全部上游任务（provider_task_id）：
+到期的任务以有限并发批量查询，状态更新与租约续期合并为一个数据库事务；
+每个任务的查询间隔根据已观测到的完成耗时分布自适应调整；写库后向任务所属用户推送状态变化；
+长视频的各分段分别跟踪，全部完成后父任务才完成（见 app.services.video_segments）
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.video import VideoGenerationTask, VideoSegment, VideoGenerationStatus
+from app.services.video_cache import propagate_to_followers
+from app.services.video_events import publish_task_update
+from app.services.video_segments import long_video_url
+
+# 尝试导入通义万相服务
+try:
+    from app.services.wanxiang_service import wanxiang_service
+except ImportError:
+    wanxiang_service = None
+
+# 估算查询间隔所需的最少完成耗时样本数
+MIN_COMPLETION_SAMPLES = 10
+
+# 提交上游任务后、完成前可显示的进度区间
+PROGRESS_SUBMITTED = 30
+PROGRESS_BEFORE_DONE = 95
+
+# 单条 IN 查询包含的最多任务数
+ID_CHUNK_SIZE = 500
+
+# 已结束的状态
+FINAL_STATUSES = (VideoGenerationStatus.COMPLETED.value, VideoGenerationStatus.FAILED.value)
+
+# 跟踪键：(任务ID, 分段ID)，单段任务的分段ID为 None
+TrackKey = Tuple[int, Optional[int]]
+
+
+def completion_values(video_url: str, duration: int) -> Dict[Any, Any]:
+    """视频生成成功时写入的字段"""
+    return {
+        VideoGenerationTask.status: VideoGenerationStatus.COMPLETED.value,
+        VideoGenerationTask.progress: 100,
+        VideoGenerationTask.video_url: video_url,
+        # 通义万相不提供缩略图，使用占位
+        VideoGenerationTask.thumbnail_url: video_url.replace(".mp4", ".jpg"),
+        VideoGenerationTask.video_duration_actual: duration,
+        VideoGenerationTask.error_message: None,
+        VideoGenerationTask.completed_at: datetime.utcnow(),
+    }
+
+
+@dataclass
+class TrackedVideo:
+    """正在等待上游完成的任务"""
+
+    task_id: int
+    user_id: int
+    provider_task_id: str
+    duration: int
+    submitted_at: datetime
+    progress: int = PROGRESS_SUBMITTED
+    next_poll_at: float = 0.0
+    failed_polls: int = 0
+    # 长视频的分段（此时 provider_task_id 与 duration 属于该分段）
+    segment_id: Optional[int] = None
+
+    @property
+    def key(self) -> TrackKey:
+        return self.task_id, self.segment_id
+
+    def age(self) -> float:
+        """提交到上游后经过的秒数"""
+        return (datetime.utcnow() - self.submitted_at).total_seconds()
+
+
+class CompletionStats:
+    """上游任务完成耗时（提交到成功）的近期分布"""
+
+    def __init__(self, window: int = 500):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self._samples) < MIN_COMPLETION_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def next_interval(self, age: float) -> float:
+        """
+        下次查询前的等待时间
+
+        大多数任务还不可能完成时（早于 p10）直接等到 p10；
+        处在常见完成区间 [p10, p90] 内时密集查询；
+        超过 p90 的慢任务逐渐放宽间隔
+        """
+        p10, p90 = self.quantile(0.1), self.quantile(0.9)
+        if p10 is None or p90 is None:
+            interval = settings.VIDEO_POLL_DEFAULT_INTERVAL
+        elif age < p10:
+            interval = p10 - age
+        elif age < p90:
+            interval = (p90 - p10) / 10
+        else:
+            interval = settings.VIDEO_POLL_MIN_INTERVAL + (age - p90) / 4
+        return min(max(interval, settings.VIDEO_POLL_MIN_INTERVAL), settings.VIDEO_POLL_MAX_INTERVAL)
+
+    def estimate_progress(self, age: float) -> Optional[int]:
+        """按 p90 完成耗时估算进度，样本不足时返回 None"""
+        p90 = self.quantile(0.9)
+        if p90 is None or p90 <= 0:
+            return None
+        ratio = min(age / p90, 1.0)
+        return PROGRESS_SUBMITTED + int((PROGRESS_BEFORE_DONE - PROGRESS_SUBMITTED) * ratio)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "samples": len(self._samples),
+            "p10_s": self.quantile(0.1),
+            "p50_s": self.quantile(0.5),
+            "p90_s": self.quantile(0.9),
+        }
+
+
+def _chunks(ids: List[int]) -> Iterable[List[int]]:
+    for i in range(0, len(ids), ID_CHUNK_SIZE):
+        yield ids[i:i + ID_CHUNK_SIZE]
+
+
+def _segmented_task_values(db, task_id: int) -> Optional[Dict[Any, Any]]:
+    """
+    根据各分段状态汇总长视频任务的状态
+
+    任一分段失败则任务失败；全部完成则任务完成（video_url 见 long_video_url）；
+    否则进度取各分段平均值，没有变化时返回 None
+    """
+    segments = db.query(VideoSegment).filter(
+        VideoSegment.task_id == task_id
+    ).order_by(VideoSegment.segment_index).all()
+    if not segments:
+        return None
+
+    failed = next((segment for segment in segments if segment.status == VideoGenerationStatus.FAILED.value), None)
+    if failed is not None:
+        return {
+            VideoGenerationTask.status: VideoGenerationStatus.FAILED.value,
+            VideoGenerationTask.error_message: f"第 {failed.segment_index + 1} 段生成失败: {failed.error_message}",
+            VideoGenerationTask.locked_by: None,
+            VideoGenerationTask.lease_expires_at: None,
+        }
+
+    if all(segment.status == VideoGenerationStatus.COMPLETED.value for segment in segments):
+        values = completion_values(long_video_url(task_id), sum(segment.duration for segment in segments))
+        values[VideoGenerationTask.thumbnail_url] = segments[0].video_url.replace(".mp4", ".jpg")
+        values[VideoGenerationTask.locked_by] = None
+        values[VideoGenerationTask.lease_expires_at] = None
+        return values
+
+    progress = min(sum(segment.progress or 0 for segment in segments) // len(segments), PROGRESS_BEFORE_DONE)
+    current = db.query(VideoGenerationTask.progress).filter(VideoGenerationTask.id == task_id).scalar()
+    if progress > (current or 0):
+        return {VideoGenerationTask.progress: progress}
+    return None
+
+
+def apply_poll_results(
+    worker_id: str,
+    updates: Dict[int, Dict[Any, Any]],
+    renew_ids: List[int],
+    segment_updates: Optional[Dict[TrackKey, Dict[Any, Any]]] = None
+) -> Tuple[Set[int], Dict[int, Dict[Any, Any]], Dict[int, Tuple[int, Dict[Any, Any]]]]:
+    """
+    在一个事务中写入本轮的状态更新并为仍在跟踪的任务续约
+
+    所有更新都以（父任务的）locked_by 为条件，租约已被接管的任务不会被改写；
+    有分段更新的长视频任务同时汇总写入父任务的状态与进度；
+    写入的状态同步给复用这些任务结果的任务（见 app.services.video_cache）
+
+    Returns:
+        (已不属于本 worker 的任务（被接管或已删除，其更新未写入）, 写入的长视频父任务更新,
+         同步的跟随任务 {任务ID: (用户ID, 字段)})
+    """
+    db = SessionLocal()
+    try:
+        lost: Set[int] = set()
+        for task_id, values in updates.items():
+            updated = db.query(VideoGenerationTask).filter(
+                VideoGenerationTask.id == task_id,
+                VideoGenerationTask.locked_by == worker_id
+            ).update(values, synchronize_session=False)
+            if not updated:
+                lost.add(task_id)
+
+        parents: Dict[int, Dict[Any, Any]] = {}
+        if segment_updates:
+            task_ids = {task_id for task_id, _ in segment_updates}
+            owned_parents = {row[0] for row in db.query(VideoGenerationTask.id).filter(
+                VideoGenerationTask.id.in_(task_ids),
+                VideoGenerationTask.locked_by == worker_id
+            )}
+            lost |= task_ids - owned_parents
+            for (task_id, segment_id), values in segment_updates.items():
+                if task_id in owned_parents:
+                    db.query(VideoSegment).filter(
+                        VideoSegment.id == segment_id
+                    ).update(values, synchronize_session=False)
+            for task_id in owned_parents:
+                values = _segmented_task_values(db, task_id)
+                if values:
+                    db.query(VideoGenerationTask).filter(
+                        VideoGenerationTask.id == task_id
+                    ).update(values, synchronize_session=False)
+                    parents[task_id] = values
+            # 已结束的任务释放了租约，不再续约
+            finished = {task_id for task_id, values in parents.items() if VideoGenerationTask.locked_by in values}
+            renew_ids = [task_id for task_id in renew_ids if task_id not in finished]
+
+        written = {task_id: values for task_id, values in updates.items() if task_id not in lost}
+        written.update(parents)
+        followers = propagate_to_followers(db, written)
+
+        owned: Set[int] = set()
+        if renew_ids:
+            now = datetime.utcnow()
+            lease_expires_at = now + timedelta(seconds=settings.VIDEO_JOB_LEASE_SECONDS)
+            for chunk in _chunks(renew_ids):
+                db.query(VideoGenerationTask).filter(
+                    VideoGenerationTask.id.in_(chunk),
+                    VideoGenerationTask.locked_by == worker_id
+                ).update({
+                    VideoGenerationTask.heartbeat_at: now,
+                    VideoGenerationTask.lease_expires_at: lease_expires_at,
+                }, synchronize_session=False)
+                owned.update(row[0] for row in db.query(VideoGenerationTask.id).filter(
+                    VideoGenerationTask.id.in_(chunk),
+                    VideoGenerationTask.locked_by == worker_id
+                ))
+        db.commit()
+        return lost | (set(renew_ids) - owned), parents, followers
+    finally:
+        db.close()
+
+
+def release_leases(worker_id: str, task_ids: List[int]) -> None:
+    """批量释放租约（worker 停止时），任务可被立即重新领取"""
+    db = SessionLocal()
+    try:
+        for chunk in _chunks(task_ids):
+            db.query(VideoGenerationTask).filter(
+                VideoGenerationTask.id.in_(chunk),
+                VideoGenerationTask.locked_by == worker_id
+            ).update({
+                VideoGenerationTask.locked_by: None,
+                VideoGenerationTask.lease_expires_at: None,
+            }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+class VideoPoller:
+    """
+    跟踪一个 worker 持有的全部上游视频任务
+
+    单个循环负责所有任务：只查询到期的任务（并发不超过 VIDEO_POLL_CONCURRENCY），
+    本轮结果一次性写库；即使没有到期任务，也至少每 VIDEO_JOB_HEARTBEAT_SECONDS 续约一次。
+    每轮查询的任务数有上限（见 round_limit），到期任务积压时分多轮查询，
+    保证两次续约的间隔不会因一轮查询过多而超过租约时长
+    """
+
+    def __init__(self, worker_id: str):
+        self.worker_id = worker_id
+        self.completion = CompletionStats()
+        self._tracked: Dict[TrackKey, TrackedVideo] = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._last_renew = time.monotonic()
+        self._loop_task: Optional[asyncio.Task] = None
+        # 有任务完成时的回调（唤醒镜像循环）
+        self.on_completed: Optional[Callable[[], None]] = None
+        # 指标
+        self.polls = 0
+        self.rounds = 0
+        self.completed = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return len(self._tracked)
+
+    def start(self) -> None:
+        self._loop_task = asyncio.create_task(self.run())
+
+    def track(self, video: TrackedVideo, poll_now: bool = False) -> None:
+        """
+        开始跟踪一个已提交到上游的任务（租约已由本 worker 持有）
+
+        poll_now: 立即查询一次（如启动时恢复的任务，可能在停机期间已经完成）
+        """
+        delay = 0.0 if poll_now else self.completion.next_interval(video.age())
+        video.next_poll_at = time.monotonic() + delay
+        self._tracked[video.key] = video
+        self._wakeup.set()
+
+    @staticmethod
+    def round_limit() -> int:
+        """每轮最多查询的任务数：按服务商限速，一轮查询耗时不超过一个续约间隔"""
+        limit = settings.VIDEO_POLL_BATCH_SIZE
+        if settings.WANXIANG_MAX_QPS > 0:
+            limit = min(limit, int(settings.WANXIANG_MAX_QPS * settings.VIDEO_JOB_HEARTBEAT_SECONDS))
+        return max(limit, 1)
+
+    async def run(self) -> None:
+        while not self._stopping:
+            now = time.monotonic()
+            due = sorted(
+                (video for video in self._tracked.values() if video.next_poll_at <= now),
+                key=lambda video: video.next_poll_at
+            )[:self.round_limit()]
+            try:
+                if due:
+                    await self._poll(due)
+                elif self._tracked and now - self._last_renew >= settings.VIDEO_JOB_HEARTBEAT_SECONDS:
+                    await self._commit({}, {}, set())
+            except Exception as e:
+                logger.error(f"视频任务轮询失败: {e}")
+
+            now = time.monotonic()
+            wait = settings.VIDEO_POLL_MAX_INTERVAL
+            if self._tracked:
+                next_due = min(video.next_poll_at for video in self._tracked.values())
+                wait = min(wait, next_due - now, self._last_renew + settings.VIDEO_JOB_HEARTBEAT_SECONDS - now)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(wait, 0.05))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _query(self, semaphore: asyncio.Semaphore, video: TrackedVideo) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                return await wanxiang_service.get_task_result(video.provider_task_id)
+            except Exception as e:
+                logger.warning(f"查询视频任务失败: {video.provider_task_id}, {e}")
+                return {"task_status": "UNKNOWN"}
+
+    async def _poll(self, due: List[TrackedVideo]) -> None:
+        semaphore = asyncio.Semaphore(settings.VIDEO_POLL_CONCURRENCY)
+        results = await asyncio.gather(*(self._query(semaphore, video) for video in due))
+        self.rounds += 1
+        self.polls += len(due)
+
+        updates: Dict[int, Dict[Any, Any]] = {}
+        segment_updates: Dict[TrackKey, Dict[Any, Any]] = {}
+        done: Set[TrackKey] = set()
+        # 写库成功后才计入的完成耗时样本、完成/失败数与进度
+        samples: List[float] = []
+        failed = 0
+        progressed: List[Tuple[TrackedVideo, int]] = []
+        now = time.monotonic()
+        for video, result in zip(due, results):
+            status = result.get("task_status")
+            age = video.age()
+            # 分段的结果写入分段表，由 apply_poll_results 汇总到父任务
+            segment = video.segment_id is not None
+            model = VideoSegment if segment else VideoGenerationTask
+            pending = segment_updates if segment else updates
+            key = video.key if segment else video.task_id
+            label = f"task_id={video.task_id}" + (f", segment_id={video.segment_id}" if segment else "")
+
+            if status == "SUCCEEDED" and result.get("video_url"):
+                samples.append(age)
+                if segment:
+                    pending[key] = {
+                        VideoSegment.status: VideoGenerationStatus.COMPLETED.value,
+                        VideoSegment.progress: 100,
+                        VideoSegment.video_url: result["video_url"],
+                        VideoSegment.error_message: None,
+                        VideoSegment.completed_at: datetime.utcnow(),
+                    }
+                else:
+                    pending[key] = completion_values(result["video_url"], video.duration)
+                done.add(video.key)
+                logger.info(f"视频生成成功: {label}, 耗时 {age:.0f}s")
+                continue
+
+            if status == "FAILED" or age > settings.VIDEO_PROVIDER_TIMEOUT:
+                message = result.get("message") if status == "FAILED" else None
+                pending[key] = {
+                    model.status: VideoGenerationStatus.FAILED.value,
+                    model.error_message: message or "视频生成超时或失败",
+                }
+                done.add(video.key)
+                failed += 1
+                logger.error(f"视频生成失败: {label}, {message or '超时'}")
+                continue
+
+            if status in ("PENDING", "RUNNING"):
+                video.failed_polls = 0
+                progress = self.completion.estimate_progress(age)
+                if progress is None:
+                    progress = PROGRESS_SUBMITTED if status == "PENDING" else 50
+                if progress > video.progress:
+                    progressed.append((video, progress))
+                    pending[key] = {model.progress: progress}
+                video.next_poll_at = now + self.completion.next_interval(age)
+            else:
+                # 查询失败或状态未知：指数退避后重试
+                video.failed_polls += 1
+                video.next_poll_at = now + min(
+                    settings.VIDEO_POLL_MIN_INTERVAL * 2 ** video.failed_polls,
+                    settings.VIDEO_POLL_MAX_INTERVAL
+                )
+
+        await self._commit(updates, segment_updates, done)
+        # 写库失败时以上结果未生效，这些任务仍在跟踪中，下一轮重新查询
+        for seconds in samples:
+            self.completion.record(seconds)
+        self.completed += len(samples)
+        self.failed += failed
+        for video, progress in progressed:
+            video.progress = progress
+
+    async def _commit(
+        self,
+        updates: Dict[int, Dict[Any, Any]],
+        segment_updates: Dict[TrackKey, Dict[Any, Any]],
+        done: Set[TrackKey]
+    ) -> None:
+        """写入状态更新并续约，停止跟踪已结束或租约丢失的任务（及其分段）"""
+        finished = {task_id for task_id, segment_id in done if segment_id is None}
+        for task_id in finished:
+            updates[task_id].update({
+                VideoGenerationTask.locked_by: None,
+                VideoGenerationTask.lease_expires_at: None,
+            })
+        renew_ids = sorted({video.task_id for key, video in self._tracked.items() if key not in done})
+        lost, parents, followers = await asyncio.to_thread(
+            apply_poll_results, self.worker_id, updates, renew_ids, segment_updates
+        )
+        self._last_renew = time.monotonic()
+
+        owners = {video.task_id: video.user_id for video in self._tracked.values()}
+        for task_id, values in [*updates.items(), *parents.items()]:
+            if task_id in owners and task_id not in lost:
+                await publish_task_update(owners[task_id], task_id, values)
+        for task_id, (user_id, values) in followers.items():
+            await publish_task_update(user_id, task_id, values)
+        if self.on_completed is not None and any(
+            values.get(VideoGenerationTask.status) == VideoGenerationStatus.COMPLETED.value
+            for values in [*updates.values(), *parents.values()]
+        ):
+            self.on_completed()
+
+        closed = finished | lost | {
+            task_id for task_id, values in parents.items()
+            if values.get(VideoGenerationTask.status) in FINAL_STATUSES
+        }
+        for key in [key for key in self._tracked if key in done or key[0] in closed]:
+            del self._tracked[key]
+        if lost:
+            logger.warning(f"视频任务租约已失效，停止跟踪: {sorted(lost)}")
+
+    async def stop(self) -> None:
+        """停止轮询并释放全部租约"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._loop_task is not None:
+            await self._loop_task
+        if self._tracked:
+            try:
+                task_ids = sorted({video.task_id for video in self._tracked.values()})
+                await asyncio.to_thread(release_leases, self.worker_id, task_ids)
+            except Exception as e:
+                logger.warning(f"释放视频任务租约失败: {e}")
+            self._tracked.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tracked": len(self._tracked),
+            "rounds": self.rounds,
+            "polls": self.polls,
+            "completed": self.completed,
+            "failed": self.failed,
+            "completion_time": self.completion.summary(),
+        }
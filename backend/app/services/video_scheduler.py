@@ -0,0 +1,193 @@
+"""
+视频任务调度：按用户加权公平排队
+任务创建时按开始时间公平排队（SFQ）分配虚拟时间标签：
+virtual_start = max(系统虚拟时间, 该用户排队中任务的最大 virtual_finish)，
+virtual_finish = virtual_start + 成本 / 会员权重（成本为提交给服务商的分段数）。
+worker 按 virtual_start 领取（见 app.services.video_jobs.claim_jobs），
+一次提交大量任务的用户只会在自己的任务之间排队，其他用户的新任务仍按权重插在前面；
+同时每个用户处理中的任务数不超过会员等级的 video_concurrency
+"""
+from datetime import datetime, timedelta
+from statistics import median
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.user import User
+from app.models.video import VideoGenerationTask, VideoGenerationStatus
+
+# 会员配置缺少调度参数时的默认值
+DEFAULT_CONCURRENCY = 1
+DEFAULT_WEIGHT = 1.0
+
+# 估计处理时长使用的最近完成任务数
+RUN_TIME_SAMPLES = 50
+
+
+def tier_policy(membership_type: Any) -> Tuple[int, float]:
+    """会员等级的 (同时处理的任务数上限, 排队权重)"""
+    tier = getattr(membership_type, "value", membership_type)
+    config = settings.MEMBERSHIP_CONFIG.get(tier, {})
+    return (
+        max(1, int(config.get("video_concurrency", DEFAULT_CONCURRENCY))),
+        max(0.1, float(config.get("video_weight", DEFAULT_WEIGHT))),
+    )
+
+
+def _queued(query):
+    """排队中（待领取）的独立任务；复用其他任务结果的任务不参与排队"""
+    return query.filter(
+        VideoGenerationTask.status == VideoGenerationStatus.PENDING.value,
+        VideoGenerationTask.source_task_id.is_(None)
+    )
+
+
+def _in_flight(query):
+    """处理中的独立任务"""
+    return query.filter(
+        VideoGenerationTask.status == VideoGenerationStatus.PROCESSING.value,
+        VideoGenerationTask.source_task_id.is_(None)
+    )
+
+
+def assign_virtual_tags(db: Session, task: VideoGenerationTask, membership_type: Any) -> None:
+    """
+    为新任务分配虚拟时间标签（在写入任务的同一事务中、写入之前调用）
+
+    先对用户行执行一次空更新：PostgreSQL/MySQL 上锁住该行，SQLite 上取得写锁，
+    同一用户并发创建的任务依次读取积压、分配标签，不会得到相同的标签
+    """
+    db.query(User).filter(User.id == task.user_id).update(
+        {User.updated_at: User.updated_at},
+        synchronize_session=False
+    )
+    # 系统虚拟时间：排队中最早的开始标签；没有排队任务时为最近领取的任务的开始标签
+    now_tag = _queued(db.query(func.min(VideoGenerationTask.virtual_start))).scalar()
+    if now_tag is None:
+        now_tag = db.query(func.max(VideoGenerationTask.virtual_start)).scalar() or 0.0
+
+    backlog = db.query(func.max(VideoGenerationTask.virtual_finish)).filter(
+        VideoGenerationTask.user_id == task.user_id,
+        VideoGenerationTask.status.in_([
+            VideoGenerationStatus.PENDING.value,
+            VideoGenerationStatus.PROCESSING.value,
+        ]),
+        VideoGenerationTask.source_task_id.is_(None)
+    ).scalar()
+
+    _, weight = tier_policy(membership_type)
+    task.virtual_start = max(now_tag, backlog or 0.0)
+    task.virtual_finish = task.virtual_start + (task.segment_count or 1) / weight
+
+
+def user_slots(db: Session, user_ids: Optional[Iterable[int]] = None) -> Dict[int, List[int]]:
+    """
+    用户的 [处理中的任务数, 上限]
+
+    未指定 user_ids 时返回所有有处理中任务的用户
+    """
+    query = _in_flight(db.query(VideoGenerationTask.user_id, func.count(VideoGenerationTask.id)))
+    if user_ids is not None:
+        user_ids = list(set(user_ids))
+        query = query.filter(VideoGenerationTask.user_id.in_(user_ids))
+    counts = dict(query.group_by(VideoGenerationTask.user_id).all())
+
+    ids = user_ids if user_ids is not None else list(counts)
+    slots = {user_id: [counts.get(user_id, 0), DEFAULT_CONCURRENCY] for user_id in ids}
+    if ids:
+        for user_id, membership_type in db.query(User.id, User.membership_type).filter(User.id.in_(ids)):
+            slots[user_id][1] = tier_policy(membership_type)[0]
+    return slots
+
+
+def _typical_run_seconds(db: Session) -> float:
+    """最近完成任务从提交到完成的耗时中位数"""
+    rows = db.query(VideoGenerationTask.submitted_at, VideoGenerationTask.completed_at).filter(
+        VideoGenerationTask.status == VideoGenerationStatus.COMPLETED.value,
+        VideoGenerationTask.source_task_id.is_(None),
+        VideoGenerationTask.submitted_at.isnot(None),
+        VideoGenerationTask.completed_at.isnot(None)
+    ).order_by(VideoGenerationTask.completed_at.desc()).limit(RUN_TIME_SAMPLES).all()
+    durations = [(completed - submitted).total_seconds() for submitted, completed in rows if completed > submitted]
+    return median(durations) if durations else float(settings.VIDEO_QUEUE_DEFAULT_RUN_SECONDS)
+
+
+def queue_estimates(db: Session, tasks: Iterable[VideoGenerationTask]) -> Dict[int, Tuple[int, datetime]]:
+    """
+    排队中任务的 (排队位置, 预计开始时间)
+
+    排队位置为全局领取顺序中的名次（从 1 开始）；预计开始时间取以下两者的较晚者：
+    前面的任务按当前处理速度（处理中的任务数 / 近期处理耗时）依次开始，
+    以及该用户自己前面的任务按会员并发上限分批完成
+    """
+    queued = [
+        task for task in tasks
+        if task.status == VideoGenerationStatus.PENDING.value
+        and task.source_task_id is None
+        and task.virtual_start is not None
+    ]
+    if not queued:
+        return {}
+
+    # 一次查询得到全局名次与用户内名次（与 claim_jobs 的领取顺序一致）
+    order = (VideoGenerationTask.virtual_start, VideoGenerationTask.id)
+    ranked = _queued(db.query(
+        VideoGenerationTask.id.label("id"),
+        func.row_number().over(order_by=order).label("position"),
+        func.row_number().over(partition_by=VideoGenerationTask.user_id, order_by=order).label("own_position"),
+    )).subquery()
+    positions = {
+        task_id: (position, own_position)
+        for task_id, position, own_position in db.query(ranked).filter(
+            ranked.c.id.in_([task.id for task in queued])
+        )
+    }
+
+    now = datetime.utcnow()
+    run_seconds = _typical_run_seconds(db)
+    in_flight = _in_flight(db.query(func.count(VideoGenerationTask.id))).scalar() or 0
+    starts_per_second = max(in_flight, 1) / run_seconds
+    slots = user_slots(db, [task.user_id for task in queued])
+
+    estimates = {}
+    for task in queued:
+        if task.id not in positions:
+            # 读取任务后已被领取
+            continue
+        position, own_position = positions[task.id]
+        own_in_flight, cap = slots[task.user_id]
+        wait = max((position - 1) / starts_per_second, (own_position - 1 + own_in_flight) // cap * run_seconds)
+        start = now + timedelta(seconds=wait)
+        if task.available_at and task.available_at > start:
+            # 失败后延迟重试的任务
+            start = task.available_at
+        estimates[task.id] = (position, start)
+    return estimates
+
+
+def backfill_virtual_tags() -> int:
+    """
+    为没有虚拟时间标签的排队任务补上标签（启动时调用），返回补充的数量
+
+    加权公平排队之前创建的任务 virtual_start 为空，各数据库对 NULL 的排序不同，
+    统一设为 0 排在最前（它们本来就最早入队）
+    """
+    db = SessionLocal()
+    try:
+        updated = db.query(VideoGenerationTask).filter(
+            VideoGenerationTask.virtual_start.is_(None),
+            VideoGenerationTask.status.in_([
+                VideoGenerationStatus.PENDING.value,
+                VideoGenerationStatus.PROCESSING.value,
+            ])
+        ).update({
+            VideoGenerationTask.virtual_start: 0.0,
+            VideoGenerationTask.virtual_finish: func.coalesce(VideoGenerationTask.segment_count, 1) / DEFAULT_WEIGHT,
+        }, synchronize_session=False)
+        db.commit()
+        return updated
+    finally:
+        db.close()
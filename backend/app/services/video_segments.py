@@ -0,0 +1,174 @@
+"""
+长视频分段生成
+通义万相单次最长生成 10 秒：更长的视频先由通义千问拆成分镜，每段作为独立的上游任务并发提交，
+全部完成并镜像（转封装为 MPEG-TS）后按顺序组成 HLS 播放列表（GET /video/tasks/{id}/playlist.m3u8）；
+未开启镜像或没有 ffmpeg 时无法生成播放列表，只能逐段播放 MP4（GET /video/tasks/{id}/segments/{序号}/file）
+"""
+import json
+import re
+import shutil
+from typing import Any, Iterable, List, Optional, Sequence
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services.admission import PRIORITY_NORMAL
+
+# 拆分分镜的系统提示词
+SCENE_SYSTEM_PROMPT = """你是一个专业的视频分镜师。
+请把用户提供的视频主题或脚本拆分为 {count} 个连续的镜头，每个镜头约 {seconds} 秒。
+
+要求：
+1. 每个镜头是一段独立的画面描述，可直接用于文生视频，包含主体、动作、场景和镜头运动
+2. 镜头之间保持人物、画面风格一致，情节连贯
+3. 风格：{style}
+
+只输出 JSON 字符串数组，共 {count} 个元素，不要有其他内容。"""
+
+# 句子分隔符（AI 拆分失败时按句子分配分镜）
+SENTENCE_PATTERN = re.compile(r"[^。！？!?\n]+[。！？!?]?")
+
+
+def is_long_video(duration: int) -> bool:
+    """是否按分段生成"""
+    return settings.VIDEO_LONG_MODE_ENABLED and duration > settings.VIDEO_SEGMENT_SECONDS
+
+
+def split_duration(duration: int) -> List[int]:
+    """
+    把总时长拆成各段时长
+
+    服务商只支持 5/10 秒，末段不足时向上取整（如 25 秒拆为 10、10、5）
+    """
+    segment = settings.VIDEO_SEGMENT_SECONDS
+    full, rest = divmod(duration, segment)
+    durations = [segment] * full
+    if rest:
+        durations.append(min(segment, 5 if rest <= 5 else 10))
+    return durations
+
+
+def _parse_scenes(text: str, count: int) -> Optional[List[str]]:
+    """解析模型输出的分镜列表，数量不足时返回 None"""
+    start, end = text.find("["), text.rfind("]")
+    if start != -1 and end > start:
+        try:
+            scenes = json.loads(text[start:end + 1])
+        except ValueError:
+            scenes = None
+        if isinstance(scenes, list):
+            scenes = [str(scene).strip() for scene in scenes if str(scene).strip()]
+            if len(scenes) >= count:
+                return scenes[:count]
+
+    # 兼容按行编号输出的情况（“1. xxx”）
+    lines = [re.sub(r"^\s*\d+\s*[.、:：)）]\s*", "", line).strip() for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    if len(lines) >= count:
+        return lines[:count]
+    return None
+
+
+def _fallback_scenes(prompt: str, count: int) -> List[str]:
+    """按句子把文案平均分配到各段；句子不足时各段共用完整文案"""
+    sentences = [s.strip() for s in SENTENCE_PATTERN.findall(prompt) if s.strip()]
+    if len(sentences) < count:
+        return [f"{prompt}（第 {i + 1}/{count} 个镜头）" for i in range(count)]
+    total = len(sentences)
+    return ["".join(sentences[i * total // count:(i + 1) * total // count]) for i in range(count)]
+
+
+async def plan_scenes(
+    prompt: str,
+    style: Optional[str],
+    count: int,
+    priority: int = PRIORITY_NORMAL
+) -> List[str]:
+    """
+    把文案拆成 count 个分镜提示词
+
+    优先由通义千问拆分；服务未配置或输出无法解析时按句子拆分
+    """
+    if count <= 1:
+        return [prompt]
+
+    try:
+        from app.services.qwen_service import get_qwen_service
+
+        text = await get_qwen_service().chat(
+            prompt=prompt,
+            system_prompt=SCENE_SYSTEM_PROMPT.format(
+                count=count,
+                seconds=settings.VIDEO_SEGMENT_SECONDS,
+                style=style or "自然、有吸引力"
+            ),
+            priority=priority,
+            temperature=0.7
+        )
+        scenes = _parse_scenes(text, count)
+        if scenes:
+            return scenes
+        logger.warning(f"分镜输出无法解析，按句子拆分: {text[:100]}")
+    except Exception as e:
+        logger.warning(f"AI 拆分分镜失败，按句子拆分: {e}")
+    return _fallback_scenes(prompt, count)
+
+
+def playlist_url(task_id: int) -> str:
+    """长视频任务的播放地址（写入任务的 video_url）"""
+    return f"{settings.API_PREFIX}/video/tasks/{task_id}/playlist.m3u8"
+
+
+def segment_file_url(task_id: int, segment_index: int) -> str:
+    """分段 MP4 地址（本地镜像，未镜像时重定向到服务商地址）"""
+    return f"{settings.API_PREFIX}/video/tasks/{task_id}/segments/{segment_index}/file"
+
+
+def hls_available() -> bool:
+    """当前进程能否为长视频生成播放列表：需开启镜像并安装 ffmpeg（转封装为 MPEG-TS）"""
+    return settings.VIDEO_MIRROR_ENABLED and shutil.which(settings.FFMPEG_PATH) is not None
+
+
+def is_playlist_url(url: Optional[str]) -> bool:
+    return bool(url) and url.endswith(".m3u8")
+
+
+def long_video_url(task_id: int, hls: Optional[bool] = None) -> str:
+    """
+    长视频任务写入 video_url 的地址
+
+    能生成播放列表时为播放列表，否则为第一段 MP4（各段地址见任务响应的 segment_urls）；
+    hls 为空时按当前进程的配置判断
+    """
+    if hls is None:
+        hls = hls_available()
+    return playlist_url(task_id) if hls else segment_file_url(task_id, 0)
+
+
+def segment_stream_url(task_id: int, segment_index: int) -> str:
+    """分段转封装后的 MPEG-TS 地址（HLS 分段，见 app.services.video_mirror）"""
+    return f"{settings.API_PREFIX}/video/tasks/{task_id}/segments/{segment_index}/stream.ts"
+
+
+def build_playlist(segments: Iterable[Any], uris: Sequence[str]) -> str:
+    """
+    按顺序生成 HLS 点播播放列表
+
+    segments 需有 duration 属性，uris 为对应的 MPEG-TS 分段地址（普通 MP4 不是合法的 HLS 分段）；
+    各段是独立生成的视频，段之间标记 EXT-X-DISCONTINUITY，播放器切换时重置时间戳与解码参数
+    """
+    segments = list(segments)
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{max(segment.duration for segment in segments)}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+    ]
+    for i, segment in enumerate(segments):
+        if i:
+            lines.append("#EXT-X-DISCONTINUITY")
+        lines.append(f"#EXTINF:{segment.duration:.1f},")
+        lines.append(uris[i])
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
@@ -4,21 +4,29 @@ https://help.aliyun.com/zh/model-studio/text-to-video-api-reference
 """
 import os
 import asyncio
-import aiohttp
+import uuid
 import requests
 from datetime import datetime
 from typing import Optional, Dict, Any
 from loguru import logger
 
 from app.core.config import settings
+from app.services.http_clients import get_aiohttp_session
+from app.services.downloader import download_file
+from app.services.admission import (
+    wanxiang_admission,
+    AdmissionTimeoutError,
+    PRIORITY_NORMAL,
+    PRIORITY_BACKGROUND,
+)
 
 
 class WanxiangVideoService:
     """通义万相视频生成服务"""
 
     def __init__(self):
-        # 北京地域
-        self.base_url = "https://dashscope.aliyuncs.com/api/v1"
+        # 默认北京地域
+        self.base_url = f"{settings.DASHSCOPE_BASE_URL.rstrip('/')}/api/v1"
         self.api_key = settings.DASHSCOPE_API_KEY or os.getenv("DASHSCOPE_API_KEY", "")
 
         if not self.api_key:
@@ -32,7 +40,8 @@ class WanxiangVideoService:
         duration: int = 5,
         negative_prompt: str = "",
         prompt_extend: bool = True,
-        watermark: bool = False
+        watermark: bool = False,
+        priority: int = PRIORITY_NORMAL
     ) -> Dict[str, Any]:
         """
         创建视频生成任务
@@ -45,6 +54,7 @@ class WanxiangVideoService:
             negative_prompt: 反向提示词
             prompt_extend: 是否智能改写prompt
             watermark: 是否添加水印
+            priority: 排队优先级（见 app.services.admission）
 
         Returns:
             任务信息，包含 task_id
@@ -81,20 +91,22 @@ class WanxiangVideoService:
             data["parameters"]["watermark"] = watermark
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=data, headers=headers) as response:
-                    result = await response.json()
-
-                    if response.status != 200:
-                        logger.error(f"创建视频任务失败: {result}")
-                        raise Exception(result.get("message", "创建任务失败"))
-
-                    logger.info(f"视频任务创建成功: {result['output']['task_id']}")
-                    return result["output"]
+            async with wanxiang_admission.slot(priority), \
+                    get_aiohttp_session().post(url, json=data, headers=headers) as response:
+                result = await response.json(content_type=None)
+
+                if response.status != 200 or not result.get("output", {}).get("task_id"):
+                    logger.error(f"创建视频任务失败: HTTP {response.status}, {result}")
+                    raise Exception(result.get("message", "创建任务失败"))
+
+                logger.info(f"视频任务创建成功: {result['output']['task_id']}")
+                return result["output"]
+        except AdmissionTimeoutError:
+            raise
         except Exception as e:
+            # 已配置 API Key 时不降级到模拟模式：由调用方按退避重试
             logger.error(f"调用通义万相API失败: {e}")
-            # 降级到模拟模式
-            return self._mock_create_task(prompt)
+            raise
 
     async def get_task_result(self, task_id: str) -> Dict[str, Any]:
         """
@@ -116,15 +128,20 @@ class WanxiangVideoService:
         }
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers) as response:
-                    result = await response.json()
-
-                    if response.status != 200:
-                        logger.error(f"查询任务失败: {result}")
-                        return {"task_status": "FAILED", "code": result.get("code"), "message": result.get("message")}
-
-                    return result["output"]
+            # 状态轮询是后台操作，排在用户发起的请求之后
+            async with wanxiang_admission.slot(PRIORITY_BACKGROUND), \
+                    get_aiohttp_session().get(url, headers=headers) as response:
+                result = await response.json()
+
+                if response.status == 429 or response.status >= 500:
+                    # 限流或服务端临时错误，稍后重新查询
+                    logger.warning(f"查询任务暂时失败: HTTP {response.status}, {result}")
+                    return {"task_status": "UNKNOWN"}
+                if response.status != 200:
+                    logger.error(f"查询任务失败: {result}")
+                    return {"task_status": "FAILED", "code": result.get("code"), "message": result.get("message")}
+
+                return result["output"]
         except Exception as e:
             logger.error(f"查询任务结果失败: {e}")
             return {"task_status": "UNKNOWN"}
@@ -178,7 +195,7 @@ class WanxiangVideoService:
 
     async def download_video(self, video_url: str, save_path: str) -> bool:
         """
-        下载视频到本地
+        下载视频到本地（分段并行、断点续传，见 app.services.downloader）
 
         Args:
             video_url: 视频URL
@@ -188,22 +205,9 @@ class WanxiangVideoService:
             是否成功
         """
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(video_url, timeout=aiohttp.ClientTimeout(total=300)) as response:
-                    if response.status != 200:
-                        logger.error(f"下载视频失败: HTTP {response.status}")
-                        return False
-
-                    # 确保目录存在
-                    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-
-                    # 写入文件
-                    with open(save_path, 'wb') as f:
-                        async for chunk in response.content.iter_chunked(8192):
-                            f.write(chunk)
-
-                    logger.info(f"视频已下载: {save_path}")
-                    return True
+            size = await download_file(video_url, save_path)
+            logger.info(f"视频已下载: {save_path}, {size} 字节")
+            return True
         except Exception as e:
             logger.error(f"下载视频异常: {e}")
             return False
@@ -211,7 +215,8 @@ class WanxiangVideoService:
     def _mock_create_task(self, prompt: str) -> Dict[str, Any]:
         """模拟创建任务（用于测试）"""
         import time
-        task_id = f"mock_{int(time.time())}"
+        # 同一秒内创建多个任务（如长视频的各分段）时用随机后缀区分
+        task_id = f"mock_{int(time.time())}_{uuid.uuid4().hex[:8]}"
         logger.info(f"[模拟模式] 创建视频任务: {task_id}")
         return {
             "task_id": task_id,
@@ -226,7 +231,7 @@ class WanxiangVideoService:
         # 根据时间模拟不同的状态
         import time
         current_time = int(time.time())
-        task_time = int(task_id.replace("mock_", ""))
+        task_time = int(task_id.split("_")[1])
 
         if current_time - task_time < 5:
             return {"task_status": "PENDING"}
@@ -9,8 +9,20 @@ from fastapi.responses import JSONResponse
 from loguru import logger
 
 from app.core.config import settings
-from app.core.database import init_db
+from app.core.database import engine, init_db
 from app.api import auth, knowledge_base, video
+from app.services.keyword_index import init_keyword_index
+from app.services.http_clients import start_http_clients, close_http_clients
+from app.services.llm_cache import get_llm_cache
+from app.services.qwen_service import get_qwen_service
+from app.services.admission import qwen_admission, wanxiang_admission
+from app.services.video_jobs import start_in_process_worker, stop_in_process_worker, worker_stats
+from app.services.ingestion_worker import (
+    start_ingestion_pool,
+    shutdown_ingestion_pool,
+    release_document_leases,
+    resume_pending_documents,
+)
 
 
 # 配置日志 - 简化版以支持 Railway 部署
@@ -52,13 +64,34 @@ async def lifespan(app: FastAPI):
     # 初始化数据库表
     try:
         init_db()
+        init_keyword_index(engine)
         logger.info("数据库初始化成功")
     except Exception as e:
         logger.warning(f"数据库初始化警告: {e}")
 
+    # 上游 HTTP 长连接池
+    await start_http_clients()
+
+    # 文档解析进程池，并恢复上次未处理完的文档
+    start_ingestion_pool()
+    try:
+        resume_pending_documents()
+    except Exception as e:
+        logger.warning(f"恢复文档处理失败: {e}")
+
+    # 恢复上次中断的视频任务，并启动 worker（独立部署 worker.py 时不在 API 进程内运行）
+    try:
+        await start_in_process_worker()
+    except Exception as e:
+        logger.warning(f"启动视频任务 worker 失败: {e}")
+
     yield
 
     # 关闭时执行
+    await stop_in_process_worker()
+    shutdown_ingestion_pool()
+    release_document_leases()
+    await close_http_clients()
     logger.info("应用关闭")
 
 
@@ -117,6 +150,25 @@ async def health_check():
     }
 
 
+# 运行指标
+@app.get("/metrics", tags=["系统"])
+async def metrics():
+    """
+    运行指标接口
+    """
+    llm_cache = get_llm_cache()
+    return {
+        "llm_cache": await llm_cache.stats() if llm_cache else None,
+        "llm_single_flight": get_qwen_service().inflight.stats(),
+        "qwen_resilience": get_qwen_service().resilience.stats(),
+        "admission": {
+            "qwen": qwen_admission.stats(),
+            "wanxiang": wanxiang_admission.stats(),
+        },
+        "video_worker": worker_stats(),
+    }
+
+
 # 全局异常处理
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
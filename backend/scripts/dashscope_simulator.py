@@ -0,0 +1,354 @@
+"""
+DashScope 本地模拟服务：用于压测与延迟测试，不消耗付费调用
+
+模拟以下接口（路径、请求头与响应格式与 DashScope 一致）：
+    POST /api/v1/services/aigc/text-generation/generation          文本生成（支持 SSE 流式）
+    POST /api/v1/services/embeddings/text-embedding/text-embedding 文本向量化
+    POST /api/v1/services/aigc/video-generation/video-synthesis    创建视频任务（异步）
+    GET  /api/v1/tasks/{task_id}                                   查询任务
+    GET  /videos/{task_id}.mp4                                     下载生成的视频（支持 Range）
+    GET  /stats                                                    模拟服务自身的请求统计
+
+延迟服从对数正态分布（由中位数与 sigma 描述），并可配置错误率与 QPS 限流（超出返回 429）。
+
+用法（在 backend 目录下执行）：
+    python scripts/dashscope_simulator.py --port 8900 --text-median-ms 800 --error-rate 0.02 --qps 20
+
+然后让后端指向模拟服务（API Key 任意非空值即可）：
+    DASHSCOPE_BASE_URL=http://127.0.0.1:8900 QWEN_API_KEY=sim DASHSCOPE_API_KEY=sim python main.py
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+API_PREFIX = "/api/v1"
+
+# 模拟回复的素材，按需重复到目标长度
+REPLY_TEXT = (
+    "这是来自 DashScope 模拟服务的回复，用于压测与延迟测试。"
+    "回复内容与提示词无关，长度由 max_tokens 与 --reply-chars 决定。"
+)
+
+# text-embedding-v1/v2 的向量维度
+EMBEDDING_DIM = 1536
+
+
+@dataclass
+class SimulatorConfig:
+    """模拟服务参数"""
+
+    text_median_ms: float = 800.0  # 文本生成（流式为首个分段）耗时中位数
+    text_sigma: float = 0.5  # 对数正态分布 sigma，越大长尾越重
+    stream_interval_ms: float = 40.0  # 流式分段间隔
+    stream_chunk_chars: int = 8  # 每个流式分段的字数
+    reply_chars: int = 300  # 回复字数上限
+    embed_median_ms: float = 150.0
+    embed_sigma: float = 0.3
+    video_submit_median_ms: float = 300.0  # 创建视频任务接口耗时
+    video_queue_seconds: float = 5.0  # 视频任务 PENDING 时长
+    video_run_seconds: float = 30.0  # 视频任务 RUNNING 时长
+    video_failure_rate: float = 0.0  # 视频任务最终失败的比例
+    video_bytes: int = 2 * 1024 * 1024  # 生成的视频文件大小
+    error_rate: float = 0.0  # 请求直接返回 500 的比例
+    qps: float = 0.0  # 每秒放行请求数（令牌桶），0 表示不限流
+    burst: int = 0  # 令牌桶容量，0 表示与 qps 相同
+    seed: Optional[int] = None
+
+
+@dataclass
+class _VideoTask:
+    task_id: str
+    prompt: str
+    submitted_at: float
+    failed: bool
+
+
+@dataclass
+class _State:
+    tokens: float = 0.0
+    refilled_at: float = field(default_factory=time.monotonic)
+    tasks: Dict[str, _VideoTask] = field(default_factory=dict)
+    counters: Dict[str, int] = field(default_factory=dict)
+
+
+def _error(status_code: int, code: str, message: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"code": code, "message": message, "request_id": str(uuid.uuid4())},
+    )
+
+
+def _fmt_time(ts: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)) + f".{int(ts * 1000) % 1000:03d}"
+
+
+def _parse_range(header: Optional[str], total: int) -> Optional[Tuple[int, int]]:
+    """解析 Range 的第一段，返回 [start, end]；格式无效时返回 None（忽略 Range，返回整个文件）"""
+    if not header or not header.startswith("bytes="):
+        return None
+    first, sep, last = header[6:].split(",")[0].strip().partition("-")
+    if not sep or not (first or last) or not all(value.isdigit() for value in (first, last) if value):
+        return None
+    if not first:
+        # bytes=-N：最后 N 个字节（N 为 0 时 start == total，不可满足）
+        return max(0, total - int(last)), total - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    return start, min(int(last), total - 1) if last else total - 1
+
+
+def create_app(config: SimulatorConfig) -> FastAPI:
+    """创建模拟服务应用（也可通过 httpx.ASGITransport 在进程内使用）"""
+    app = FastAPI(title="DashScope Simulator")
+    rng = random.Random(config.seed)
+    burst = config.burst or max(1, math.ceil(config.qps))
+    state = _State(tokens=float(burst))
+
+    def count(name: str) -> None:
+        state.counters[name] = state.counters.get(name, 0) + 1
+
+    def sample_latency(median_ms: float, sigma: float) -> float:
+        """按对数正态分布抽样耗时（秒）"""
+        if median_ms <= 0:
+            return 0.0
+        return rng.lognormvariate(math.log(median_ms / 1000), sigma)
+
+    def take_token() -> bool:
+        if config.qps <= 0:
+            return True
+        now = time.monotonic()
+        state.tokens = min(burst, state.tokens + (now - state.refilled_at) * config.qps)
+        state.refilled_at = now
+        if state.tokens >= 1:
+            state.tokens -= 1
+            return True
+        return False
+
+    def admit(request: Request, endpoint: str) -> Optional[JSONResponse]:
+        """鉴权、限流与随机错误，返回 None 表示正常处理"""
+        count(f"{endpoint}.requests")
+        if not request.headers.get("Authorization", "").removeprefix("Bearer ").strip():
+            count(f"{endpoint}.401")
+            return _error(401, "InvalidApiKey", "Invalid API-key provided.")
+        if not take_token():
+            count(f"{endpoint}.429")
+            return _error(429, "Throttling.RateQuota", "Requests rate limit exceeded, please try again later.")
+        if config.error_rate and rng.random() < config.error_rate:
+            count(f"{endpoint}.500")
+            return _error(500, "InternalError", "An internal error has occured, please try again later.")
+        return None
+
+    @app.head("/")
+    @app.get("/")
+    async def root():
+        return {"service": "dashscope-simulator"}
+
+    @app.get("/stats")
+    async def stats():
+        return {"counters": state.counters, "video_tasks": len(state.tasks)}
+
+    @app.post(f"{API_PREFIX}/services/aigc/text-generation/generation")
+    async def text_generation(request: Request):
+        rejected = admit(request, "text")
+        if rejected is not None:
+            return rejected
+        body = await request.json()
+        parameters = body.get("parameters") or {}
+        messages = (body.get("input") or {}).get("messages") or []
+        prompt_chars = sum(len(message.get("content", "")) for message in messages)
+        length = max(1, min(config.reply_chars, int(parameters.get("max_tokens") or config.reply_chars)))
+        reply = (REPLY_TEXT * (length // len(REPLY_TEXT) + 1))[:length]
+        request_id = str(uuid.uuid4())
+        usage = {"input_tokens": prompt_chars, "output_tokens": length, "total_tokens": prompt_chars + length}
+
+        def choice(content: str, finish_reason: str) -> dict:
+            return {"finish_reason": finish_reason, "message": {"role": "assistant", "content": content}}
+
+        if request.headers.get("X-DashScope-SSE") != "enable" and not parameters.get("stream"):
+            await asyncio.sleep(sample_latency(config.text_median_ms, config.text_sigma))
+            return {
+                "output": {"choices": [choice(reply, "stop")]},
+                "usage": usage,
+                "request_id": request_id,
+            }
+
+        incremental = bool(parameters.get("incremental_output"))
+        size = max(1, config.stream_chunk_chars)
+        chunks = [reply[i:i + size] for i in range(0, len(reply), size)]
+
+        async def events():
+            await asyncio.sleep(sample_latency(config.text_median_ms, config.text_sigma))
+            sent = ""
+            for index, chunk in enumerate(chunks, 1):
+                if index > 1:
+                    await asyncio.sleep(config.stream_interval_ms / 1000)
+                sent += chunk
+                last = index == len(chunks)
+                data = {
+                    "output": {"choices": [choice(chunk if incremental else sent, "stop" if last else "null")]},
+                    "usage": usage,
+                    "request_id": request_id,
+                }
+                yield (
+                    f"id:{index}\nevent:result\n:HTTP_STATUS/200\n"
+                    f"data:{json.dumps(data, ensure_ascii=False)}\n\n"
+                )
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post(f"{API_PREFIX}/services/embeddings/text-embedding/text-embedding")
+    async def text_embedding(request: Request):
+        rejected = admit(request, "embed")
+        if rejected is not None:
+            return rejected
+        body = await request.json()
+        texts = (body.get("input") or {}).get("texts") or []
+        await asyncio.sleep(sample_latency(config.embed_median_ms, config.embed_sigma))
+        embeddings = []
+        for index, text in enumerate(texts):
+            # 同一文本总是得到同一向量
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).normal(size=EMBEDDING_DIM)
+            vector /= np.linalg.norm(vector)
+            embeddings.append({"text_index": index, "embedding": vector.round(6).tolist()})
+        return {
+            "output": {"embeddings": embeddings},
+            "usage": {"total_tokens": sum(len(text) for text in texts)},
+            "request_id": str(uuid.uuid4()),
+        }
+
+    @app.post(f"{API_PREFIX}/services/aigc/video-generation/video-synthesis")
+    async def video_synthesis(request: Request):
+        rejected = admit(request, "video")
+        if rejected is not None:
+            return rejected
+        if request.headers.get("X-DashScope-Async") != "enable":
+            return _error(403, "AccessDenied", "current user api does not support synchronous calls")
+        body = await request.json()
+        await asyncio.sleep(sample_latency(config.video_submit_median_ms, 0.3))
+        task = _VideoTask(
+            task_id=str(uuid.uuid4()),
+            prompt=(body.get("input") or {}).get("prompt", ""),
+            submitted_at=time.time(),
+            failed=rng.random() < config.video_failure_rate,
+        )
+        state.tasks[task.task_id] = task
+        return {
+            "output": {"task_id": task.task_id, "task_status": "PENDING"},
+            "request_id": str(uuid.uuid4()),
+        }
+
+    @app.get(f"{API_PREFIX}/tasks/{{task_id}}")
+    async def get_task(task_id: str, request: Request):
+        rejected = admit(request, "task")
+        if rejected is not None:
+            return rejected
+        task = state.tasks.get(task_id)
+        if task is None:
+            return {"output": {"task_id": task_id, "task_status": "UNKNOWN"}, "request_id": str(uuid.uuid4())}
+
+        elapsed = time.time() - task.submitted_at
+        output = {
+            "task_id": task_id,
+            "submit_time": _fmt_time(task.submitted_at),
+            "orig_prompt": task.prompt,
+        }
+        if elapsed < config.video_queue_seconds:
+            output["task_status"] = "PENDING"
+        elif elapsed < config.video_queue_seconds + config.video_run_seconds:
+            output["task_status"] = "RUNNING"
+            output["scheduled_time"] = _fmt_time(task.submitted_at + config.video_queue_seconds)
+        else:
+            output["scheduled_time"] = _fmt_time(task.submitted_at + config.video_queue_seconds)
+            output["end_time"] = _fmt_time(
+                task.submitted_at + config.video_queue_seconds + config.video_run_seconds
+            )
+            if task.failed:
+                output.update(task_status="FAILED", code="InternalError", message="Video generation failed.")
+            else:
+                output.update(
+                    task_status="SUCCEEDED",
+                    video_url=f"{str(request.base_url).rstrip('/')}/videos/{task_id}.mp4",
+                )
+        return {"output": output, "request_id": str(uuid.uuid4())}
+
+    @app.get("/videos/{task_id}.mp4")
+    async def download_video(task_id: str, request: Request):
+        count("download.requests")
+        total = config.video_bytes
+        start, end = 0, total - 1
+        status_code = 200
+        byte_range = _parse_range(request.headers.get("Range"), total)
+        if byte_range is not None:
+            start, end = byte_range
+            if start >= total:
+                return Response(status_code=416, headers={"Content-Range": f"bytes */{total}"})
+            status_code = 206
+
+        # 内容由 task_id 决定，同一视频多次下载（或分段下载）得到相同字节
+        block = hashlib.sha256(task_id.encode("utf-8")).digest() * 2048
+
+        async def body():
+            position = start
+            while position <= end:
+                offset = position % len(block)
+                piece = block[offset:offset + min(len(block) - offset, end - position + 1)]
+                position += len(piece)
+                yield piece
+
+        headers = {
+            "Accept-Ranges": "bytes",
+            "Content-Length": str(end - start + 1),
+            "ETag": f'"{task_id}"',
+        }
+        if status_code == 206:
+            headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+        return StreamingResponse(body(), status_code=status_code, media_type="video/mp4", headers=headers)
+
+    return app
+
+
+def main():
+    defaults = SimulatorConfig()
+    parser = argparse.ArgumentParser(description="DashScope 本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--text-median-ms", type=float, default=defaults.text_median_ms, help="文本生成耗时中位数")
+    parser.add_argument("--text-sigma", type=float, default=defaults.text_sigma, help="文本生成耗时的对数正态 sigma")
+    parser.add_argument("--stream-interval-ms", type=float, default=defaults.stream_interval_ms, help="流式分段间隔")
+    parser.add_argument("--stream-chunk-chars", type=int, default=defaults.stream_chunk_chars, help="每个流式分段字数")
+    parser.add_argument("--reply-chars", type=int, default=defaults.reply_chars, help="回复字数上限")
+    parser.add_argument("--embed-median-ms", type=float, default=defaults.embed_median_ms, help="向量化耗时中位数")
+    parser.add_argument("--embed-sigma", type=float, default=defaults.embed_sigma)
+    parser.add_argument("--video-submit-median-ms", type=float, default=defaults.video_submit_median_ms)
+    parser.add_argument("--video-queue-seconds", type=float, default=defaults.video_queue_seconds, help="任务排队时长")
+    parser.add_argument("--video-run-seconds", type=float, default=defaults.video_run_seconds, help="任务生成时长")
+    parser.add_argument("--video-failure-rate", type=float, default=defaults.video_failure_rate)
+    parser.add_argument("--video-bytes", type=int, default=defaults.video_bytes, help="生成的视频文件大小")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="返回 500 的请求比例")
+    parser.add_argument("--qps", type=float, default=defaults.qps, help="限流阈值，超出返回 429，0 表示不限流")
+    parser.add_argument("--burst", type=int, default=defaults.burst, help="限流令牌桶容量，默认与 qps 相同")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子（便于复现）")
+    args = parser.parse_args()
+
+    config = SimulatorConfig(**{
+        name: value for name, value in vars(args).items() if name not in ("host", "port")
+    })
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+测试公共配置
+
+数据库固定为当前目录下的 ai_agent_platform.db（见 app.core.database），
+因此在导入 app 之前切换到临时目录，测试不会读写开发数据库与上传目录
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import text
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(tempfile.mkdtemp(prefix="aiagent-tests-"))
+
+import app.models  # noqa: E402,F401  注册所有模型
+from app.core.database import Base, SessionLocal, engine, init_db  # noqa: E402
+from app.models.user import User  # noqa: E402
+from app.services.keyword_index import FTS_TABLE, init_keyword_index  # noqa: E402
+
+init_db()
+init_keyword_index(engine)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db():
+    """数据库会话；测试结束后清空所有表"""
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        with engine.begin() as conn:
+            for table in reversed(Base.metadata.sorted_tables):
+                conn.execute(table.delete())
+            conn.execute(text(f"DELETE FROM {FTS_TABLE}"))
+
+
+@pytest.fixture
+def make_user(db):
+    """创建用户：make_user(membership_type=MembershipType.PROFESSIONAL)"""
+    counter = iter(range(1, 10 ** 6))
+
+    def factory(**values) -> User:
+        n = next(counter)
+        user = User(username=f"user{n}", email=f"user{n}@example.com", hashed_password="x", **values)
+        db.add(user)
+        db.commit()
+        return user
+
+    return factory
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from app.services.admission import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_NORMAL,
+    AdmissionController,
+    AdmissionTimeoutError,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def _controller(**overrides) -> AdmissionController:
+    options = dict(name="test", qps=0, burst=1, max_concurrency=1, queue_timeout=0.05)
+    options.update(overrides)
+    return AdmissionController(**options)
+
+
+async def test_user_requests_time_out_in_queue():
+    controller = _controller()
+    await controller.acquire(PRIORITY_NORMAL)
+
+    with pytest.raises(AdmissionTimeoutError):
+        await controller.acquire(PRIORITY_NORMAL)
+    assert controller.timeouts == 1
+
+
+async def test_background_requests_wait_past_queue_timeout():
+    controller = _controller()
+    await controller.acquire(PRIORITY_NORMAL)
+
+    waiter = asyncio.ensure_future(controller.acquire(PRIORITY_BACKGROUND))
+    await asyncio.sleep(0.1)
+    assert not waiter.done()
+
+    controller.release()
+    await asyncio.wait_for(waiter, 1)
+    assert controller.in_flight == 1
+    assert controller.timeouts == 0
+
+
+async def test_background_queue_timeout_is_configurable():
+    controller = _controller(background_queue_timeout=0.05)
+    await controller.acquire(PRIORITY_NORMAL)
+
+    with pytest.raises(AdmissionTimeoutError):
+        await controller.acquire(PRIORITY_BACKGROUND)
@@ -0,0 +1,34 @@
+from sqlalchemy import inspect, text
+
+from app.core.database import _upgrade_tables, engine
+from app.models.video import VideoGenerationTask
+
+
+def _columns(table: str):
+    return {column["name"] for column in inspect(engine).get_columns(table)}
+
+
+def test_upgrade_adds_missing_columns_with_defaults(db, make_user):
+    user = make_user()
+    task = VideoGenerationTask(user_id=user.id, prompt="p")
+    db.add(task)
+    db.commit()
+    task_id = task.id
+    db.close()
+
+    # 模拟旧版本创建的表
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE "video_generation_tasks" DROP COLUMN "attempts"'))
+        conn.execute(text('ALTER TABLE "knowledge_documents" DROP COLUMN "lease_expires_at"'))
+    assert "attempts" not in _columns("video_generation_tasks")
+
+    _upgrade_tables()
+    _upgrade_tables()
+
+    assert "attempts" in _columns("video_generation_tasks")
+    assert "lease_expires_at" in _columns("knowledge_documents")
+    with engine.connect() as conn:
+        attempts = conn.execute(
+            text('SELECT attempts FROM video_generation_tasks WHERE id = :id'), {"id": task_id}
+        ).scalar()
+    assert attempts == 0
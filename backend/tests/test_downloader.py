@@ -0,0 +1,119 @@
+import os
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.services.downloader import DownloadError, RangedDownload, download_file
+
+pytestmark = pytest.mark.anyio
+
+CONTENT = os.urandom(10_000)
+URL = "https://oss.example.com/video.mp4"
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+class RangeServer:
+    """按 Range 返回 CONTENT 的模拟对象存储，记录收到的请求头"""
+
+    def __init__(self, etag='"v1"', ranges=True, honor_if_range=True, fail_offsets=()):
+        self.etag = etag
+        self.ranges = ranges
+        self.honor_if_range = honor_if_range
+        self.fail_offsets = set(fail_offsets)
+        self.requests = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request.headers)
+        headers = {"Last-Modified": LAST_MODIFIED}
+        if self.etag:
+            headers["ETag"] = self.etag
+        range_header = request.headers.get("range")
+        part_request = "if-range" in request.headers
+        if not self.ranges or not range_header or (part_request and not self.honor_if_range):
+            return httpx.Response(200, content=CONTENT, headers=headers)
+        first, _, last = range_header[6:].partition("-")
+        start, end = int(first), min(int(last), len(CONTENT) - 1)
+        if start in self.fail_offsets:
+            raise httpx.ConnectError("connection reset", request=request)
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(CONTENT)}"
+        return httpx.Response(206, content=CONTENT[start:end + 1], headers=headers)
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
+
+    def part_requests(self):
+        return [headers for headers in self.requests if headers.get("range") not in (None, "bytes=0-0")]
+
+
+@pytest.fixture(autouse=True)
+def small_parts(monkeypatch):
+    monkeypatch.setattr(settings, "DOWNLOAD_PART_SIZE", 1000)
+    monkeypatch.setattr(settings, "DOWNLOAD_CONCURRENCY", 3)
+    monkeypatch.setattr(settings, "DOWNLOAD_RETRY_ATTEMPTS", 1)
+
+
+async def test_ranged_download(tmp_path):
+    server = RangeServer()
+    dest = str(tmp_path / "video.mp4")
+
+    async with server.client() as client:
+        size = await download_file(URL, dest, client)
+
+    assert size == len(CONTENT)
+    assert open(dest, "rb").read() == CONTENT
+    assert len(server.part_requests()) == 10
+    assert all(headers["if-range"] == '"v1"' for headers in server.part_requests())
+    assert not os.path.exists(dest + ".part")
+    assert not os.path.exists(dest + ".part.json")
+
+
+async def test_weak_etag_falls_back_to_last_modified(tmp_path):
+    server = RangeServer(etag='W/"v1"')
+
+    async with server.client() as client:
+        await download_file(URL, str(tmp_path / "video.mp4"), client)
+
+    assert all(headers["if-range"] == LAST_MODIFIED for headers in server.part_requests())
+
+
+async def test_part_answered_with_whole_file_falls_back_to_single_download(tmp_path):
+    server = RangeServer(honor_if_range=False)
+    dest = str(tmp_path / "video.mp4")
+
+    async with server.client() as client:
+        size = await download_file(URL, dest, client)
+
+    assert size == len(CONTENT)
+    assert open(dest, "rb").read() == CONTENT
+
+
+async def test_server_without_range_support(tmp_path):
+    server = RangeServer(ranges=False)
+    dest = str(tmp_path / "video.mp4")
+
+    async with server.client() as client:
+        await download_file(URL, dest, client)
+
+    assert open(dest, "rb").read() == CONTENT
+    assert server.part_requests() == []
+
+
+async def test_failed_download_resumes_missing_parts(tmp_path):
+    server = RangeServer(fail_offsets={3000})
+    dest = str(tmp_path / "video.mp4")
+
+    async with server.client() as client:
+        with pytest.raises(DownloadError):
+            await download_file(URL, dest, client)
+    assert os.path.exists(dest + ".part.json")
+
+    server.fail_offsets.clear()
+    server.requests.clear()
+    async with server.client() as client:
+        download = RangedDownload(URL, dest, client)
+        assert await download.run() == len(CONTENT)
+
+    assert open(dest, "rb").read() == CONTENT
+    assert download.resumed_bytes > 0
+    assert len(server.part_requests()) < 10
@@ -0,0 +1,100 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.core.security import create_access_token, create_file_token, decode_access_token, decode_file_token
+from app.services.file_delivery import RangeNotSatisfiable, file_response, parse_range
+
+CONTENT = bytes(range(256)) * 40
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-9", (0, 9)),
+    ("bytes=5-", (5, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=90-500", (90, 99)),
+    ("bytes=5-3", None),
+    ("bytes=abc-", None),
+    ("bytes=--5", None),
+    ("bytes=-", None),
+    ("bytes=0-1,5-6", None),
+    ("items=0-9", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=200-300", "bytes=-0"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, 100)
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(CONTENT)
+    app = FastAPI()
+
+    @app.get("/file")
+    async def get_file(request: Request):
+        return await file_response(request, str(path), media_type="video/mp4")
+
+    @app.get("/missing")
+    async def get_missing(request: Request):
+        return await file_response(request, str(tmp_path / "missing.mp4"))
+
+    return TestClient(app)
+
+
+def test_full_and_partial_content(client):
+    full = client.get("/file")
+    assert full.status_code == 200
+    assert full.content == CONTENT
+    assert full.headers["accept-ranges"] == "bytes"
+
+    part = client.get("/file", headers={"Range": "bytes=100-199"})
+    assert part.status_code == 206
+    assert part.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+    assert part.content == CONTENT[100:200]
+
+
+def test_invalid_range_sends_whole_file(client):
+    response = client.get("/file", headers={"Range": "bytes=500-100"})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+def test_unsatisfiable_range(client):
+    response = client.get("/file", headers={"Range": f"bytes={len(CONTENT)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+
+def test_conditional_requests(client):
+    etag = client.get("/file").headers["etag"]
+
+    assert client.get("/file", headers={"If-None-Match": etag}).status_code == 304
+
+    stale = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+    assert stale.status_code == 200
+    assert stale.content == CONTENT
+
+    fresh = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert fresh.status_code == 206
+    assert fresh.content == CONTENT[:10]
+
+
+def test_missing_file(client):
+    assert client.get("/missing").status_code == 404
+
+
+def test_file_token_is_bound_to_its_resource():
+    token = create_file_token(7, "video:1")
+
+    assert decode_file_token(token, "video:1") == "7"
+    assert decode_file_token(token, "video:2") is None
+    # 文件签名不能作为登录令牌，登录令牌也不能作为文件签名
+    assert decode_access_token(token) is None
+    assert decode_file_token(create_access_token({"sub": "7"}), "video:1") is None
@@ -0,0 +1,80 @@
+import hashlib
+import os
+
+import pytest
+
+from app.core.config import settings
+from app.models.storage import FileBlob
+from app.services.file_storage import (
+    StoredUpload,
+    acquire_blob,
+    blob_path,
+    install_blob,
+    purge_blob,
+    release_blob,
+)
+
+
+@pytest.fixture(autouse=True)
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+
+
+def _upload(tmp_path, content: bytes = b"hello") -> StoredUpload:
+    path = tmp_path / f"upload-{os.urandom(4).hex()}"
+    path.write_bytes(content)
+    return StoredUpload(filename="a.txt", path=str(path), size=len(content), sha256=hashlib.sha256(content).hexdigest())
+
+
+def test_rolled_back_release_keeps_file(db, tmp_path):
+    upload = _upload(tmp_path)
+    acquire_blob(db, upload)
+    db.commit()
+    install_blob(upload)
+
+    assert release_blob(db, upload.sha256)
+    db.rollback()
+
+    assert os.path.exists(blob_path(upload.sha256))
+    assert db.get(FileBlob, upload.sha256).ref_count == 1
+
+
+def test_rolled_back_acquire_leaves_no_blob(db, tmp_path):
+    upload = _upload(tmp_path)
+    acquire_blob(db, upload)
+    db.rollback()
+
+    assert not os.path.exists(blob_path(upload.sha256))
+    assert os.path.exists(upload.path)
+
+
+def test_purge_skips_content_reacquired_after_release(db, tmp_path):
+    first = _upload(tmp_path)
+    acquire_blob(db, first)
+    db.commit()
+    install_blob(first)
+
+    assert release_blob(db, first.sha256)
+    db.commit()
+    # 删除文件之前，相同内容被再次上传
+    second = _upload(tmp_path)
+    acquire_blob(db, second)
+    db.commit()
+    install_blob(second)
+
+    purge_blob(db, first.sha256)
+
+    assert os.path.exists(blob_path(first.sha256))
+
+
+def test_purge_removes_unreferenced_file(db, tmp_path):
+    upload = _upload(tmp_path)
+    acquire_blob(db, upload)
+    db.commit()
+    install_blob(upload)
+
+    assert release_blob(db, upload.sha256)
+    db.commit()
+    purge_blob(db, upload.sha256)
+
+    assert not os.path.exists(blob_path(upload.sha256))
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.knowledge_base import KnowledgeBase, KnowledgeChunk, KnowledgeDocument
+from app.services import ingestion_worker
+
+
+@pytest.fixture
+def document(db, make_user):
+    user = make_user()
+    kb = KnowledgeBase(user_id=user.id, name="kb")
+    db.add(kb)
+    db.commit()
+    doc = KnowledgeDocument(kb_id=kb.id, file_name="a.txt", status="processing")
+    db.add(doc)
+    db.commit()
+    return doc
+
+
+def test_document_lease_excludes_other_workers(db, document, monkeypatch):
+    claimed, _ = ingestion_worker._claim_document(document.id)
+    assert claimed
+
+    monkeypatch.setattr(ingestion_worker, "WORKER_ID", "other-process")
+    claimed, held_until = ingestion_worker._claim_document(document.id)
+    assert not claimed
+    assert held_until > datetime.utcnow()
+    assert not ingestion_worker._renew_document_lease(document.id)
+
+    document.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    claimed, _ = ingestion_worker._claim_document(document.id)
+    assert claimed
+
+
+def test_document_lease_is_released(db, document):
+    ingestion_worker._claim_document(document.id)
+    assert ingestion_worker._renew_document_lease(document.id)
+
+    ingestion_worker._release_documents([document.id])
+
+    db.refresh(document)
+    assert document.locked_by is None
+    assert document.lease_expires_at is None
+
+
+def test_finished_document_is_not_claimed(db, document):
+    document.status = "completed"
+    db.commit()
+
+    assert ingestion_worker._claim_document(document.id) == (False, None)
+
+
+@pytest.mark.anyio
+async def test_text_document_is_indexed_in_background(db, make_user, tmp_path):
+    user = make_user()
+    kb = KnowledgeBase(user_id=user.id, name="kb", chunk_size=100, chunk_overlap=20)
+    db.add(kb)
+    db.commit()
+    path = tmp_path / "a.txt"
+    path.write_text("人工智能是研究如何让计算机模拟人类智能的学科。" * 30, encoding="utf-8")
+    doc = KnowledgeDocument(
+        kb_id=kb.id, file_name="a.txt", file_url=str(path), file_type=".txt", status="processing"
+    )
+    db.add(doc)
+    db.commit()
+
+    await ingestion_worker.process_document(doc.id)
+
+    db.expire_all()
+    assert doc.status == "completed"
+    assert doc.progress == 100
+    assert doc.locked_by is None
+    assert db.query(KnowledgeChunk).filter(KnowledgeChunk.doc_id == doc.id).count() > 1
+    assert kb.document_count == 1
@@ -0,0 +1,69 @@
+from sqlalchemy import text
+
+from app.core.database import engine
+from app.models.knowledge_base import KnowledgeBase, KnowledgeChunk, KnowledgeDocument
+from app.services import keyword_index
+from app.services.keyword_index import FTS_TABLE, LEGACY_TABLES, _query_tokens, init_keyword_index
+
+
+def _document(db, user, contents):
+    kb = KnowledgeBase(user_id=user.id, name="kb")
+    db.add(kb)
+    db.flush()
+    doc = KnowledgeDocument(kb_id=kb.id, file_name="a.txt")
+    db.add(doc)
+    db.flush()
+    chunks = [
+        KnowledgeChunk(kb_id=kb.id, doc_id=doc.id, chunk_index=i, start_offset=0, end_offset=len(content), content=content)
+        for i, content in enumerate(contents)
+    ]
+    db.add_all(chunks)
+    db.flush()
+    return kb, doc, chunks
+
+
+def test_query_drops_unigrams_covered_by_bigrams():
+    assert sorted(_query_tokens("猫咪 狗")) == sorted(["猫咪", "狗"])
+
+
+def test_search_only_matches_own_knowledge_base(db, make_user):
+    user = make_user()
+    kb_a, _, [chunk_a] = _document(db, user, ["猫咪在草地上奔跑"])
+    kb_b, _, [chunk_b] = _document(db, user, ["猫咪在树下睡觉"])
+    keyword_index.index_chunks(db, kb_a.id, [(chunk_a.id, chunk_a.content)])
+    keyword_index.index_chunks(db, kb_b.id, [(chunk_b.id, chunk_b.content)])
+    db.commit()
+
+    assert [chunk_id for chunk_id, _ in keyword_index.search(db, kb_a.id, "猫咪")] == [chunk_a.id]
+    assert [chunk_id for chunk_id, _ in keyword_index.search(db, kb_b.id, "猫咪")] == [chunk_b.id]
+
+
+def test_copied_index_is_searchable_in_target_knowledge_base(db, make_user):
+    user = make_user()
+    kb_a, doc_a, [chunk_a] = _document(db, user, ["小溪边的猫咪"])
+    kb_b, doc_b, [chunk_b] = _document(db, user, ["小溪边的猫咪"])
+    keyword_index.index_chunks(db, kb_a.id, [(chunk_a.id, chunk_a.content)])
+
+    keyword_index.copy_document(db, kb_b.id, doc_a.id, doc_b.id)
+    db.commit()
+
+    assert [chunk_id for chunk_id, _ in keyword_index.search(db, kb_b.id, "小溪")] == [chunk_b.id]
+    assert [chunk_id for chunk_id, _ in keyword_index.search(db, kb_a.id, "小溪")] == [chunk_a.id]
+
+
+def test_legacy_index_is_rebuilt(db, make_user):
+    user = make_user()
+    kb, _, [chunk] = _document(db, user, ["夕阳西下"])
+    db.commit()
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE {FTS_TABLE}"))
+        conn.execute(text(f"CREATE VIRTUAL TABLE {LEGACY_TABLES['sqlite']} USING fts5(tokens, kb_id UNINDEXED)"))
+
+    init_keyword_index(engine)
+
+    with engine.connect() as conn:
+        legacy = conn.execute(
+            text("SELECT count(*) FROM sqlite_master WHERE name = :name"), {"name": LEGACY_TABLES["sqlite"]}
+        ).scalar()
+    assert legacy == 0
+    assert [chunk_id for chunk_id, _ in keyword_index.search(db, kb.id, "夕阳")] == [chunk.id]
@@ -0,0 +1,138 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.resilience import MIN_LATENCY_SAMPLES, CircuitBreaker, CircuitOpenError, ResilientCaller
+
+pytestmark = pytest.mark.anyio
+
+
+def _status_error(code: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://dashscope.example.com")
+    return httpx.HTTPStatusError(f"HTTP {code}", request=request, response=httpx.Response(code, request=request))
+
+
+async def _fail(breaker: CircuitBreaker, exc: Exception) -> None:
+    with pytest.raises(type(exc)):
+        async with breaker.guard():
+            raise exc
+
+
+async def _succeed(breaker: CircuitBreaker) -> None:
+    async with breaker.guard():
+        pass
+
+
+@pytest.mark.parametrize("code", [401, 403, 429, 503])
+async def test_breaker_opens_on_upstream_and_auth_failures(code):
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_timeout=60)
+    for _ in range(3):
+        await _fail(breaker, _status_error(code))
+
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        await _succeed(breaker)
+
+
+async def test_client_errors_neither_trip_nor_reset_the_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_timeout=60)
+    await _fail(breaker, _status_error(503))
+    await _fail(breaker, _status_error(503))
+    await _fail(breaker, _status_error(400))
+    assert breaker.failures == 2
+
+    await _fail(breaker, _status_error(503))
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+async def test_half_open_probe_closes_the_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0)
+    await _fail(breaker, httpx.ConnectError("refused"))
+    assert breaker.state == CircuitBreaker.OPEN
+
+    await _succeed(breaker)
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+
+
+def _caller(**overrides) -> ResilientCaller:
+    options = dict(
+        name="test",
+        attempts=3,
+        backoff_base=0.001,
+        backoff_max=0.001,
+        hedge_enabled=False,
+        hedge_percentile=0.95,
+        hedge_min_delay=0.01,
+        hedge_max_delay=0.01,
+        breaker=CircuitBreaker("test", failure_threshold=10, recovery_timeout=60),
+    )
+    options.update(overrides)
+    return ResilientCaller(**options)
+
+
+async def test_retries_transient_errors_only():
+    caller = _caller()
+    outcomes = [_status_error(503), _status_error(429), "ok"]
+
+    async def flaky():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert await caller.call("chat", flaky) == "ok"
+    assert caller.retries == 2
+
+    calls = 0
+
+    async def bad_request():
+        nonlocal calls
+        calls += 1
+        raise _status_error(400)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await caller.call("chat", bad_request)
+    assert calls == 1
+
+
+async def test_hedged_request_wins_when_first_is_slow():
+    caller = _caller(hedge_enabled=True)
+    calls = 0
+
+    async def fast():
+        return 0
+
+    for _ in range(MIN_LATENCY_SAMPLES):
+        await caller.call("chat", fast)
+    assert caller.hedge_delay("chat") == 0.01
+
+    async def request():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(1 if calls == 1 else 0)
+        return calls
+
+    assert await asyncio.wait_for(caller.call("chat", request), 0.5) == 2
+    assert caller.hedge_wins == 1
+
+
+async def test_latency_excludes_admission_queue_wait():
+    from app.services.admission import AdmissionController
+
+    caller = _caller(hedge_enabled=True, hedge_max_delay=10)
+    admission = AdmissionController("test", qps=0, burst=1, max_concurrency=1, queue_timeout=5)
+
+    async def request():
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    # 并发请求在准入队列中排队，排队时间不能抬高对冲延迟
+    await asyncio.gather(*[
+        caller.call("chat", request, slot=lambda: admission.slot())
+        for _ in range(MIN_LATENCY_SAMPLES)
+    ])
+
+    assert caller.hedge_delay("chat") < 0.1
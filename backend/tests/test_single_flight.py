@@ -0,0 +1,137 @@
+import asyncio
+import sys
+
+import pytest
+
+import app.services.qwen_service  # noqa: F401
+from app.services.single_flight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    results = await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+
+    assert results == ["answer"] * 5
+    assert calls == 1
+    assert flight.stats()["leaders"] == 1
+    assert flight.stats()["coalesced"] == 4
+    assert flight.stats()["in_flight"] == 0
+
+
+async def test_exception_is_delivered_to_every_waiter():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(*(flight.do("k", fail) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+async def test_cancelling_one_waiter_keeps_the_shared_call():
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def work():
+        await release.wait()
+        return 42
+
+    first = asyncio.create_task(flight.do("k", work))
+    second = asyncio.create_task(flight.do("k", work))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await second == 42
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+async def test_cancelling_the_last_waiter_cancels_and_forgets_the_call():
+    flight = SingleFlight()
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def slow():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    waiter = asyncio.create_task(flight.do("k", slow))
+    await started.wait()
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+    # 取消后立即到达的调用发起新的调用，而不是加入已取消的任务
+    async def fresh():
+        return "fresh"
+
+    assert flight.stats()["in_flight"] == 0
+    assert await flight.do("k", fresh) == "fresh"
+
+
+def _service(monkeypatch):
+    # app.services.qwen_service 同时是包属性（服务代理），按模块对象打补丁
+    module = sys.modules["app.services.qwen_service"]
+    monkeypatch.setattr(module, "get_llm_cache", lambda: None)
+    service = module.QwenService()
+    calls = []
+    release = asyncio.Event()
+
+    async def complete(key, messages, priority, **kwargs):
+        calls.append(priority)
+        answer = f"answer-{len(calls)}"
+        await release.wait()
+        return answer
+
+    monkeypatch.setattr(service, "_complete", complete)
+    return service, calls, release
+
+
+async def test_chat_without_cache_is_not_coalesced(monkeypatch):
+    service, calls, release = _service(monkeypatch)
+
+    first = asyncio.create_task(service.chat("hi"))
+    second = asyncio.create_task(service.chat("hi", use_cache=False))
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await first != await second
+    assert len(calls) == 2
+
+
+async def test_chat_joins_only_flights_of_equal_or_higher_priority(monkeypatch):
+    from app.services.admission import PRIORITY_BACKGROUND, PRIORITY_HIGH
+
+    service, calls, release = _service(monkeypatch)
+
+    background = asyncio.create_task(service.chat("hi", priority=PRIORITY_BACKGROUND))
+    await asyncio.sleep(0)
+    high = asyncio.create_task(service.chat("hi", priority=PRIORITY_HIGH))
+    await asyncio.sleep(0)
+    # 低优先级请求可以加入已在进行的高优先级调用
+    later_background = asyncio.create_task(service.chat("hi", priority=PRIORITY_BACKGROUND))
+    await asyncio.sleep(0)
+    release.set()
+
+    results = await asyncio.gather(background, high, later_background)
+    assert calls == [PRIORITY_BACKGROUND, PRIORITY_HIGH]
+    assert results[1] == results[2]
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.services.vector_store import INDEX_IVF, NumpyVectorStore
+
+DIM = 8
+
+
+def _vectors(count: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32)
+
+
+@pytest.fixture(autouse=True)
+def small_ivf(monkeypatch):
+    monkeypatch.setattr(settings, "IVF_MIN_TRAIN_SIZE", 50)
+    monkeypatch.setattr(settings, "IVF_RETRAIN_FACTOR", 2.0)
+
+
+def test_flat_search_finds_stored_vector(tmp_path):
+    store = NumpyVectorStore(str(tmp_path))
+    vectors = _vectors(20, seed=1)
+    store.add(1, list(range(100, 120)), vectors)
+
+    [hits] = store.search_batch(1, [vectors[7]], top_k=1)
+
+    assert hits[0][0] == 107
+    assert hits[0][1] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_ivf_search_and_delete(tmp_path):
+    store = NumpyVectorStore(str(tmp_path))
+    vectors = _vectors(60, seed=2)
+    store.add(1, list(range(60)), vectors)
+    assert store.build_ivf(1)
+
+    [hits] = store.search_batch(1, [vectors[3]], top_k=1, index_type=INDEX_IVF, nprobe=64)
+    assert hits[0][0] == 3
+
+    assert store.delete(1, [3]) == 1
+    [hits] = store.search_batch(1, [vectors[3]], top_k=5, index_type=INDEX_IVF, nprobe=64)
+    assert 3 not in [chunk_id for chunk_id, _ in hits]
+    assert store.count(1) == 59
+
+
+def test_trained_size_survives_reload(tmp_path):
+    store = NumpyVectorStore(str(tmp_path))
+    store.add(1, list(range(60)), _vectors(60, seed=3))
+    store.build_ivf(1)
+    store.add(1, list(range(60, 90)), _vectors(30, seed=4))
+
+    # 新实例从磁盘加载：训练时的向量数不能被当前向量数覆盖，否则永远不会重新训练
+    reloaded = NumpyVectorStore(str(tmp_path))
+    assert reloaded._load(1).trained_size == 60
+
+    reloaded.add(1, list(range(90, 120)), _vectors(30, seed=5))
+    assert reloaded._load(1).trained_size == 120
+    assert NumpyVectorStore(str(tmp_path))._load(1).trained_size == 120
+
+
+def test_appends_and_deletes_survive_reload_without_rewriting_snapshot(tmp_path):
+    store = NumpyVectorStore(str(tmp_path))
+    vectors = _vectors(30, seed=6)
+    store.add(1, list(range(20)), vectors[:20])
+    snapshot = tmp_path / "kb_1.npy"
+    mtime = snapshot.stat().st_mtime_ns
+
+    store.add(1, list(range(20, 30)), vectors[20:])
+    store.delete(1, [5, 25])
+
+    assert snapshot.stat().st_mtime_ns == mtime
+    reloaded = NumpyVectorStore(str(tmp_path))
+    assert reloaded.count(1) == 28
+    found = reloaded.get(1, [5, 24, 25])
+    assert set(found) == {24}
+    [hits] = reloaded.search_batch(1, [vectors[24]], top_k=1)
+    assert hits[0][0] == 24
+
+
+def test_log_is_compacted_once_it_outgrows_snapshot(tmp_path):
+    store = NumpyVectorStore(str(tmp_path))
+    store.add(1, list(range(10)), _vectors(10, seed=7))
+    store.add(1, list(range(10, 20)), _vectors(10, seed=8))
+    assert (tmp_path / "kb_1_log_ids.i64").exists()
+
+    store.add(1, [20], _vectors(1, seed=9))
+
+    assert not (tmp_path / "kb_1_log_ids.i64").exists()
+    assert len(np.load(tmp_path / "kb_1_ids.npy")) == 21
+
+
+def test_torn_append_is_truncated_on_load(tmp_path):
+    store = NumpyVectorStore(str(tmp_path))
+    store.add(1, list(range(10)), _vectors(10, seed=10))
+    store.add(1, [10, 11], _vectors(2, seed=11))
+    # 模拟写完向量、未写 ID 时中断
+    with open(tmp_path / "kb_1_log.f32", "ab") as f:
+        f.write(_vectors(1, seed=12).tobytes())
+
+    reloaded = NumpyVectorStore(str(tmp_path))
+    assert reloaded.count(1) == 12
+    reloaded.add(1, [12], _vectors(1, seed=13))
+    assert NumpyVectorStore(str(tmp_path)).count(1) == 13
+
+
+def test_ivf_trains_with_fewer_vectors_than_default_nlist(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "IVF_MIN_TRAIN_SIZE", 5)
+    store = NumpyVectorStore(str(tmp_path))
+    vectors = _vectors(8, seed=14)
+    store.add(1, list(range(8)), vectors)
+
+    assert store.build_ivf(1)
+    [hits] = store.search_batch(1, [vectors[2]], top_k=1, index_type=INDEX_IVF, nprobe=16)
+    assert hits[0][0] == 2
@@ -0,0 +1,80 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.user import MembershipType
+from app.models.video import VideoGenerationStatus, VideoGenerationTask
+from app.services.video_jobs import LeaseLostError, _cancel_job, _finish, _heartbeat, claim_jobs
+
+
+def _queue_tasks(db, user, count):
+    tasks = [VideoGenerationTask(user_id=user.id, prompt="p", virtual_start=0.0) for _ in range(count)]
+    db.add_all(tasks)
+    db.commit()
+    return tasks
+
+
+def test_workers_claim_disjoint_jobs(db, make_user):
+    user = make_user(membership_type=MembershipType.PROFESSIONAL)
+    _queue_tasks(db, user, 4)
+
+    first = claim_jobs("worker-a", 2)
+    second = claim_jobs("worker-b", 5)
+
+    assert len(first) == 2
+    assert len(second) == 2
+    assert not {task_id for task_id, _ in first} & {task_id for task_id, _ in second}
+
+
+def test_expired_lease_is_taken_over(db, make_user):
+    user = make_user()
+    [task] = _queue_tasks(db, user, 1)
+    assert claim_jobs("worker-a", 1) == [(task.id, user.id)]
+    assert claim_jobs("worker-b", 1) == []
+
+    task.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+
+    assert claim_jobs("worker-b", 1) == [(task.id, user.id)]
+    db.refresh(task)
+    assert task.locked_by == "worker-b"
+    assert task.attempts == 2
+    # 原 worker 已失去租约，不能再续约或写入结果
+    with pytest.raises(LeaseLostError):
+        _heartbeat(task.id, "worker-a")
+    with pytest.raises(LeaseLostError):
+        _finish(task.id, "worker-a", {VideoGenerationTask.status: VideoGenerationStatus.COMPLETED.value})
+
+
+def test_finish_releases_the_lease(db, make_user):
+    user = make_user()
+    [task] = _queue_tasks(db, user, 1)
+    claim_jobs("worker-a", 1)
+
+    _finish(task.id, "worker-a", {VideoGenerationTask.status: VideoGenerationStatus.COMPLETED.value})
+
+    db.refresh(task)
+    assert task.status == VideoGenerationStatus.COMPLETED.value
+    assert task.locked_by is None
+    assert task.lease_expires_at is None
+
+
+@pytest.mark.anyio
+async def test_cancel_job_waits_for_cleanup():
+    cleaned_up = False
+
+    async def submit():
+        nonlocal cleaned_up
+        try:
+            await asyncio.sleep(10)
+        finally:
+            await asyncio.sleep(0)
+            cleaned_up = True
+
+    job = asyncio.create_task(submit())
+    await asyncio.sleep(0)
+    await _cancel_job(job)
+
+    assert job.cancelled()
+    assert cleaned_up
@@ -0,0 +1,51 @@
+import pytest
+
+from app.core.config import settings
+from app.services.video_poller import VideoPoller
+
+
+@pytest.mark.parametrize("max_qps, heartbeat, batch, expected", [
+    (0, 15, 100, 100),
+    (2, 15, 100, 30),
+    (20, 15, 100, 100),
+    (0.01, 15, 100, 1),
+])
+def test_round_limit_keeps_lease_renewal_on_time(monkeypatch, max_qps, heartbeat, batch, expected):
+    monkeypatch.setattr(settings, "WANXIANG_MAX_QPS", max_qps)
+    monkeypatch.setattr(settings, "VIDEO_JOB_HEARTBEAT_SECONDS", heartbeat)
+    monkeypatch.setattr(settings, "VIDEO_POLL_BATCH_SIZE", batch)
+
+    assert VideoPoller.round_limit() == expected
+
+
+def _completed_segments(db, user, count=2):
+    from app.models.video import VideoGenerationStatus, VideoGenerationTask, VideoSegment
+
+    task = VideoGenerationTask(user_id=user.id, prompt="p", segment_count=count)
+    db.add(task)
+    db.flush()
+    for i in range(count):
+        db.add(VideoSegment(
+            task_id=task.id, segment_index=i, prompt="p", duration=10,
+            status=VideoGenerationStatus.COMPLETED.value, video_url=f"https://cdn.example.com/{i}.mp4",
+        ))
+    db.commit()
+    return task
+
+
+@pytest.mark.parametrize("mirror_enabled, ffmpeg, expected", [
+    (True, "sh", "playlist.m3u8"),
+    (False, "sh", "segments/0/file"),
+    (True, "definitely-not-ffmpeg", "segments/0/file"),
+])
+def test_long_video_url_falls_back_to_segment_files(db, make_user, monkeypatch, mirror_enabled, ffmpeg, expected):
+    from app.models.video import VideoGenerationTask
+    from app.services.video_poller import _segmented_task_values
+
+    monkeypatch.setattr(settings, "VIDEO_MIRROR_ENABLED", mirror_enabled)
+    monkeypatch.setattr(settings, "FFMPEG_PATH", ffmpeg)
+    task = _completed_segments(db, make_user())
+
+    values = _segmented_task_values(db, task.id)
+
+    assert values[VideoGenerationTask.video_url].endswith(f"/video/tasks/{task.id}/{expected}")
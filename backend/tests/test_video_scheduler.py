@@ -0,0 +1,77 @@
+from app.models.user import MembershipType
+from app.models.video import VideoGenerationStatus, VideoGenerationTask
+from app.services.video_jobs import claim_jobs
+from app.services.video_scheduler import assign_virtual_tags, backfill_virtual_tags, queue_estimates
+
+
+def _create_task(db, user, segment_count=None) -> VideoGenerationTask:
+    """按创建接口的方式写入任务：分配标签与写入在同一事务中"""
+    task = VideoGenerationTask(user_id=user.id, prompt="p", segment_count=segment_count)
+    assign_virtual_tags(db, task, user.membership_type)
+    db.add(task)
+    db.commit()
+    return task
+
+
+def test_heavy_user_does_not_delay_other_users(db, make_user):
+    heavy = make_user()
+    light = make_user()
+    heavy_tasks = [_create_task(db, heavy) for _ in range(3)]
+    light_task = _create_task(db, light)
+
+    positions = {task_id: position for task_id, (position, _) in queue_estimates(db, heavy_tasks + [light_task]).items()}
+
+    assert positions[heavy_tasks[0].id] == 1
+    assert positions[light_task.id] == 2
+    assert [positions[task.id] for task in heavy_tasks[1:]] == [3, 4]
+
+
+def test_weight_follows_membership(db, make_user):
+    free = make_user(membership_type=MembershipType.FREE)
+    pro = make_user(membership_type=MembershipType.PROFESSIONAL)
+    free_task = _create_task(db, free, segment_count=4)
+    pro_task = _create_task(db, pro, segment_count=4)
+
+    assert free_task.virtual_finish - free_task.virtual_start == 4
+    assert pro_task.virtual_finish - pro_task.virtual_start == 1
+
+
+def test_estimates_skip_tasks_that_are_not_queued(db, make_user):
+    user = make_user()
+    task = _create_task(db, user)
+    task.status = VideoGenerationStatus.PROCESSING.value
+    db.commit()
+
+    assert queue_estimates(db, [task]) == {}
+
+
+def test_claim_respects_tier_concurrency(db, make_user):
+    free = make_user(membership_type=MembershipType.FREE)
+    standard = make_user(membership_type=MembershipType.STANDARD)
+    for _ in range(3):
+        _create_task(db, free)
+        _create_task(db, standard)
+
+    claimed = claim_jobs("worker-a", 10)
+
+    users = [user_id for _, user_id in claimed]
+    assert users.count(free.id) == 1
+    assert users.count(standard.id) == 3
+    # 已达上限的用户不会被其他 worker 继续领取
+    assert claim_jobs("worker-b", 10) == []
+
+
+def test_backfill_puts_untagged_tasks_first(db, make_user):
+    user = make_user()
+    # 加权公平排队之前创建的任务没有标签
+    legacy = VideoGenerationTask(user_id=user.id, prompt="p", segment_count=3)
+    db.add(legacy)
+    db.commit()
+    tagged = [_create_task(db, make_user()) for _ in range(2)]
+
+    assert backfill_virtual_tags() == 1
+    db.expire_all()
+
+    assert (legacy.virtual_start, legacy.virtual_finish) == (0.0, 3.0)
+    positions = queue_estimates(db, [legacy] + tagged)
+    assert positions[legacy.id][0] == 1
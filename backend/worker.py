@@ -0,0 +1,43 @@
+"""
+视频任务 worker 入口
+与 API 分开部署时使用（API 进程设置 VIDEO_WORKER_IN_PROCESS=false），可按任务量独立扩容：
+    python worker.py
+"""
+import asyncio
+import signal
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.database import init_db
+from app.services.http_clients import start_http_clients, close_http_clients
+from app.services.video_jobs import VideoWorker, recover_video_tasks
+
+
+async def main() -> None:
+    init_db()
+    await start_http_clients()
+
+    worker = VideoWorker()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # 接管上次中断的任务（已提交到上游的继续等待，未提交的重新排队）；
+    # 恢复失败时照常启动，未恢复的任务在租约到期后被重新领取
+    try:
+        await recover_video_tasks(worker)
+    except Exception as e:
+        logger.error(f"恢复视频任务失败: {e}")
+    worker.start()
+    logger.info(f"{settings.APP_NAME} 视频任务 worker 运行中，Ctrl+C 退出")
+    await stop.wait()
+
+    # 停止时释放租约，未完成的任务由其他 worker 立即接手
+    await worker.stop()
+    await close_http_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())